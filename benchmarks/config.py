@@ -0,0 +1,51 @@
+"""Benchmarks of loading the RADS configuration.
+
+These use the ``conf/rads.xml`` file of the RADS dataroot and are skipped if
+no dataroot can be found, see :func:`rads.config.loader.get_dataroot`.
+"""
+from rads.config.grammar import pre_config_grammar, satellite_grammar
+from rads.config.loader import _load_ast, get_dataroot, load_config
+from rads.exceptions import InvalidDataroot
+from rads.paths import rads_xml
+
+GRAMMARS = {"pre_config": pre_config_grammar, "satellite": satellite_grammar}
+
+
+def _dataroot() -> str:
+    try:
+        dataroot = get_dataroot(require=True)
+    except InvalidDataroot:
+        raise NotImplementedError("no RADS dataroot")  # skips the benchmark
+    return str(dataroot)
+
+
+class Parse:
+    """Parse the upstream rads.xml file with each grammar."""
+
+    params = list(GRAMMARS)
+    param_names = ["grammar"]
+
+    def setup(self, name: str) -> None:
+        self.path = rads_xml(_dataroot())
+        self.grammar = GRAMMARS[name]()
+
+    def time_parse(self, name: str) -> None:
+        _load_ast(self.path, self.grammar)
+
+
+class LoadConfig:
+    """Load the configuration from the RADS dataroot, without the cache."""
+
+    def setup(self) -> None:
+        self.dataroot = _dataroot()
+
+    def time_load_config(self) -> None:
+        load_config(dataroot=self.dataroot, cache=False)
+
+    def time_load_config_all_satellites(self) -> None:
+        config = load_config(dataroot=self.dataroot, cache=False)
+        self.satellites = dict(config.satellites)
+
+    def peakmem_load_config_all_satellites(self) -> None:
+        config = load_config(dataroot=self.dataroot, cache=False)
+        self.satellites = dict(config.satellites)
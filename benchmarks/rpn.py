@@ -0,0 +1,132 @@
+"""Benchmarks of the RPN calculator.
+
+Each benchmark is timed (``time_*``) and its peak memory measured
+(``peakmem_*``) by airspeed velocity, see ``asv.conf.json``.
+"""
+from typing import Any, Dict, List
+
+import numpy as np  # type: ignore
+
+from rads.rpn import _KEYWORDS, CompleteExpression, Operator
+from rads.typing import FloatOrArray
+
+OPERATORS = sorted(k for k, v in _KEYWORDS.items() if isinstance(v, Operator))
+
+SHAPES: Dict[str, Any] = {
+    "scalar": None,
+    "1e3": (1000,),
+    "1e6": (1000000,),
+    "2d": (1000, 1000),
+}
+
+# representative expressions from the RADS configuration
+EXPRESSIONS = {
+    "sla": (
+        "alt range SUB dry_tropo SUB wet_tropo SUB iono SUB ssb SUB "
+        "inv_bar SUB tide_solid SUB tide_ocean SUB tide_load SUB "
+        "tide_pole SUB mss SUB"
+    ),
+    "sla_edited": (
+        "alt range SUB mss SUB DUP -2 2 INRANGE 0 NAN MUL "
+        "swh 0 11 INRANGE 0 NAN MUL flags 4 BTEST 1 NAN MUL"
+    ),
+    "geocentric_lat": "lat TAND 0.993305615 MUL ATAND",
+    "range_rate": "alt time DXDY",
+    "wind_speed": "sig0 10 SUB 0.5 MUL EXP 0.1 MAX LOG 1.5 MUL 2 ADD",
+    "time": "time YMDHMS",
+    "smoothed_sla": "alt range SUB mss SUB 0 7 BOXCAR",
+    "iono_smoothed": "iono DUP ISNAN EXCH 0 5 GAUSS AND",
+}
+
+
+def _values(names: str, shape: Any, seed: int = 0) -> List[FloatOrArray]:
+    """Create arguments, "x" in (0.1, 0.9), "z" in (1.5, 1.9), "i" integers."""
+    rng = np.random.default_rng(seed)
+    values: List[FloatOrArray] = []
+    for name in names.split():
+        if name == "x":
+            values.append(rng.uniform(0.1, 0.9, shape))
+        elif name == "z":
+            values.append(rng.uniform(1.5, 1.9, shape))
+        elif name == "i":
+            values.append(rng.integers(0, 2 ** 16, shape))
+        else:
+            values.append(float(name) if "." in name else int(name))
+    return values
+
+
+def _arguments(name: str, shape: Any) -> List[FloatOrArray]:
+    """Arguments in the domain of an operator."""
+    operator = _KEYWORDS[name]
+    if name in ("IAND", "IOR"):
+        return _values("i i", shape)
+    if name == "BTEST":
+        return _values("i 3", shape)
+    if name in ("BOXCAR", "GAUSS"):
+        return _values("x 0 3", shape)
+    if name == "ACOSH":
+        return _values("z", shape)
+    return _values(" ".join(["x"] * operator.pops), shape)
+
+
+class Operators:
+    """Call each operator on arguments of different sizes."""
+
+    params = (OPERATORS, list(SHAPES))
+    param_names = ["operator", "shape"]
+
+    def setup(self, name: str, shape: str) -> None:
+        if name in ("BOXCAR", "GAUSS", "DXDY") and SHAPES[shape] is None:
+            raise NotImplementedError("filters require arrays")
+        self.operator = _KEYWORDS[name]
+        self.args = _arguments(name, SHAPES[shape])
+
+    def time_call(self, name: str, shape: str) -> None:
+        self.operator(list(self.args), {})
+
+    def peakmem_call(self, name: str, shape: str) -> None:
+        self.operator(list(self.args), {})
+
+
+class Expressions:
+    """Evaluate expressions in different ways on 1e6 elements."""
+
+    params = (list(EXPRESSIONS), ["eval", "inplace", "compiled", "chunked"])
+    param_names = ["expression", "method"]
+
+    def setup(self, name: str, method: str) -> None:
+        self.expression = CompleteExpression(EXPRESSIONS[name])
+        self.environment: Dict[str, FloatOrArray] = {}
+        for i, variable in enumerate(sorted(self.expression.variables)):
+            values = _values("x", SHAPES["1e6"], seed=i)[0] * 100
+            if variable == "flags":
+                values = _values("i", SHAPES["1e6"], seed=i)[0]
+            elif variable == "time":
+                values = np.linspace(0, 1e9, 1000000)
+            self.environment[variable] = values
+        if method == "compiled":
+            self.function = self.expression.compile()
+
+    def time_eval(self, name: str, method: str) -> None:
+        self._eval(method)
+
+    def peakmem_eval(self, name: str, method: str) -> None:
+        self._eval(method)
+
+    def _eval(self, method: str) -> None:
+        if method == "eval":
+            self.expression.eval(self.environment)
+        elif method == "inplace":
+            self.expression.eval(self.environment, inplace=True)
+        elif method == "compiled":
+            self.function(self.environment)
+        else:
+            self.expression.eval_chunked(self.environment)
+
+
+class Parse:
+    """Parse and check expressions, parsed strings are cached."""
+
+    def time_parse(self) -> None:
+        for string in EXPRESSIONS.values():
+            CompleteExpression(string)
@@ -10,12 +10,15 @@ from typing import (
     Callable,
     Collection,
     Container,
+    Dict,
+    Iterable,
     Iterator,
     List,
     Mapping,
     MutableMapping,
     Optional,
     Sequence,
+    Set,
     TypeVar,
     Union,
     cast,
@@ -58,6 +61,7 @@ __all__ = [
     "SatelliteID",
     "Satellites",
     "Variable",
+    "partition_satellites",
 ]
 
 ActionType = Callable[[Any, str, Any], None]
@@ -71,6 +75,27 @@ def _get_or_init(environment: Any, attr: str, mapping: Callable[[], T]) -> T:
     return cast(T, _get(environment, attr))
 
 
+def _intersection(
+    first: Optional[Set[str]], second: Optional[Set[str]]
+) -> Optional[Set[str]]:
+    # intersection of satellite sets where None is all satellites
+    if first is None:
+        return second
+    if second is None:
+        return first
+    return first & second
+
+
+def _union(sets: Iterable[Optional[Set[str]]]) -> Optional[Set[str]]:
+    # union of satellite sets where None is all satellites
+    result: Set[str] = set()
+    for set_ in sets:
+        if set_ is None:
+            return None
+        result |= set_
+    return result
+
+
 def _suggest_field(dataclass: Any, attempt: str) -> Optional[str]:
     matches = get_close_matches(attempt, [f.name for f in fields(dataclass)], 1, 0.1)
     if matches:
@@ -366,6 +391,19 @@ class Condition(ABC):
             True if the condition is a match, otherwise False.
         """
 
+    def match_satellites(self, satellites: Collection[str]) -> Optional[Set[str]]:
+        """Determine the satellites the condition is a match for.
+
+        :param satellites:
+            2 character ID's of the satellites to test, each with the
+            selectors ``{"id": satellite}``.
+
+        :return:
+            The subset of `satellites` that the condition is a match for, or
+            None if it is a match for any satellite.
+        """
+        return {s for s in satellites if self.test({"id": s})}
+
 
 class TrueCondition(Condition):
     """Condition that is always true."""
@@ -373,6 +411,10 @@ class TrueCondition(Condition):
     def test(self, selectors: Mapping[str, Any]) -> bool:  # noqa: D102
         return True
 
+    def match_satellites(self, satellites: Collection[str]) -> Optional[Set[str]]:
+        """Match all satellites."""
+        return None
+
 
 class FalseCondition(Condition):
     """Condition that is always false."""
@@ -380,6 +422,10 @@ class FalseCondition(Condition):
     def test(self, selectors: Mapping[str, Any]) -> bool:  # noqa: D102
         return False
 
+    def match_satellites(self, satellites: Collection[str]) -> Optional[Set[str]]:
+        """Match no satellites."""
+        return set()
+
 
 class SatelliteCondition(Condition):
     """Condition that matches based on the satellite `id`.
@@ -485,6 +531,22 @@ class Statement(ABC):
             of the configuration file.
         """
 
+    def match_satellites(self, satellites: Collection[str]) -> Optional[Set[str]]:
+        """Determine the satellites the statement can modify the environment of.
+
+        This is used by :func:`partition_satellites` to skip statements that
+        do nothing for a satellite.
+
+        :param satellites:
+            2 character ID's of the satellites to test, each with the
+            selectors ``{"id": satellite}``.
+
+        :return:
+            The subset of `satellites` for which evaluating the statement can
+            modify the environment, or None if it can for any satellite.
+        """
+        return None
+
 
 class NullStatement(Statement):
     """A null statement that does nothing when evaluated."""
@@ -500,6 +562,10 @@ class NullStatement(Statement):
             of the configuration file.
         """
 
+    def match_satellites(self, satellites: Collection[str]) -> Optional[Set[str]]:
+        """Match no satellites, as the statement does nothing."""
+        return set()
+
 
 class CompoundStatement(Sequence[Statement], Statement):
     """A sequence of statements."""
@@ -553,6 +619,10 @@ class CompoundStatement(Sequence[Statement], Statement):
         for statement in self:
             statement.eval(environment, selectors)
 
+    def match_satellites(self, satellites: Collection[str]) -> Optional[Set[str]]:
+        """Match the satellites any of the contained statements match."""
+        return _union(s.match_satellites(satellites) for s in self)
+
 
 class If(Statement):
     """If/else statement AST node."""
@@ -619,6 +689,17 @@ class If(Statement):
         elif self.false_statement is not None:
             self.false_statement.eval(environment, selectors)
 
+    def match_satellites(self, satellites: Collection[str]) -> Optional[Set[str]]:
+        """Match the satellites whose branch taken matches them."""
+        matched = self.condition.match_satellites(satellites)
+        true = _intersection(matched, self.true_statement.match_satellites(satellites))
+        if self.false_statement is None or matched is None:
+            return true
+        false = _intersection(
+            set(satellites) - matched, self.false_statement.match_satellites(satellites)
+        )
+        return _union([true, false])
+
 
 class Assignment(Statement):
     """Assignment statement (value to variable) AST node."""
@@ -715,6 +796,10 @@ class Assignment(Statement):
             except (TypeError, ValueError, KeyError) as err:
                 raise ASTEvaluationError(str(err), source=self.source)
 
+    def match_satellites(self, satellites: Collection[str]) -> Optional[Set[str]]:
+        """Match the satellites the :attr:`condition` matches."""
+        return self.condition.match_satellites(satellites)
+
 
 class Alias(Statement):
     """Variable alias statement."""
@@ -807,6 +892,10 @@ class Alias(Statement):
             except (TypeError, ValueError, KeyError) as err:
                 raise ASTEvaluationError(str(err), source=self.source)
 
+    def match_satellites(self, satellites: Collection[str]) -> Optional[Set[str]]:
+        """Match the satellites the :attr:`condition` matches."""
+        return self.condition.match_satellites(satellites)
+
 
 class SatelliteID(Statement):
     """Satellite ID statement."""
@@ -865,6 +954,10 @@ class SatelliteID(Statement):
             environment.id3 = self.id3
             environment.names = self.names
 
+    def match_satellites(self, satellites: Collection[str]) -> Optional[Set[str]]:
+        """Match the satellite with the :attr:`id` of this statement."""
+        return {self.id} if self.id in satellites else set()
+
 
 class Satellites(Mapping[str, Statement], Statement):
     """A collection of :class:`SatelliteID` statements.
@@ -916,6 +1009,10 @@ class Satellites(Mapping[str, Statement], Statement):
         except KeyError:
             pass
 
+    def match_satellites(self, satellites: Collection[str]) -> Optional[Set[str]]:
+        """Match the satellites in this collection."""
+        return {s for s in satellites if s in self}
+
 
 class Block(Statement, ABC):
     """Abstract block statement.
@@ -1002,6 +1099,11 @@ class Block(Statement, ABC):
         self.inner_statement.eval(builder, selectors)
         self._update_or_store(environment, builder)
 
+    def match_satellites(self, satellites: Collection[str]) -> Optional[Set[str]]:
+        """Match the satellites the :attr:`condition` matches."""
+        # the block is stored even if the inner statement does nothing
+        return self.condition.match_satellites(satellites)
+
 
 class Phase(Block):
     """Phase statement, for all phase related information."""
@@ -1025,3 +1127,41 @@ class Variable(Block):
             update(mapping[builder.id], builder)
         except KeyError:
             mapping[builder.id] = self._build(builder)
+
+
+def partition_satellites(
+    statement: Statement, satellites: Collection[str]
+) -> Dict[str, Statement]:
+    r"""Split a statement into the statements that apply to each satellite.
+
+    Evaluating the statement for each satellite (with the selectors
+    ``{"id": satellite}``) evaluates every statement in it, even though most
+    of them have conditions that are only true for a few satellites.  Instead
+    the partition of a satellite can be evaluated, which gives identical
+    results but only contains the statements that can modify the environment
+    of the satellite, including all unconditional statements.
+
+    :param statement:
+        Statement to split.  Nested :class:`CompoundStatement`\ s are
+        flattened, any other statement is kept whole.
+    :param satellites:
+        2 character ID's of the satellites to split the statement for.
+
+    :return:
+        Mapping from the 2 character ID of each satellite to the statements
+        that apply to it, in their original order.
+    """
+    partitions: Dict[str, List[Statement]] = {sat: [] for sat in satellites}
+    for statement_ in _flatten(statement):
+        matched = statement_.match_satellites(satellites)
+        for sat in partitions if matched is None else matched:
+            partitions[sat].append(statement_)
+    return {sat: CompoundStatement(*s) for sat, s in partitions.items()}
+
+
+def _flatten(statement: Statement) -> Iterator[Statement]:
+    if isinstance(statement, CompoundStatement):
+        for statement_ in statement:
+            yield from _flatten(statement_)
+    else:
+        yield statement
@@ -1,27 +1,54 @@
 """PyRADS XML file loader functions."""
+import hashlib
 import os
+import pickle
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from functools import wraps
 from pathlib import Path
-from typing import IO, Any, Callable, Dict, Iterable, Mapping, Optional, TypeVar, cast
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    cast,
+)
 
 from dataclass_builder import MissingFieldError
 
+from ..__version__ import __version__
 from ..exceptions import ConfigError, InvalidDataroot
+from ..logging import log
 from ..paths import (
     local_config,
     local_xml,
     rads_xml,
     site_config,
+    user_cache,
     user_config,
     user_xml,
 )
 from ..typing import PathLike, PathLikeOrFile, PathOrFile
 from ..utility import isio
 from ..xml import ParseError, parse, rads_fixer
-from .ast import ASTEvaluationError, NullStatement, Statement
+from .ast import (
+    ASTEvaluationError,
+    NullStatement,
+    Statement,
+    partition_satellites,
+)
 from .builders import PreConfigBuilder, SatelliteBuilder
 from .grammar import dataroot_grammar, pre_config_grammar, satellite_grammar
-from .tree import Config, PreConfig
+from .tree import Config, PreConfig, Satellite
 from .xml_parsers import Parser, TerminalXMLParseError
 
 __all__ = ["config_files", "get_dataroot", "load_config", "xml_loader"]
@@ -36,6 +63,9 @@ __all__ = ["config_files", "get_dataroot", "load_config", "xml_loader"]
 # for incomplete configurations.
 _BLACKLISTED_SATELLITES = ["g3", "ss"]
 
+# pickle protocol of the configuration cache, see load_config
+_CACHE_PROTOCOL = 4
+
 
 def _to_config_error(exc: Exception) -> ConfigError:
     """Convert an exception into a :class:`rads.config.loader.ConfigError`.
@@ -218,9 +248,18 @@ def load_config(
     dataroot: Optional[PathLike] = None,
     xml_files: Optional[Iterable[PathLikeOrFile]] = None,
     satellites: Optional[Iterable[str]] = None,
+    cache: bool = True,
+    workers: Optional[int] = None,
 ) -> Config:
     """Load the PyRADS configuration from one or more XML files.
 
+    The XML files are parsed immediately, but the configuration of each
+    satellite in :attr:`rads.config.tree.Config.satellites` is only evaluated
+    the first time it is accessed (unless `workers` is given).  Therefore,
+    errors in the configuration of a satellite are raised (as
+    :class:`rads.config.loader.ConfigError`) when it is first accessed instead
+    of by this function.
+
     :param dataroot:
         Optionally set the RADS *dataroot*.  If not given :func:`get_dataroot`
         will be used.  If `xml_files` were given they will be passed to the
@@ -233,6 +272,23 @@ def load_config(
         Optionally specify which satellites to load the configuration for by
         their 2 character id strings.  The default is to load the configuration
         for all non-blacklisted satellites.
+    :param cache:
+        Set to False to always load the configuration from the XML files.
+
+        By default the loaded configuration is stored in the user cache
+        directory (see :func:`rads.paths.user_cache`) and loaded from there
+        by later calls with the same arguments, which is much faster than
+        parsing the XML files.  The cached configuration is only used if the
+        version of PyRADS and the path, size, modification time and contents
+        of each configuration file (including whether it exists) are
+        unchanged.  The cache is not used if any of the `xml_files` are file
+        objects.
+    :param workers:
+        Set to evaluate the configuration of every satellite immediately,
+        using a pool of this many worker processes.  The result is identical
+        to accessing each satellite in turn, including which error is raised
+        if any satellite has an error.  This is useful when the full
+        configuration is needed, such as for validating the configuration.
 
     :return:
         The resulting PyRADS configuration object.
@@ -240,39 +296,302 @@ def load_config(
     :raises RuntimeError:
         If the *dataroot* cannot be found or the given/configured *dataroot* is
         not a valid RADS *dataroot*.
+    :raises ValueError:
+        If `workers` is less than 1.
     :raises rads.config.loader.ConfigError:
-        If there is any problem loading the configuration files.
+        If there is any problem loading or parsing the configuration files.
 
     .. seealso::
 
         :class:`rads.config.tree.Config`
             PyRADS configuration object.
     """
+    if workers is not None and workers < 1:
+        raise ValueError("'workers' must be at least 1")
+    if xml_files is not None:
+        xml_files = list(xml_files)
+    if satellites is not None:
+        satellites = list(satellites)
+    key = _cache_key(dataroot, xml_files, satellites) if cache else None
+    config = None if key is None else _read_cache(*key)
+    if config is None:
+        config = _load_config(
+            dataroot=dataroot, xml_files=xml_files, satellites=satellites
+        )
+        if workers is not None:
+            _build_satellites(config, workers)
+        if key is not None:
+            _write_cache(*key, config)
+    elif workers is not None:
+        _build_satellites(config, workers)
+    return config
+
+
+def _load_config(
+    *,
+    dataroot: Optional[PathLike] = None,
+    xml_files: Optional[Iterable[PathLikeOrFile]] = None,
+    satellites: Optional[Iterable[str]] = None,
+) -> Config:
+    """Load the PyRADS configuration from the XML files, without caching.
+
+    See :func:`load_config` for argument documentation.
+    """
     # load pre-config
     pre_config = _load_preconfig(
         dataroot=dataroot, xml_files=xml_files, satellites=satellites
     )
 
-    # initialize configuration object and satellite configuration builders
-    builders: Mapping[str, Any] = {
-        sat: SatelliteBuilder()
-        for sat in pre_config.satellites
-        if sat not in pre_config.blacklist
-    }
-
-    # parse and evaluate each configuration file
+    # parse each configuration file, evaluation is deferred until a satellite
+    # is first accessed
+    satellites = [
+        sat for sat in pre_config.satellites if sat not in pre_config.blacklist
+    ]
+    statements: Dict[str, List[Statement]] = {sat: [] for sat in satellites}
     for file in pre_config.config_files:
-        builders = _load_satellites(file, builders)
+        for sat, statement in _load_satellites(file, satellites).items():
+            statements[sat].append(statement)
+
+    return Config(pre_config, _LazySatellites(statements))
 
-    # build each satellite configuration object
-    satellites = {}
-    for sat, builder in builders.items():
+
+class _LazySatellites(Mapping[str, Satellite]):
+    """Satellite descriptors that are only evaluated when first accessed.
+
+    Each satellite descriptor is evaluated from the statements of each
+    configuration file that apply to it, and built, the first time it is
+    looked up.  Any error in doing so is raised as a :class:`ConfigError` at
+    that time.
+
+    .. note::
+
+        Membership tests and iteration never evaluate a satellite.  Each
+        satellite is evaluated only once, even if it is first accessed from
+        multiple threads at the same time.
+    """
+
+    def __init__(self, statements: Mapping[str, Sequence[Statement]]):
+        """
+        :param statements:
+            Mapping from 2 character satellite ID's to the statements to
+            evaluate for the satellite, one for each configuration file.
+        """
+        self._satellites = list(statements)
+        self._statements = dict(statements)
+        self._cache: Dict[str, Satellite] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, key: str) -> Satellite:
         try:
-            satellites[sat] = builder.build()
-        except MissingFieldError as err:
-            raise _to_config_error(err) from err
+            return self._cache[key]
+        except KeyError:
+            pass
+        with self._lock:
+            # another thread may have evaluated it while waiting for the lock
+            try:
+                return self._cache[key]
+            except KeyError:
+                pass
+            satellite = _build_satellite(key, self._statements[key])
+            self._store(key, satellite)
+        return satellite
+
+    def _store(self, key: str, satellite: Satellite) -> None:
+        # must be called with the lock held
+        self._cache[key] = satellite
+        del self._statements[key]  # no longer needed
+
+    def __getstate__(self) -> Dict[str, Any]:
+        with self._lock:
+            state = self.__dict__.copy()
+            state["_cache"] = dict(self._cache)
+            state["_statements"] = dict(self._statements)
+        del state["_lock"]  # locks can not be pickled
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def build(self, workers: int = 1) -> None:
+        """Evaluate all satellites that have not been accessed yet.
+
+        :param workers:
+            Number of worker processes to evaluate the satellites with.  If 1
+            they are evaluated in this process.
+
+        :raises rads.config.loader.ConfigError:
+            If there is an error in the configuration of any satellite.  This
+            is the same error that accessing the satellites in order raises.
+        """
+        pending = [sat for sat in self._satellites if sat not in self._cache]
+        if workers > 1 and len(pending) > 1:
+            statements = [self._statements[sat] for sat in pending]
+            with ProcessPoolExecutor(min(workers, len(pending))) as executor:
+                results = executor.map(_try_build_satellite, pending, statements)
+                for sat, satellite in zip(pending, results):
+                    with self._lock:
+                        if satellite is not None and sat not in self._cache:
+                            self._store(sat, satellite)
+        # evaluate the remaining satellites, raising the error of the first
+        for sat in pending:
+            self[sat]
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._cache or key in self._statements
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._satellites)
+
+    def __len__(self) -> int:
+        return len(self._satellites)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__qualname__}({self._satellites!r})"
+
+
+def _build_satellite(satellite: str, statements: Iterable[Statement]) -> Satellite:
+    """Evaluate and build the configuration of a satellite.
+
+    :param satellite:
+        2 character ID of the satellite.
+    :param statements:
+        Statements to evaluate for the satellite.
+
+    :return:
+        The satellite descriptor.
+
+    :raises rads.config.loader.ConfigError:
+        If there is an error in the configuration of the satellite.
+    """
+    builder = SatelliteBuilder()
+    try:
+        for statement in statements:
+            statement.eval(builder, {"id": satellite})
+        satellite_: Satellite = builder.build()
+    except (ASTEvaluationError, MissingFieldError) as err:
+        raise _to_config_error(err) from err
+    return satellite_
+
 
-    return Config(pre_config, satellites)
+def _try_build_satellite(
+    satellite: str, statements: Iterable[Statement]
+) -> Optional[Satellite]:
+    # run in worker processes, the error is not returned because the file and
+    # line of a ConfigError do not survive pickling, instead the satellite is
+    # evaluated again in the parent process to raise it
+    try:
+        return _build_satellite(satellite, statements)
+    except ConfigError:
+        return None
+
+
+def _build_satellites(config: Config, workers: int) -> None:
+    """Evaluate the configuration of all satellites not accessed yet.
+
+    :param config:
+        Configuration to evaluate the satellites of.
+    :param workers:
+        Number of worker processes to use.
+    """
+    if isinstance(config.satellites, _LazySatellites):
+        config.satellites.build(workers)
+
+
+def _cache_key(
+    dataroot: Optional[PathLike],
+    xml_files: Optional[Sequence[PathLikeOrFile]],
+    satellites: Optional[Sequence[str]],
+) -> Optional[Tuple[Path, bytes]]:
+    """Get the location and fingerprint of a cached configuration.
+
+    See :func:`load_config` for argument documentation.
+
+    :return:
+        The path of the cache file for the given arguments and the fingerprint
+        of the configuration files and PyRADS version, or None if the
+        configuration can not be cached.
+    """
+    dataroot_ = get_dataroot(dataroot, xml_files=xml_files, require=True)
+    files = config_files(dataroot_) if xml_files is None else xml_files
+    if any(isio(file) or isio(file, read=True) for file in files):
+        return None
+    paths = [Path(cast(PathLike, file)).absolute() for file in files]
+    arguments = repr((__version__, str(dataroot_), [str(p) for p in paths], satellites))
+    name = hashlib.sha256(arguments.encode()).hexdigest()[:32]
+    fingerprint = hashlib.sha256(arguments.encode())
+    for path in paths:
+        fingerprint.update(_file_fingerprint(path))
+    return user_cache() / f"config-{name}.pickle", fingerprint.digest()
+
+
+def _file_fingerprint(path: Path) -> bytes:
+    """Get the size, modification time and content hash of a file.
+
+    :param path:
+        Path of the file.
+
+    :return:
+        Fingerprint of the file, which is empty if the file does not exist.
+    """
+    try:
+        stat = path.stat()
+        content = hashlib.sha256(path.read_bytes()).digest()
+    except OSError:
+        return b""
+    return f"{stat.st_size}:{stat.st_mtime_ns}:".encode() + content
+
+
+def _read_cache(path: Path, fingerprint: bytes) -> Optional[Config]:
+    """Read a cached configuration.
+
+    :param path:
+        Path of the cache file.
+    :param fingerprint:
+        Fingerprint the cached configuration must have been stored with.
+
+    :return:
+        The cached configuration, or None if it does not exist, it can not be
+        read or the fingerprint is different.
+    """
+    try:
+        with path.open("rb") as file:
+            if pickle.load(file) != fingerprint:
+                return None
+            return cast(Config, pickle.load(file))
+    except FileNotFoundError:
+        return None
+    except Exception as err:  # corrupt or from an incompatible version
+        log.debug(f"ignoring configuration cache '{path}': {err}")
+        return None
+
+
+def _write_cache(path: Path, fingerprint: bytes, config: Config) -> None:
+    """Write a configuration to the cache.
+
+    The file is replaced atomically, so other processes reading the cache
+    see either the old or the new configuration.  Errors are logged and
+    otherwise ignored as the cache is optional.
+
+    :param path:
+        Path of the cache file.
+    :param fingerprint:
+        Fingerprint of the configuration, see :func:`_cache_key`.
+    :param config:
+        Configuration to cache.
+    """
+    temp: Optional[str] = None
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+        with os.fdopen(fd, "wb") as file:
+            pickle.dump(fingerprint, file, protocol=_CACHE_PROTOCOL)
+            pickle.dump(config, file, protocol=_CACHE_PROTOCOL)
+        os.replace(temp, path)
+    except Exception as err:
+        log.debug(f"unable to write configuration cache '{path}': {err}")
+        if temp is not None and os.path.exists(temp):
+            os.remove(temp)
 
 
 T = TypeVar("T")
@@ -395,7 +714,8 @@ def _load_preconfig2(ast: Statement, builder: T) -> T:
 
 
 @xml_loader(satellite_grammar())
-def _load_satellites(ast: Statement, builders: Mapping[str, T]) -> Mapping[str, T]:
-    for sat, builder in builders.items():
-        ast.eval(builder, {"id": sat})
-    return builders
+def _load_satellites(
+    ast: Statement, satellites: Sequence[str]
+) -> Mapping[str, Statement]:
+    # only the statements that apply to each satellite are evaluated for it
+    return partition_satellites(ast, satellites)
@@ -71,6 +71,8 @@ from typing import (
     Any,
     Callable,
     Collection,
+    Dict,
+    FrozenSet,
     List,
     MutableSequence,
     NoReturn,
@@ -253,6 +255,19 @@ class Parser(ABC):
             If the parser encounters an unrecoverable error.
         """
 
+    def _first_tags(self) -> Optional[FrozenSet[str]]:
+        """Get the tag names of the elements the parser can match at.
+
+        This is used by :class:`Alternate` to skip parsers that can not match
+        the element at the current position.
+
+        :return:
+            The tag names an element must have for the parser to match at it,
+            or None if the parser may match at (or raise a
+            :class:`TerminalXMLParseError` at) any element.
+        """
+        return None
+
     def __add__(self, other: "Parser") -> "Sequence":
         """Combine two parsers, matching the first followed by the second.
 
@@ -377,6 +392,9 @@ class Apply(Parser):
                 raise  # don't catch this exception
             raise XMLParseError(position.file, position.opening_line, str(err)) from err
 
+    def _first_tags(self) -> Optional[FrozenSet[str]]:
+        return self._parser._first_tags()
+
 
 class Lazy(Parser):
     """Delay construction of parser until evaluated.
@@ -395,12 +413,24 @@ class Lazy(Parser):
         """
         self._parser_func = parser_func
         self._parser: Optional[Parser] = None
+        self._visiting = False
 
     def __call__(self, position: Element) -> Tuple[Any, Element]:  # noqa: D102
         if self._parser is None:
             self._parser = self._parser_func()
         return self._parser(position)
 
+    def _first_tags(self) -> Optional[FrozenSet[str]]:
+        if self._visiting:  # recursive parser
+            return None
+        if self._parser is None:
+            self._parser = self._parser_func()
+        self._visiting = True
+        try:
+            return self._parser._first_tags()
+        finally:
+            self._visiting = False
+
 
 class Must(Parser):
     """Raise a XMLParseError to a TerminalXMLParseError ending parsing."""
@@ -437,6 +467,9 @@ class At(Parser):
         value, _ = self._parser(position)
         return value, position
 
+    def _first_tags(self) -> Optional[FrozenSet[str]]:
+        return self._parser._first_tags()
+
 
 class Not(Parser):
     """Invert a parser match, consuming nothing."""
@@ -526,6 +559,10 @@ class Sequence(_MultiParser):
             values.append(value)
         return values, position
 
+    def _first_tags(self) -> Optional[FrozenSet[str]]:
+        # the first parser must match for the sequence to match
+        return self._parsers[0]._first_tags() if self._parsers else None
+
     def __add__(self, other: Parser) -> "Sequence":
         """Combine this sequence and a parser, returning a new sequence.
 
@@ -569,6 +606,12 @@ class Alternate(_MultiParser):
     .. note::
 
         Consecutive Alternate's are automatically flattened.
+
+    .. note::
+
+        Parsers that can only match elements with particular tags (see
+        :class:`Tag`) are only tried for elements with one of those tags,
+        instead of trying every parser in turn.
     """
 
     def __init__(self, *parsers: Parser):
@@ -577,15 +620,46 @@ class Alternate(_MultiParser):
             Pool of parsers to find a match in.
         """
         super().__init__(Alternate, *parsers)
+        self._dispatch: Optional[Dict[str, List[Parser]]] = None
+        self._untagged: List[Parser] = []
 
     def __call__(self, position: Element) -> Tuple[Any, Element]:  # noqa: D102
-        for parser in self._parsers:
+        for parser in self._candidates(position):
             try:
                 return parser(position)
             except XMLParseError:
                 pass
         raise XMLParseError(position.file, position.opening_line)
 
+    def _candidates(self, position: Element) -> List[Parser]:
+        """Get the parsers that can match at the given position, in order."""
+        if self._dispatch is None:
+            self._build_dispatch()
+        try:
+            tag = position.tag
+        except XMLParseError:  # no element, let each parser fail
+            return self._parsers
+        return cast(Dict[str, List[Parser]], self._dispatch).get(tag, self._untagged)
+
+    def _build_dispatch(self) -> None:
+        first_tags = [parser._first_tags() for parser in self._parsers]
+        tags = set().union(*(t for t in first_tags if t is not None))
+        self._dispatch = {
+            tag: [p for p, t in zip(self._parsers, first_tags) if t is None or tag in t]
+            for tag in tags
+        }
+        self._untagged = [p for p, t in zip(self._parsers, first_tags) if t is None]
+
+    def _append(self, other: Parser) -> None:
+        super()._append(other)
+        self._dispatch = None
+
+    def _first_tags(self) -> Optional[FrozenSet[str]]:
+        first_tags = [parser._first_tags() for parser in self._parsers]
+        if None in first_tags:
+            return None
+        return frozenset().union(*cast(List[FrozenSet[str]], first_tags))
+
     def __or__(self, other: Parser) -> "Alternate":
         """Combine this alternate and a parser, returning a new alternate.
 
@@ -689,6 +763,9 @@ class Tag(Parser):
             return yzal.strict(position), next_element(position)
         raise XMLParseError(position.file, position.opening_line)
 
+    def _first_tags(self) -> Optional[FrozenSet[str]]:
+        return frozenset([self._name])
+
 
 def lazy(parser_func: Callable[[], Parser]) -> Parser:
     """Delays construction of parser until evaluated.
@@ -1,6 +1,6 @@
 """Additional utility for numpy.datetime64."""
 
-from typing import Tuple
+from typing import Any, Tuple, cast
 
 import numpy as np  # type: ignore
 
@@ -13,8 +13,16 @@ __all__ = [
     "second",
     "microsecond",
     "ymdhmsus",
+    "ymdhmsus_from_microseconds",
 ]
 
+# days from 0000-03-01 to 1970-01-01 in the proleptic Gregorian calendar
+_DAYS_TO_1970 = 719468
+
+_DAYS_PER_ERA = 146097  # the Gregorian calendar repeats every 400 years
+
+_MICROSECONDS_PER_DAY = 86400000000
+
 
 def year(datetime64: np.datetime64) -> np.generic:
     """Get year from NumPy datetime64 value/array.
@@ -125,14 +133,59 @@ def ymdhmsus(
         * Minute or array of minutes from `datetime64`.
         * Second or array of seconds from `datetime64`.
         * Microsecond or array of microseconds from `datetime64`.
+
+        Each component of a NaT (not a time) value is the smallest 64 bit
+        integer.
     """
-    # based on: https://stackoverflow.com/a/26895491
-    year = datetime64.astype("datetime64[Y]").astype(int) + 1970
-    month_ = datetime64.astype("datetime64[M]")
-    month = month_.astype(int) % 12 + 1
-    day = (datetime64.astype("datetime64[D]") - month_).astype(int) + 1
-    hour = datetime64.astype("datetime64[h]").astype(int) % 24
-    minute = datetime64.astype("datetime64[m]").astype(int) % 60
-    second = datetime64.astype("datetime64[s]").astype(int) % 60
-    microsecond = datetime64.astype("datetime64[us]").astype(int) % 1000000
+    datetime64 = datetime64.astype("datetime64[us]")
+    components = ymdhmsus_from_microseconds(datetime64.astype(np.int64))
+    isnat = np.isnat(datetime64)
+    if not np.any(isnat):
+        return components
+    nat = np.iinfo(np.int64).min
+    return cast(
+        Tuple[Any, Any, Any, Any, Any, Any, Any],
+        tuple(np.where(isnat, nat, c)[()] for c in components),
+    )
+
+
+def ymdhmsus_from_microseconds(
+    microseconds: Any,
+) -> Tuple[Any, Any, Any, Any, Any, Any, Any]:
+    """Get time components from microseconds since 1970-01-01 00:00:00.
+
+    This computes the components with integer arithmetic (civil from days,
+    see http://howardhinnant.github.io/date_algorithms.html) in a single pass
+    over the values, without converting to :class:`numpy.datetime64`.
+
+    :param microseconds:
+        Integer or array of integers giving the number of microseconds since
+        1970-01-01 00:00:00 (the epoch of :class:`numpy.datetime64`), may be
+        negative.
+
+    :return:
+        A tuple with the year, month, day of month, hour, minute, second and
+        microsecond (each an integer or array of integers), see
+        :func:`ymdhmsus`.
+    """
+    days, microseconds = divmod(microseconds, _MICROSECONDS_PER_DAY)
+    seconds, microsecond = divmod(microseconds, 1000000)
+    minutes, second = divmod(seconds, 60)
+    hour, minute = divmod(minutes, 60)
+    # day of the 400 year era starting on 0000-03-01 (or a multiple of 400)
+    era, day_of_era = divmod(days + _DAYS_TO_1970, _DAYS_PER_ERA)
+    year_of_era = (
+        day_of_era
+        - day_of_era // 1460
+        + day_of_era // 36524
+        - day_of_era // (_DAYS_PER_ERA - 1)
+    ) // 365
+    day_of_year = day_of_era - (
+        365 * year_of_era + year_of_era // 4 - year_of_era // 100
+    )
+    # month starting from March
+    month_ = (5 * day_of_year + 2) // 153
+    day = day_of_year - (153 * month_ + 2) // 5 + 1
+    month = (month_ + 2) % 12 + 1
+    year = year_of_era + era * 400 + (month_ >= 10)
     return year, month, day, hour, minute, second, microsecond
@@ -120,3 +120,24 @@ def local_config() -> Path:
         Path to the local RADS configuration file.
     """
     return Path("pyrads.xml")
+
+
+# Cache paths
+################################################################################
+
+
+def user_cache() -> Path:
+    r"""Path to the PyRADS user cache directory.
+
+    ================  ==============================================
+    Operating System  Path
+    ================  ==============================================
+    Mac OS X          ~/Library/Caches/pyrads
+    Unix              ~/.cache/pyrads
+    Windows           C:\Users\<username>\AppData\Local\pyrads\Cache
+    ================  ==============================================
+
+    :return:
+        Path to the PyRADS user cache directory.
+    """
+    return Path(_APPDIRS.user_cache_dir)
@@ -10,16 +10,30 @@ Classes
 -------
 
 * :class:`Expression`
+* :class:`CompleteExpression`
+* :class:`ExpressionGraph`
+* :class:`CostEstimate`
+* :class:`GraphNode`
+* :class:`LazyEnvironment`
+* :class:`ParallelEvaluator`
+* :class:`Profiler`
+* :class:`ProfileStats`
 * :class:`Token`
 * :class:`Literal`
 * :class:`Variable`
 * :class:`Operator`
+* :class:`OperatorInfo`
+* :class:`OperatorKind`
+* :class:`DTypeRule`
+* :class:`NaNRule`
 
 
 Functions
 ---------
 
 * :func:`token`
+* :func:`evaluate_many`
+* :func:`evaluate_bytes`
 
 
 Constants
@@ -113,35 +127,70 @@ Keyword          Description
 """
 
 import math
+import struct
+import sys
+import threading
+import time
+import warnings
 from abc import ABC, abstractmethod
-from datetime import timedelta
+from collections import OrderedDict, deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    wait,
+)
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from enum import Enum
+from functools import lru_cache, partial
 from itertools import chain
 from numbers import Integral
 from typing import (
     TYPE_CHECKING,
     AbstractSet,
     Any,
+    Callable,
+    Deque,
+    Dict,
+    FrozenSet,
     Iterable,
     Iterator,
     List,
     Mapping,
     MutableSequence,
+    NamedTuple,
     Optional,
     Sequence,
+    Set,
     Tuple,
     Union,
     cast,
     overload,
 )
+from uuid import uuid4
+from weakref import WeakValueDictionary, finalize
 
 import numpy as np  # type: ignore
-from astropy.convolution import Box1DKernel, Gaussian1DKernel, convolve  # type: ignore
+from astropy.convolution import Box1DKernel, Gaussian1DKernel  # type: ignore
+from scipy.ndimage import convolve1d  # type: ignore
 
 from .constants import EPOCH
-from .datetime64util import ymdhmsus
+from .datetime64util import ymdhmsus_from_microseconds
 from .typing import FloatOrArray
 from .utility import fortran_float
 
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None  # type: ignore
+
+try:
+    import numexpr  # type: ignore
+except ImportError:
+    numexpr = None
+
 # TODO: Change to functools.cached_property when dropping support for
 #       Python 3.7
 if TYPE_CHECKING:
@@ -155,13 +204,26 @@ __all__ = [
     "StackUnderflowError",
     "Expression",
     "CompleteExpression",
+    "ExpressionGraph",
+    "CostEstimate",
+    "GraphNode",
+    "LazyEnvironment",
+    "ParallelEvaluator",
+    "Profiler",
+    "ProfileStats",
     "Token",
     "Literal",
     "PI",
     "E",
     "Variable",
     "Operator",
+    "OperatorInfo",
+    "OperatorKind",
+    "DTypeRule",
+    "NaNRule",
     "token",
+    "evaluate_many",
+    "evaluate_bytes",
     "SUB",
     "ADD",
     "MUL",
@@ -316,6 +378,33 @@ class Literal(Token):
         """Value of the literal."""
         return self._value
 
+    # equal literals are interned, so they are only stored once
+    _interned: "WeakValueDictionary[Any, Literal]" = WeakValueDictionary()
+
+    def __new__(cls, value: Union[int, float, bool]) -> "Literal":
+        """Get the interned literal with the given value, creating it if needed.
+
+        :param value:
+            Value of the literal.
+
+        :return:
+            The literal, the same object for equal values of the same type.
+
+        :raises TypeError:
+            If the given `value` is not of type :class:`int`, :class:`float`
+            or :class:`bool`.
+        """
+        if not isinstance(value, (int, float, bool)):
+            raise TypeError("'value' must be an int, float, or bool")
+        # repr distinguishes 1 from 1.0 and -0.0 from 0.0
+        key = (cls, type(value), repr(value))
+        try:
+            return cls._interned[key]
+        except KeyError:
+            literal = super().__new__(cls)
+            cls._interned[key] = literal
+            return literal
+
     def __init__(self, value: Union[int, float, bool]):
         """
         :param value:
@@ -324,8 +413,6 @@ class Literal(Token):
         :raises ValueError:
             If `value` is not a number.
         """
-        if not isinstance(value, (int, float, bool)):
-            raise TypeError("'value' must be an int, float, or bool")
         self._value: Union[int, float, bool] = value
 
     def __call__(
@@ -375,6 +462,9 @@ class Literal(Token):
     def __str__(self) -> str:
         return str(self._value)
 
+    def __getnewargs__(self) -> Tuple[Union[int, float, bool]]:
+        return (self._value,)
+
 
 class Variable(Token):
     """Environment variable token.
@@ -398,16 +488,40 @@ class Variable(Token):
         """Name of the variable, used to lookup value in the environment."""
         return self._name
 
-    def __init__(self, name: str):
-        """
+    # variables with the same name are interned, so they are only stored once
+    _interned: "WeakValueDictionary[Any, Variable]" = WeakValueDictionary()
+
+    def __new__(cls, name: str) -> "Variable":
+        """Get the interned variable with the given name, creating it if needed.
+
         :param name:
-            Name of the variable, this is what will be used to lookup the
-            variables value in the environment mapping.
+            Name of the variable.
+
+        :return:
+            The variable, the same object for equal names.
+
+        :raises TypeError:
+            If the given `name` is not a string.
+        :raises ValueError:
+            If the given `name` is not a valid identifier.
         """
         if not isinstance(name, str):
             raise TypeError(f"'name' must be a string, got '{type(name)}'")
         if not name.isidentifier():
             raise ValueError(f"'name' must be a valid identifier, got '{name}'")
+        try:
+            return cls._interned[cls, name]
+        except KeyError:
+            variable = super().__new__(cls)
+            cls._interned[cls, name] = variable
+            return variable
+
+    def __init__(self, name: str):
+        """
+        :param name:
+            Name of the variable, this is what will be used to lookup the
+            variables value in the environment mapping.
+        """
         self._name = name
 
     def __call__(
@@ -439,10 +553,124 @@ class Variable(Token):
     def __str__(self) -> str:
         return str(self._name)
 
+    def __getnewargs__(self) -> Tuple[str]:
+        return (self._name,)
+
+
+class OperatorKind(Enum):
+    """Kind of computation performed by an operator."""
+
+    STACK = "stack"
+    """Only rearranges values on the stack, such as :data:`DUP`."""
+    ELEMENTWISE = "elementwise"
+    """Each element of the result only depends on the same element of the
+    (broadcast) arguments, such as :data:`ADD`."""
+    STENCIL = "stencil"
+    """Each element of the result depends on neighboring elements of the
+    arguments, such as :data:`DIF`."""
+    REDUCTION = "reduction"
+    """The result depends on all elements of the argument, such as
+    :data:`SUM`."""
+    OTHER = "other"
+    """Nothing is known about the operator."""
+
+
+class DTypeRule(Enum):
+    """Type of the result of an operator."""
+
+    PRESERVE = "preserve"
+    """Values are not changed."""
+    PROMOTE = "promote"
+    """NumPy type promotion of the arguments, integers stay integers."""
+    FLOAT = "float"
+    """Floating point, integers are converted."""
+    FIRST = "first"
+    """Type of the first argument."""
+    DOUBLE = "double"
+    """Double precision floating point, regardless of the arguments."""
+    BOOL = "bool"
+    """Boolean."""
+    INTEGER = "integer"
+    """Integer, arguments must also be integers."""
+    OTHER = "other"
+    """Nothing is known about the type of the result."""
+
+
+class NaNRule(Enum):
+    """Handling of NaN values by an operator."""
+
+    PROPAGATE = "propagate"
+    """A NaN argument gives a NaN result."""
+    SKIP = "skip"
+    """NaN arguments are ignored when other values are available."""
+    COMPARE = "compare"
+    """NaN compares unequal to all values, including NaN."""
+    DETECT = "detect"
+    """The result indicates whether an argument is NaN."""
+    INVALID = "invalid"
+    """Arguments can not be NaN."""
+    OTHER = "other"
+    """NaN values are handled in another way (or it is not known how)."""
+
+
+@dataclass(frozen=True)
+class OperatorInfo:
+    """**dataclass**: Properties of an operator.
+
+    These allow evaluation strategies (such as compiling, chunking or
+    simplifying expressions) to be chosen without knowing each operator.
+    """
+
+    kind: OperatorKind
+    """Kind of computation performed by the operator."""
+    dtype: DTypeRule
+    """Type of the result."""
+    nan: NaNRule
+    """Handling of NaN values."""
+    halo: Optional[Tuple[int, int]] = (0, 0)
+    """
+    Number of neighboring elements along the first dimension (before and
+    after) needed to compute an element of the result, None if this depends on
+    the arguments (see :func:`Operator.halo`) or the operator is not element
+    wise or a stencil.
+    """
+    commutative: bool = False
+    """True if the order of the arguments does not change the result."""
+    combine: Optional[Callable[[List[FloatOrArray]], FloatOrArray]] = None
+    """
+    For reductions that can be split, a function combining the results of the
+    operator on parts of the argument into the result for the whole argument.
+    """
+    flat: bool = False
+    """True if the operator works on the flattened (1D) arguments."""
+
 
 class Operator(Token, ABC):
     """Base class of all RPN operators."""
 
+    @property
+    def info(self) -> OperatorInfo:
+        """Properties of the operator.
+
+        Operators that are not built into this module have unknown properties
+        unless they override this property.
+        """
+        return _OPERATOR_INFO.get(self, _UNKNOWN_OPERATOR_INFO)
+
+    def halo(self, *args: Optional[FloatOrArray]) -> Optional[Tuple[int, int]]:
+        r"""Get the neighbors needed to compute an element of the result.
+
+        :param \*args:
+            Values of the arguments of the operator, where known ahead of
+            evaluation, or None.
+
+        :return:
+            Number of neighboring elements along the first dimension (before
+            and after) needed to compute an element of the result, or None if
+            this can not be determined.
+        """
+        return self.info.halo
+
     def __init__(self, name: str):
         """
         :param name:
@@ -458,6 +686,12 @@ class Operator(Token, ABC):
         # sentinel object so copy will break it
         return self
 
+    def __reduce_ex__(self, protocol: Any) -> Any:
+        # built in operators are unpickled as the same object
+        if _KEYWORDS.get(self._name) is self:
+            return token, (self._name,)
+        return super().__reduce_ex__(protocol)
+
     def __repr__(self) -> str:
         return self._name
 
@@ -522,7 +756,7 @@ class Expression(Sequence[Token], Token):
                 sequence of `tokens`.
         """
         if isinstance(tokens, str):
-            self._tokens = [token(t) for t in tokens.split()]
+            self._tokens = list(_parse(tokens))
         else:
             self._tokens = []
             for token_ in tokens:
@@ -555,6 +789,102 @@ class Expression(Sequence[Token], Token):
         """
         return self.pops == 0 and self.puts == 1
 
+    def graph(self) -> "ExpressionGraph":
+        """Build the dataflow graph of the expression.
+
+        .. code-block:: python
+
+            expression = Expression("lat SIND SQR lat SIND ADD")
+            expression.graph().expression()
+            # CompleteExpression("lat SIND DUP SQR EXCH ADD")
+
+        :return:
+            A graph of the expression with identical sub-expressions merged.
+        """
+        return ExpressionGraph(self)
+
+    def estimate(
+        self,
+        shapes: Mapping[str, Union[int, Sequence[int]]],
+        dtypes: Optional[Mapping[str, Any]] = None,
+    ) -> "CostEstimate":
+        """Estimate the memory and time needed to evaluate the expression.
+
+        The shape and type of each intermediate value is derived from the
+        shapes and types of the variables and the :attr:`Operator.info` of
+        the operators, without computing anything.
+
+        .. code-block:: python
+
+            estimate = expression.estimate({"x": 1000000, "y": (1000, 1000)})
+            chunksize = 1000000 * memory_limit // estimate.peak_bytes
+
+        :param shapes:
+            Shape of each variable, an integer for 1D arrays.
+        :param dtypes:
+            Type of each variable, double precision for variables not given.
+
+        :return:
+            The estimated cost of evaluating the expression.
+
+        :raises KeyError:
+            If the shape of a variable in the expression is not given.
+        :raises ValueError:
+            If the expression takes values from the stack or the shapes of the
+            arguments of an operator can not be broadcast together.
+        """
+        if self.pops:
+            raise ValueError("expression must not take values from the stack")
+        return _estimate(self._tokens, shapes, dtypes or {})
+
+    def optimize(self, fast_math: bool = False) -> "Expression":
+        """Simplify the expression without changing the result.
+
+        The following optimizations are performed:
+
+            * Operators with only literal arguments are replaced with their
+              result, ``PI 180 DIV`` becomes ``0.017453292519943295``.
+            * Redundant stack operations are removed, such as ``EXCH EXCH``,
+              ``DUP POP`` and ``EXCH`` before commutative operators.
+            * Repeated idempotent or self-inverse operators are removed, such
+              as ``ABS ABS``, ``FLOOR CEIL`` and ``NEG NEG``.
+            * Common sub-expressions are shared, see :func:`graph`.
+
+        .. code-block:: python
+
+            Expression("x PI 180 DIV MUL y EXCH EXCH DUP POP ADD").optimize()
+            # CompleteExpression("x 0.017453292519943295 MUL y ADD")
+
+        :param fast_math:
+            Set to True to also remove pairs of inverse operators that do not
+            give the exact same result due to rounding or overflow, such as
+            ``D2R R2D`` and ``INV INV``, and replace ``SQR SQRT`` with ``ABS``.
+
+        :return:
+            The optimized expression.  This will be a
+            :class:`CompleteExpression` if possible.
+        """
+        tokens = list(_flatten(self._tokens))
+        while True:
+            optimized = _simplify(_fold(tokens), fast_math)
+            # each pass shortens the expression until nothing is left to do
+            done = len(optimized) == len(tokens)
+            tokens = optimized
+            if done:
+                break
+        if Expression(tokens).pops == 0:
+            try:
+                shared = list(ExpressionGraph(Expression(tokens)).expression())
+            except ValueError:
+                pass
+            else:
+                if _cost(shared) < _cost(tokens):
+                    tokens = shared
+        try:
+            return CompleteExpression(tokens)
+        except ValueError:
+            return Expression(tokens)
+
     def __call__(
         self,
         stack: MutableSequence[FloatOrArray],
@@ -680,7 +1010,11 @@ class CompleteExpression(Expression):
         return self
 
     def eval(
-        self, environment: Optional[Mapping[str, FloatOrArray]] = None
+        self,
+        environment: Optional[Mapping[str, FloatOrArray]] = None,
+        executor: Optional[Executor] = None,
+        dtype: Optional[Any] = None,
+        inplace: bool = False,
     ) -> FloatOrArray:
         """Evaluate the expression and return a numerical or logical result.
 
@@ -704,6 +1038,91 @@ class CompleteExpression(Expression):
 
                 missing_vars = expression.variables.difference(environment)
 
+        :param executor:
+            Executor to evaluate independent branches of the expression with,
+            such as a :class:`concurrent.futures.ThreadPoolExecutor`.  NumPy
+            releases the GIL for most operations on large arrays, so branches
+            evaluated in different threads run in parallel.
+
+            .. code-block:: python
+
+                with ThreadPoolExecutor() as executor:
+                    result = expression.eval(environment, executor=executor)
+
+            The expression is evaluated without the `executor` if all
+            variables are scalars or small arrays, as the overhead of
+            scheduling would outweigh the gain.
+
+            Evaluations with an `executor` are not recorded by a
+            :class:`Profiler`.
+        :param dtype:
+            Floating point type of the results of operators, one of:
+
+                * None - NumPy's type promotion, integers are converted to
+                  double precision by most operators.
+                * "float64" - double precision.
+                * "float32" - single precision, halving the memory used by
+                  intermediate arrays.
+                * "preserve" - the smallest floating point type that exactly
+                  represents the arguments, single precision for single
+                  precision data or 8 and 16 bit integers, otherwise double
+                  precision.
+
+            The policy applies to all operators producing floating point
+            values, their array arguments are converted to the type before
+            computing the result.  Integers stay integers for operators that
+            keep integers (such as :data:`ADD` or :data:`MAX` with only
+            integer arguments) and for :data:`IAND`, :data:`IOR` and
+            :data:`BTEST`.  Comparisons are made on the unconverted values.
+            :data:`YMDHMS` always uses double precision, as its results have
+            12 significant digits.
+
+            .. code-block:: python
+
+                result = expression.eval(environment, dtype="float32")
+
+            In single precision each operator is accurate to within a few
+            units in the last place (a relative error of about 1e-6) of the
+            single precision value of its double precision result, see
+            ``test_eval_dtype_accuracy`` in the test suite.  Errors accumulate
+            over the operators of an expression and can be amplified by
+            cancellation (as in :data:`SUB`) just like in double precision.
+            Integers with more than 24 significant bits are rounded when
+            converted to single precision.
+
+        :param inplace:
+            Set to True to write the results of element wise operators into
+            the arrays of their arguments where these are intermediate
+            results not used anywhere else (never into the arrays of the
+            `environment`).  This reduces the number of arrays allocated by
+            an evaluation to about the number of values on the stack at the
+            same time, and the memory used to about as many arrays.
+
+            .. code-block:: python
+
+                result = expression.eval(environment, inplace=True)
+
+            Evaluations with `inplace` are not recorded by a
+            :class:`Profiler`.
+
+        If any variable in the `environment` is a dask_ array the result is
+        a lazy dask array.  Element wise operators are applied to each block,
+        stencil operators (:data:`DIF`, :data:`DXDY`, :data:`BOXCAR` and
+        :data:`GAUSS`) to each block extended with the neighboring elements
+        they need (see :attr:`OperatorInfo.halo`) and :data:`SUM` is a tree
+        reduction over the blocks, so the result can be computed in parallel
+        and without loading entire arrays into memory.
+
+        .. code-block:: python
+
+            environment = {"x": dask.array.from_zarr("x.zarr")}
+            result = expression.eval(environment).compute()
+
+        The `executor` and `inplace` arguments are ignored and the evaluation
+        is not recorded by a :class:`Profiler` in this case.
+
+        .. _dask: https://dask.org/
+
         :return:
             The numeric or logical result of the expression.
 
@@ -722,16 +1141,216 @@ class CompleteExpression(Expression):
             If arguments to operators in the expression do not have the proper
             dimensions or values for the operators to produce a result.  See
             the documentation of each operator for specifics.
+        :raises ValueError:
+            If `dtype` is not a valid policy or `dtype` or `inplace` is given
+            with an `executor`.
         """
-        if not environment:
+        if environment is None:
             environment = {}
+        dtype = _dtype_policy(dtype)
+        if _uses_dask(self, environment):
+            return _eval_dask(self._tokens, environment, dtype)
+        if executor is not None:
+            if dtype is not None or inplace:
+                raise ValueError(
+                    "'dtype' and 'inplace' can not be used with an 'executor'"
+                )
+            graph = self._graph
+            return graph._eval_concurrent(environment, graph.outputs, executor)[0]
+        if inplace:
+            return _eval_inplace(self._tokens, environment, dtype)
+        profiler = _PROFILER  # read once, it may be changed by other threads
+        if profiler is not None:
+            return profiler._eval(self, environment, dtype)
         stack: List[FloatOrArray] = []
+        if dtype is not None:
+            for token_ in _flatten(self._tokens):
+                _call_with_dtype(token_, stack, environment, dtype)
+            return stack[0]
         for token_ in self._tokens:
             token_(stack, environment)
         # NOTE: The stack will always have exactly one element at this point
         #       due to the static checker that runs at initialization.
         return stack[0]
 
+    def eval_chunked(
+        self,
+        environment: Optional[Mapping[str, FloatOrArray]] = None,
+        chunksize: int = 65536,
+        out: Optional[np.ndarray] = None,
+    ) -> FloatOrArray:
+        """Evaluate the expression in chunks along the first dimension.
+
+        Each chunk is evaluated separately and written into the output array,
+        so intermediate arrays are never larger than a chunk.  Chunks are
+        extended with the neighboring elements required by the :data:`DIF`,
+        :data:`DXDY`, :data:`BOXCAR` and :data:`GAUSS` operators, and
+        :data:`SUM` is computed from the sums of all chunks before the rest
+        of the expression.
+
+        .. code-block:: python
+
+            result = expression.eval_chunked(environment, chunksize=100000)
+
+        If the expression can not be split into chunks, because the arrays in
+        the `environment` do not have the same shape or the expression
+        contains operators that are not known to be element wise, it is
+        evaluated as a whole instead.
+
+        .. note::
+
+            Sums computed over chunks may differ from :func:`eval` in the last
+            few bits as the order of the additions is different.
+
+        :param environment:
+            A mapping to lookup variables in when evaluating the expression.
+            Each variable is looked up only once.
+        :param chunksize:
+            Number of elements along the first dimension in each chunk.
+        :param out:
+            Array to store the result in.  This must have the shape of the
+            result.
+
+        :return:
+            The numeric or logical result of the expression, this is `out` if
+            given.
+
+        :raises ValueError:
+            If `chunksize` is not positive or `out` does not have the shape of
+            the result.
+
+        See :func:`eval` for other exceptions.
+        """
+        if chunksize < 1:
+            raise ValueError("'chunksize' must be positive")
+        if environment is None:
+            environment = {}
+        return _eval_chunked(self, environment, chunksize, out)
+
+    def eval_numexpr(
+        self, environment: Optional[Mapping[str, FloatOrArray]] = None
+    ) -> FloatOrArray:
+        """Evaluate the expression with numexpr_.
+
+        Chains of element wise operators on double precision arrays are
+        combined into a single numexpr_ expression, which is evaluated in
+        blocks by multiple threads without creating full size intermediate
+        arrays.  All other operators, such as :data:`BOXCAR` and :data:`DXDY`,
+        and operators on values of other types are evaluated as in
+        :func:`eval`.
+
+        .. code-block:: python
+
+            result = expression.eval_numexpr(environment)
+
+        If numexpr_ is not installed or none of the variables are double
+        precision arrays the expression is evaluated with :func:`eval`.
+
+        .. note::
+
+            The results may differ from :func:`eval` in the last few bits as
+            numexpr_ has its own implementation of some functions.  Also,
+            NumPy's floating point warnings are not given for the operators
+            evaluated by numexpr_.
+
+        .. _numexpr: https://github.com/pydata/numexpr
+
+        :param environment:
+            A mapping to lookup variables in when evaluating the expression.
+
+        :return:
+            The numeric or logical result of the expression.
+
+        See :func:`eval` for exceptions.
+        """
+        if environment is None:
+            environment = {}
+        return _eval_numexpr(self, environment)
+
+    def compile(self) -> Callable[..., FloatOrArray]:
+        """Compile the expression into a single Python function.
+
+        The stack is resolved when compiling, so the resulting function calls
+        the NumPy functions backing each operator directly instead of pushing
+        and popping values on a stack.  Intermediate arrays that are created
+        by the function itself (and not referenced anywhere else) are reused
+        through the `out` argument of NumPy's ufuncs instead of allocating a
+        new array for every operator.
+
+        .. code-block:: python
+
+            func = expression.compile()
+            for environment in environments:
+                result = func(environment)
+
+        .. note::
+
+            The expression is only compiled once, further calls return the
+            same function.
+
+        :return:
+            A function taking an optional `environment` mapping and returning
+            the same result as :func:`eval` would.  Arrays given in the
+            `environment` are never modified.
+        """
+        return self._compiled
+
+    def to_bytes(self) -> bytes:
+        """Serialize the expression to a compact bytecode.
+
+        The bytecode consists of an array of 16 bit opcodes, a pool of the
+        literal values and a table of variable names.  It can be converted
+        back to an expression with :func:`from_bytes` or evaluated directly
+        with :func:`evaluate_bytes`.
+
+        .. code-block:: python
+
+            data = expression.to_bytes()
+            CompleteExpression.from_bytes(data) == expression  # True
+
+        :return:
+            The bytecode of the expression.
+
+        :raises ValueError:
+            If the expression contains operators that are not RADS keywords,
+            integers that do not fit in 64 bits, or too many distinct
+            literals or variables.
+        """
+        return _encode(self._tokens)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "CompleteExpression":
+        """Load an expression from the bytecode given by :func:`to_bytes`.
+
+        :param data:
+            Bytecode of the expression.
+
+        :return:
+            The expression.
+
+        :raises ValueError:
+            If `data` is not valid bytecode of a complete expression.
+        """
+        expression = cls.__new__(cls)
+        # the bytecode is checked to be a complete expression when decoded
+        expression._tokens = list(_decode(bytes(data)))
+        return expression
+
+    @cached_property
+    def _compiled(self) -> Callable[..., FloatOrArray]:
+        return _compile(self._tokens)
+
+    @cached_property
+    def _graph(self) -> "ExpressionGraph":
+        return self.graph()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        # compiled functions can not be pickled, they will be rebuilt on demand
+        state.pop("_compiled", None)
+        state.pop("_graph", None)
+        return state
+
     def _format_syntax_error(self, string: str, token_: Optional[int] = None) -> str:
         tokens_str = [str(t) for t in self._tokens]
         result = f"{string}\n{' '.join(tokens_str)}"
@@ -773,6 +1392,925 @@ class CompleteExpression(Expression):
             )
 
 
+# maximum number of tokens in an expression written out from a graph
+_MAX_GRAPH_TOKENS = 100000
+
+# number of expression strings to keep parsed tokens of
+_PARSE_CACHE_SIZE = 4096
+
+# smallest array size for which operators are submitted to an executor
+_CONCURRENT_MIN_SIZE = 100000
+
+
+class GraphNode:
+    """Node of an :class:`ExpressionGraph`, a single value of the expression.
+
+    There are three types of nodes:
+
+        * Leaf nodes hold a :class:`Literal` or :class:`Variable` token and
+          have no arguments.
+        * Operator nodes hold the :class:`Operator` that computes the value
+          from the values of the argument nodes.
+        * Input nodes have no token and represent a value that must already
+          be on the stack before evaluating the expression.
+    """
+
+    __slots__ = ("token", "args", "index")
+
+    token: Optional[Token]
+    """Token computing the value, None for an input node."""
+    args: Tuple["GraphNode", ...]
+    """Argument nodes of the token, in stack order."""
+    index: int
+    """
+    Index of the value within the outputs of the token (0 for operators with
+    a single output) or the position of an input node counted from the top of
+    the stack.
+    """
+
+    def __init__(
+        self,
+        token: Optional[Token],
+        args: Iterable["GraphNode"] = (),
+        index: int = 0,
+    ):
+        """
+        :param token:
+            Token computing the value, None for an input node.
+        :param args:
+            Argument nodes of the `token`, in stack order.
+        :param index:
+            Index of the value within the outputs of the `token` or position
+            of an input node.
+        """
+        self.token = token
+        self.args = tuple(args)
+        self.index = index
+
+    def __repr__(self) -> str:
+        if self.token is None:
+            return f"{self.__class__.__qualname__}(None, index={self.index})"
+        return f"{self.__class__.__qualname__}({repr(self.token)})"
+
+
+class ExpressionGraph:
+    """Dataflow graph of one or more expressions.
+
+    Identical sub-expressions are only stored once (regardless of whether they
+    were repeated in the expression or duplicated with :data:`DUP`) and stack
+    manipulation (:data:`DUP`, :data:`EXCH`, and :data:`POP`) is resolved when
+    building the graph.  Therefore, evaluating the graph computes each
+    sub-expression only once.
+
+    .. code-block:: python
+
+        graph = ExpressionGraph(Expression("lat SIND SQR lat SIND ADD"))
+        graph.expression()  # CompleteExpression("lat SIND DUP SQR EXCH ADD")
+
+    Values removed with :data:`POP` are still computed, so evaluating the
+    graph raises the same errors as :func:`CompleteExpression.eval`, such as
+    the :class:`KeyError` of ``y POP 1`` without a ``y`` variable.
+    """
+
+    nodes: List[GraphNode]
+    """Nodes of the graph in the order they were created (topological order)."""
+    outputs: List[GraphNode]
+    """Output nodes of all expressions in the graph, in the order added."""
+    discarded: List[GraphNode]
+    """
+    Nodes of the values removed with :data:`POP` (other than literals and
+    inputs), these are computed whenever the graph is evaluated.
+    """
+    inputs: int
+    """Maximum number of inputs taken by any expression in the graph."""
+
+    def __init__(self, expressions: Union[Expression, Iterable[Expression]] = ()):
+        """
+        :param expressions:
+            Expression or expressions to add to the graph.
+        """
+        self.nodes = []
+        self.outputs = []
+        self.discarded = []
+        self.inputs = 0
+        self._nodes: Dict[Any, GraphNode] = {}
+        if isinstance(expressions, Expression):
+            expressions = [expressions]
+        for expression in expressions:
+            self.add(expression)
+
+    def add(self, expression: Iterable[Token]) -> Tuple[GraphNode, ...]:
+        """Add an expression to the graph.
+
+        Sub-expressions that are already in the graph are reused.
+
+        :param expression:
+            Expression (or sequence of tokens) to add.
+
+        :return:
+            The output nodes of the expression, from the bottom to the top of
+            the stack.
+        """
+        stack: List[GraphNode] = []
+        inputs = 0
+        for token_ in _flatten(expression):
+            if len(stack) < token_.pops:
+                # values must come from the stack before the expression
+                missing = token_.pops - len(stack)
+                stack[0:0] = [
+                    self._node(None, (), i)
+                    for i in reversed(range(inputs, inputs + missing))
+                ]
+                inputs += missing
+            args = stack[len(stack) - token_.pops :]
+            del stack[len(stack) - token_.pops :]
+            if token_ is DUP:
+                stack.extend(args * 2)
+            elif token_ is EXCH:
+                stack.extend(reversed(args))
+            elif token_ is POP:
+                self._discard(args[0])
+            else:
+                stack.extend(self._node(token_, args, i) for i in range(token_.puts))
+        self.inputs = max(self.inputs, inputs)
+        self.outputs.extend(stack)
+        return tuple(stack)
+
+    def uses(
+        self, outputs: Optional[Iterable[GraphNode]] = None
+    ) -> Dict[GraphNode, int]:
+        """Count the number of times each node is used.
+
+        :param outputs:
+            Output nodes to count the uses for, defaults to :attr:`outputs`.
+
+        :return:
+            Mapping from each node needed to compute the `outputs` to the
+            number of times it is used as an argument or output.  The
+            :attr:`discarded` nodes that are not otherwise needed are included
+            with no uses.
+        """
+        outputs = self.outputs if outputs is None else list(outputs)
+        return self._uses(outputs, {})
+
+    def order(self, outputs: Optional[Iterable[GraphNode]] = None) -> List[GraphNode]:
+        """Get the nodes needed to compute the given outputs.
+
+        :param outputs:
+            Output nodes to compute, defaults to :attr:`outputs`.
+
+        :return:
+            Nodes needed to compute the `outputs` in evaluation order.
+        """
+        uses = self.uses(outputs)
+        return [n for n in self.nodes if n in uses]
+
+    def eval(
+        self,
+        environment: Optional[Mapping[str, FloatOrArray]] = None,
+        outputs: Optional[Iterable[GraphNode]] = None,
+        executor: Optional[Executor] = None,
+    ) -> List[FloatOrArray]:
+        """Evaluate the graph, computing each node only once.
+
+        :param environment:
+            A mapping to lookup variables in when evaluating the graph.
+        :param outputs:
+            Output nodes to compute, defaults to :attr:`outputs`.
+        :param executor:
+            Executor to evaluate independent nodes with.  See
+            :func:`CompleteExpression.eval`.
+
+        :return:
+            The value of each of the `outputs`.
+
+        :raises ValueError:
+            If the graph has inputs.
+
+        See :func:`CompleteExpression.eval` for other exceptions.
+        """
+        outputs = self.outputs if outputs is None else list(outputs)
+        if environment is None:
+            environment = {}
+        if executor is not None:
+            return self._eval_concurrent(environment, outputs, executor)
+        return self._eval(environment, outputs, {})
+
+    def expression(self, outputs: Optional[Iterable[GraphNode]] = None) -> Expression:
+        """Convert the graph back into an expression.
+
+        Sub-expressions that are used by consecutive arguments of an operator
+        are only computed once, using :data:`DUP` and :data:`EXCH` to share
+        them.  Other shared sub-expressions are computed each time they are
+        used.
+
+        :param outputs:
+            Output nodes to compute, defaults to :attr:`outputs`.
+
+        :return:
+            An expression placing the values of the `outputs` on the stack.
+            This will be a :class:`CompleteExpression` if possible.
+
+        :raises ValueError:
+            If the graph has inputs or is too large to be written as an
+            expression.
+        """
+        outputs = self.outputs if outputs is None else list(outputs)
+        if self.inputs:
+            raise ValueError("graph with inputs can not be converted to an expression")
+        uses = self.uses(outputs)
+        # computed only for their errors, written out first followed by POP
+        discarded = [n for n in self.discarded if n in uses and not uses[n]]
+        # size of each node when written out without sharing
+        sizes: Dict[GraphNode, int] = {}
+        for node in self.order(outputs):
+            puts = cast(Token, node.token).puts
+            sizes[node] = 1 + puts + sum(sizes[a] for a in node.args)
+        if sum(sizes[n] for n in chain(discarded, outputs)) > _MAX_GRAPH_TOKENS:
+            raise ValueError("graph is too large to be converted to an expression")
+        tokens: List[Token] = []
+        for node in discarded:
+            self._emit(node, tokens)
+            tokens.append(POP)
+        for node in outputs:
+            self._emit(node, tokens)
+        try:
+            return CompleteExpression(tokens)
+        except ValueError:
+            return Expression(tokens)
+
+    def _node(
+        self, token_: Optional[Token], args: Sequence[GraphNode], index: int
+    ) -> GraphNode:
+        """Get an existing node or create a new one."""
+        if token_ is None:
+            key: Any = None
+        elif isinstance(token_, Literal):
+            # repr distinguishes 1 from 1.0 and -0.0 from 0.0
+            key = (Literal, repr(token_.value))
+        elif isinstance(token_, Variable):
+            key = (Variable, token_.name)
+        else:
+            key = id(token_)
+        key = (key, tuple(id(a) for a in args), index)
+        try:
+            return self._nodes[key]
+        except KeyError:
+            node = GraphNode(token_, args, index)
+            self._nodes[key] = node
+            self.nodes.append(node)
+            return node
+
+    def _discard(self, node: GraphNode) -> None:
+        """Record a node whose value is removed with :data:`POP`."""
+        if (
+            node.token is not None
+            and not isinstance(node.token, Literal)
+            and node not in self.discarded
+        ):
+            self.discarded.append(node)
+
+    def _uses(
+        self, outputs: Sequence[GraphNode], known: Mapping[GraphNode, Any]
+    ) -> Dict[GraphNode, int]:
+        """Count uses, without descending into the arguments of known nodes.
+
+        The discarded nodes are included with no uses of their own, unless
+        they are computed anyway (possibly as another output of the same call).
+        """
+        uses = self._count_uses(outputs, known, {})
+        calls = {(id(n.token), n.args) for n in uses}
+        discarded = [
+            n for n in self.discarded if (id(n.token), n.args) not in calls
+        ]
+        for node, count in self._count_uses(discarded, known, uses).items():
+            uses[node] = uses.get(node, 0) + count
+        for node in discarded:
+            uses[node] -= 1
+        return uses
+
+    def _count_uses(
+        self,
+        outputs: Sequence[GraphNode],
+        known: Mapping[GraphNode, Any],
+        counted: Mapping[GraphNode, int],
+    ) -> Dict[GraphNode, int]:
+        """Count uses, without descending into known or counted nodes."""
+        uses: Dict[GraphNode, int] = {}
+        for node in outputs:
+            uses[node] = uses.get(node, 0) + 1
+        for node in reversed(self.nodes):
+            if node in uses and node not in known and node not in counted:
+                for arg in node.args:
+                    uses[arg] = uses.get(arg, 0) + 1
+        return uses
+
+    def _eval(
+        self,
+        environment: Mapping[str, FloatOrArray],
+        outputs: Sequence[GraphNode],
+        known: Mapping[GraphNode, FloatOrArray],
+    ) -> List[FloatOrArray]:
+        """Evaluate the graph, using the given values for the `known` nodes."""
+        remaining = self._uses(outputs, known)
+        values: Dict[GraphNode, FloatOrArray] = {}
+        for node in self.nodes:
+            if node not in remaining:
+                continue
+            if node in known:
+                values[node] = known[node]
+                continue
+            values[node] = self._eval_node(node, values, environment)
+            # release intermediate values as soon as possible
+            _release(node.args, remaining, values)
+            if not remaining[node]:  # discarded
+                del values[node]
+        return [values[node] for node in outputs]
+
+    def _eval_concurrent(
+        self,
+        environment: Mapping[str, FloatOrArray],
+        outputs: Sequence[GraphNode],
+        executor: Executor,
+    ) -> List[FloatOrArray]:
+        """Evaluate the graph, submitting operators to the `executor`.
+
+        Each operator is submitted as soon as all of its arguments have been
+        computed, so independent branches run concurrently.
+        """
+        remaining = self._uses(outputs, {})
+        values: Dict[GraphNode, FloatOrArray] = {}
+        # operator calls, each with the nodes of the outputs that are used
+        calls: Dict[Any, List[GraphNode]] = {}
+        for node in self.nodes:
+            if node not in remaining:
+                continue
+            if node.token is None or isinstance(node.token, (Literal, Variable)):
+                values[node] = self._eval_node(node, values, environment)
+            else:
+                key = (id(node.token), tuple(id(a) for a in node.args))
+                calls.setdefault(key, []).append(node)
+        if all(np.size(v) < _CONCURRENT_MIN_SIZE for v in values.values()):
+            return self._eval(environment, outputs, values)
+        _run_calls(calls, remaining, values, environment, executor)
+        return [values[node] for node in outputs]
+
+    @staticmethod
+    def _eval_node(
+        node: GraphNode,
+        values: Mapping[GraphNode, FloatOrArray],
+        environment: Mapping[str, FloatOrArray],
+    ) -> FloatOrArray:
+        if isinstance(node.token, Literal):
+            return node.token.value
+        if isinstance(node.token, Variable):
+            return environment[node.token.name]
+        if node.token is None:
+            raise ValueError("graph with inputs can not be evaluated")
+        args = [values[a] for a in node.args]
+        return _call(node.token, args, environment)[node.index]
+
+    def _emit(self, node: GraphNode, tokens: List[Token]) -> None:
+        """Write the tokens placing the value of `node` on top of the stack."""
+        token_ = cast(Token, node.token)
+        self._emit_args(node.args, tokens)
+        tokens.append(token_)
+        # only keep the output given by the node's index
+        tokens.extend([POP] * (token_.puts - node.index - 1))
+        tokens.extend([EXCH, POP] * node.index)
+
+    def _emit_above(
+        self, node: GraphNode, shared: GraphNode, tokens: List[Token]
+    ) -> None:
+        """Write the tokens computing `node` with `shared` on top of the stack."""
+        if node is shared:
+            return
+        self._emit_above(node.args[0], shared, tokens)
+        self._emit_args(node.args[1:], tokens)
+        tokens.append(cast(Token, node.token))
+
+    def _emit_args(self, args: Sequence[GraphNode], tokens: List[Token]) -> None:
+        """Write the tokens placing the values of `args` on the stack."""
+        i = 0
+        while i < len(args):
+            if i + 1 < len(args):
+                shared = _shared_spine(args[i], args[i + 1])
+                if shared is not None:
+                    self._emit(shared, tokens)
+                    tokens.append(DUP)
+                    self._emit_above(args[i], shared, tokens)
+                    if args[i] is not shared:
+                        tokens.append(EXCH)
+                    self._emit_above(args[i + 1], shared, tokens)
+                    i += 2
+                    continue
+            self._emit(args[i], tokens)
+            i += 1
+
+
+def _spine(node: GraphNode) -> Iterator[GraphNode]:
+    """Iterate over the nodes computed from the first argument of `node`.
+
+    These are the nodes that can be placed on top of the stack and used to
+    compute `node` without any stack manipulation.
+    """
+    while True:
+        yield node
+        if not node.args or cast(Token, node.token).puts != 1:
+            return
+        node = node.args[0]
+
+
+def _shared_spine(first: GraphNode, second: GraphNode) -> Optional[GraphNode]:
+    """Find the largest computed node on the spine of two consecutive nodes."""
+    if first is second:
+        return first
+    second_spine = set(_spine(second))
+    for node in _spine(first):
+        if node.args and node in second_spine:
+            return node
+    return None
+
+
+def _run_calls(
+    calls: Mapping[Any, Sequence[GraphNode]],
+    remaining: Dict[GraphNode, int],
+    values: Dict[GraphNode, FloatOrArray],
+    environment: Mapping[str, FloatOrArray],
+    executor: Executor,
+) -> None:
+    """Compute the nodes of operator calls with an executor.
+
+    :param calls:
+        Nodes computed by each operator call, in topological order.
+    :param remaining:
+        Number of uses of each node, intermediate values are released once
+        they have no remaining uses.
+    :param values:
+        Values of the nodes that are already computed, updated in place.
+    :param environment:
+        A mapping to lookup variables in, passed to the operators.
+    :param executor:
+        Executor to submit the calls to.
+    """
+    waiting, dependents = _dependencies(calls, values)
+    pending: Dict["Future[List[FloatOrArray]]", Any] = {}
+
+    def submit(key: Any) -> None:
+        node = calls[key][0]
+        args = [values[a] for a in node.args]
+        token_ = cast(Token, node.token)
+        pending[executor.submit(_call, token_, args, environment)] = key
+
+    for key in [k for k, n in waiting.items() if not n]:
+        submit(key)
+    try:
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                for node in calls[pending.pop(future)]:
+                    values[node] = result[node.index]
+                    for key in dependents.get(node, ()):
+                        waiting[key] -= 1
+                        if not waiting[key]:
+                            submit(key)
+                    _release(node.args, remaining, values)
+                    if not remaining[node]:  # discarded
+                        del values[node]
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _dependencies(
+    calls: Mapping[Any, Sequence[GraphNode]], values: Mapping[GraphNode, Any]
+) -> Tuple[Dict[Any, int], Dict[GraphNode, List[Any]]]:
+    """Find the dependencies between operator calls.
+
+    :return:
+        The number of distinct arguments of each call that are not in
+        `values` and the calls using each of these arguments.
+    """
+    waiting: Dict[Any, int] = {}
+    dependents: Dict[GraphNode, List[Any]] = {}
+    for key, (node, *_) in calls.items():
+        args = set(node.args).difference(values)
+        waiting[key] = len(args)
+        for arg in args:
+            dependents.setdefault(arg, []).append(key)
+    return waiting, dependents
+
+
+def _release(
+    args: Iterable[GraphNode],
+    remaining: Dict[GraphNode, int],
+    values: Dict[GraphNode, FloatOrArray],
+) -> None:
+    """Release the values of arguments that have no remaining uses."""
+    for arg in args:
+        remaining[arg] -= 1
+        if not remaining[arg]:
+            del values[arg]
+
+
+class LazyEnvironment(Mapping[str, FloatOrArray]):
+    """Environment that loads variables only when they are needed.
+
+    Variables are loaded with the `loader` the first time they are looked up,
+    unless they are math variables (with an expression as their `data`) in
+    which case the expression is evaluated with this environment, loading
+    only the variables the expression depends on.  The most recently used
+    values are cached.
+
+    .. code-block:: python
+
+        environment = LazyEnvironment(load_variable, config.variables)
+        expression.eval(environment)
+
+    .. note::
+
+        Membership tests and iteration only consider the given `variables` and
+        cached values, they never load a variable.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[str], FloatOrArray],
+        variables: Optional[Mapping[str, Any]] = None,
+        maxsize: Optional[int] = 128,
+    ):
+        """
+        :param loader:
+            Function taking the name of a variable and returning its value.
+            This should raise :class:`KeyError` if the variable does not
+            exist.
+        :param variables:
+            Mapping of variable names to variable descriptors, such as
+            :class:`rads.config.tree.Variable`.  Any variable with a
+            :class:`CompleteExpression` as its `data` attribute will be
+            computed from the expression instead of being loaded.
+        :param maxsize:
+            Maximum number of values to cache, None for no limit.
+        """
+        self._loader = loader
+        self._variables = {} if variables is None else variables
+        self._maxsize = maxsize
+        self._cache: "OrderedDict[str, FloatOrArray]" = OrderedDict()
+        self._pending: List[str] = []
+
+    def clear(self) -> None:
+        """Remove all values from the cache."""
+        self._cache.clear()
+
+    def __getitem__(self, name: str) -> FloatOrArray:
+        try:
+            self._cache.move_to_end(name)
+            return self._cache[name]
+        except KeyError:
+            pass
+        if name in self._pending:
+            cycle = " -> ".join(self._pending[self._pending.index(name) :] + [name])
+            raise ValueError(f"cyclic dependency in variables: {cycle}")
+        data = getattr(self._variables.get(name), "data", None)
+        self._pending.append(name)
+        try:
+            if isinstance(data, CompleteExpression):
+                value = data.eval(self)
+            else:
+                value = self._loader(name)
+        finally:
+            self._pending.pop()
+        self._cache[name] = value
+        if self._maxsize is not None and len(self._cache) > self._maxsize:
+            self._cache.popitem(last=False)
+        return value
+
+    def __contains__(self, name: Any) -> bool:
+        return name in self._cache or name in self._variables
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self._variables
+        yield from (n for n in self._cache if n not in self._variables)
+
+    def __len__(self) -> int:
+        return len(set(self._variables).union(self._cache))
+
+
+class ParallelEvaluator:
+    """Evaluate expressions over many environments with a pool of processes.
+
+    The expressions are sent to each worker process once, where they are
+    compiled (see :func:`CompleteExpression.compile`).  Only the environments
+    are sent with each task, and the resulting arrays are returned through
+    shared memory instead of being pickled.  The arrays are not copied out of
+    the shared memory, which is released once they are garbage collected.
+
+    .. code-block:: python
+
+        with ParallelEvaluator({"sla": sla, "ssha": ssha}) as evaluator:
+            for results in evaluator.map(environments):
+                store(results["sla"], results["ssha"])
+
+    .. note::
+
+        Shared memory requires Python 3.8 or later, with older versions the
+        results are pickled.
+    """
+
+    def __init__(
+        self,
+        expressions: Union[Mapping[Any, CompleteExpression], Iterable[Expression]],
+        max_workers: Optional[int] = None,
+        mp_context: Optional[Any] = None,
+    ):
+        """
+        :param expressions:
+            Mapping of keys to expressions, or a collection of expressions in
+            which case the string form of each expression is used as its key.
+        :param max_workers:
+            Number of worker processes, defaults to the number of processors.
+        :param mp_context:
+            Multiprocessing context used to start the worker processes, see
+            :class:`concurrent.futures.ProcessPoolExecutor`.
+
+        :raises ValueError:
+            If one of the `expressions` is not a complete expression.
+        """
+        if isinstance(expressions, Mapping):
+            items = list(expressions.items())
+        else:
+            items = [(str(e), e) for e in expressions]
+        self._expressions = {k: e.complete() for k, e in items}
+        self._id = uuid4().hex
+        if sys.version_info >= (3, 7):
+            self._executor = ProcessPoolExecutor(
+                max_workers,
+                mp_context=mp_context,
+                initializer=_init_worker,
+                initargs=(self._id, self._expressions),
+            )
+        else:
+            self._executor = ProcessPoolExecutor(max_workers)
+
+    def evaluate(self, environment: Mapping[str, FloatOrArray]) -> Dict[Any, Any]:
+        """Evaluate the expressions with a single environment.
+
+        :param environment:
+            A mapping to lookup variables in when evaluating the expressions.
+            This must be picklable.
+
+        :return:
+            Mapping from each key to the result of the expression.
+
+        See :func:`CompleteExpression.eval` for exceptions.
+        """
+        return next(self.map([environment]))
+
+    def map(
+        self, environments: Iterable[Mapping[str, FloatOrArray]]
+    ) -> Iterator[Dict[Any, Any]]:
+        """Evaluate the expressions with each environment.
+
+        The environments are all submitted to the worker processes before the
+        first result is returned.
+
+        :param environments:
+            Mappings to lookup variables in when evaluating the expressions.
+            These must be picklable.
+
+        :return:
+            Iterator over the results for each environment, in the same order
+            as the `environments`.  Each result maps the keys to the results of
+            the expressions.  The results that are not used are released when
+            the iterator is closed or garbage collected.
+
+        See :func:`CompleteExpression.eval` for exceptions.
+        """
+        # expressions can not be sent on worker initialization before 3.7
+        expressions = None if sys.version_info >= (3, 7) else self._expressions
+        futures = deque(
+            self._executor.submit(_eval_worker, self._id, expressions, e)
+            for e in environments
+        )
+        results = self._results(futures)
+        # the finally clause of a generator does not run if it never started
+        finalize(results, _release_futures, futures)
+        return results
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Shutdown the worker processes.
+
+        :param wait:
+            Set to False to return immediately instead of waiting for the
+            evaluations in progress to complete.
+        """
+        self._executor.shutdown(wait)
+
+    def __enter__(self) -> "ParallelEvaluator":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.shutdown()
+
+    @staticmethod
+    def _results(futures: Deque["Future[Any]"]) -> Iterator[Dict[Any, Any]]:
+        try:
+            while futures:
+                results = futures[0].result()
+                futures.popleft()
+                yield {k: _unshare(v) for k, v in results.items()}
+        finally:
+            _release_futures(futures)
+
+
+@dataclass
+class CostEstimate:
+    """**dataclass**: Estimated cost of evaluating an expression.
+
+    See :func:`Expression.estimate`.
+    """
+
+    stack_depth: int = 0
+    """Largest number of values on the stack."""
+    peak_bytes: int = 0
+    """
+    Largest number of bytes of intermediate arrays alive at the same time,
+    including the results of the operator being computed.  Variables are not
+    included.
+    """
+    operations: Dict[str, int] = field(default_factory=dict)
+    """
+    Approximate number of element operations of each operator, the number of
+    elements of the largest argument or result of each call.
+    """
+
+
+@dataclass
+class ProfileStats:
+    """**dataclass**: Statistics of profiled evaluations."""
+
+    calls: int = 0
+    """Number of evaluations."""
+    time: float = 0.0
+    """Total wall time in seconds."""
+    input_size: int = 0
+    """Total number of elements in the arguments."""
+    output_size: int = 0
+    """Total number of elements in the results."""
+    allocated: int = 0
+    """Total bytes of the arrays created."""
+    dtypes: Set[str] = field(default_factory=set)
+    """Types of the arguments and results, such as ``float64,int64->float64``."""
+
+
+class Profiler:
+    """Record the time and memory used by each operator while evaluating.
+
+    Profiling is enabled while the profiler is used as a context manager and
+    records each evaluation with :func:`CompleteExpression.eval` (in any
+    thread, recording is thread safe).  When no profiler is enabled
+    expressions are evaluated without any instrumentation.
+
+    .. code-block:: python
+
+        with Profiler() as profiler:
+            for expression in expressions:
+                expression.eval(environment)
+        print(profiler.report())
+
+    Profilers can be nested, in which case evaluations are only recorded by
+    the innermost profiler, the most recently enabled profiler that is still
+    enabled.  Profilers may be disabled in any order, such as when they are
+    used by different threads.
+    """
+
+    expressions: Dict[str, ProfileStats]
+    """Statistics of each expression, keyed by the expression string."""
+    operators: Dict[str, ProfileStats]
+    """Statistics of each operator, keyed by the operator keyword."""
+
+    def __init__(self) -> None:
+        """Create a profiler without any recorded statistics."""
+        self.expressions = {}
+        self.operators = {}
+        self._lock = threading.Lock()
+
+    def clear(self) -> None:
+        """Remove all recorded statistics."""
+        with self._lock:
+            self.expressions.clear()
+            self.operators.clear()
+
+    def report(self, limit: Optional[int] = None) -> str:
+        """Summarize the recorded statistics.
+
+        :param limit:
+            Maximum number of operators and expressions to list, defaults to
+            all of them.
+
+        :return:
+            A table of the operators and a table of the expressions, each
+            sorted by decreasing total time.
+        """
+        lines = []
+        with self._lock:
+            tables = [
+                ("operator", dict(self.operators)),
+                ("expression", dict(self.expressions)),
+            ]
+        for title, stats in tables:
+            lines.append(
+                f"{title:<40} {'calls':>8} {'time [ms]':>10} {'input':>12} "
+                f"{'output':>12} {'allocated':>12}  dtypes"
+            )
+            items = sorted(stats.items(), key=lambda i: i[1].time, reverse=True)
+            for name, stat in items[:limit]:
+                if len(name) > 40:
+                    name = name[:37] + "..."
+                lines.append(
+                    f"{name:<40} {stat.calls:>8} {stat.time * 1000:>10.3f} "
+                    f"{stat.input_size:>12} {stat.output_size:>12} "
+                    f"{stat.allocated:>12}  {' '.join(sorted(stat.dtypes))}"
+                )
+            lines.append("")
+        return "\n".join(lines[:-1])
+
+    def __enter__(self) -> "Profiler":
+        global _PROFILER
+        with _PROFILERS_LOCK:
+            _PROFILERS.append(self)
+            _PROFILER = self
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        global _PROFILER
+        with _PROFILERS_LOCK:
+            # remove the most recent use, which need not be the innermost
+            index = len(_PROFILERS) - 1 - _PROFILERS[::-1].index(self)
+            del _PROFILERS[index]
+            _PROFILER = _PROFILERS[-1] if _PROFILERS else None
+
+    def _eval(
+        self,
+        expression: Expression,
+        environment: Mapping[str, FloatOrArray],
+        dtype: Optional[Union[str, np.dtype]] = None,
+    ) -> FloatOrArray:
+        """Evaluate an expression, recording each operator."""
+        stack: List[FloatOrArray] = []
+        variables: Dict[str, FloatOrArray] = {}
+        allocated = 0
+        start = time.perf_counter()
+        for token_ in _flatten(expression):
+            if not isinstance(token_, Operator):
+                token_(stack, environment)
+                if isinstance(token_, Variable):
+                    variables[token_.name] = stack[-1]
+                continue
+            args = stack[len(stack) - token_.pops :]
+            token_start = time.perf_counter()
+            _call_with_dtype(token_, stack, environment, dtype)
+            elapsed = time.perf_counter() - token_start
+            results = stack[len(stack) - token_.puts :] if token_.puts else []
+            # arrays that are not views or arguments are new
+            new = sum(
+                r.nbytes
+                for r in results
+                if isinstance(r, np.ndarray)
+                and r.flags.owndata
+                and not any(r is a for a in args)
+            )
+            with self._lock:
+                stats = self.operators.setdefault(str(token_), ProfileStats())
+                self._record(stats, elapsed, args, results, new)
+            allocated += new
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            stats = self.expressions.setdefault(str(expression), ProfileStats())
+            self._record(stats, elapsed, list(variables.values()), stack, allocated)
+        return stack[0]
+
+    @staticmethod
+    def _record(
+        stats: ProfileStats,
+        elapsed: float,
+        args: Sequence[FloatOrArray],
+        results: Sequence[FloatOrArray],
+        allocated: int,
+    ) -> None:
+        stats.calls += 1
+        stats.time += elapsed
+        stats.input_size += sum(np.size(a) for a in args)
+        stats.output_size += sum(np.size(r) for r in results)
+        stats.allocated += allocated
+        stats.dtypes.add(
+            ",".join(_dtype_name(a) for a in args)
+            + "->"
+            + ",".join(_dtype_name(r) for r in results)
+        )
+
+
 def token(string: str) -> Token:
     """Parse string token into a :class:`Token`.
 
@@ -809,6 +2347,85 @@ def token(string: str) -> Token:
         raise ValueError(f"invalid RPN token '{string}'")
 
 
+def evaluate_many(
+    expressions: Union[Mapping[Any, Expression], Iterable[Expression]],
+    environment: Optional[Mapping[str, FloatOrArray]] = None,
+) -> Dict[Any, FloatOrArray]:
+    """Evaluate multiple expressions together.
+
+    The expressions are evaluated as a single :class:`ExpressionGraph`.
+    Therefore, each variable is looked up in the `environment` only once and
+    sub-expressions shared between expressions are only computed once.
+
+    .. code-block:: python
+
+        results = evaluate_many(
+            {"sla": sla_expression, "ssha": ssha_expression}, environment
+        )
+
+    .. note::
+
+        Identical expressions (and expressions that reduce to the same value)
+        share the same result object.
+
+    :param expressions:
+        Mapping of keys to expressions, or a collection of expressions.
+    :param environment:
+        A mapping to lookup variables in when evaluating the expressions.
+
+    :return:
+        Mapping from each key of `expressions` to the result of the
+        expression.  If a collection of expressions is given the string form
+        of each expression is used as the key.
+
+    :raises ValueError:
+        If one of the `expressions` is not a complete expression.
+
+    See :func:`CompleteExpression.eval` for other exceptions.
+    """
+    if isinstance(expressions, Mapping):
+        items = list(expressions.items())
+    else:
+        items = [(str(e), e) for e in expressions]
+    graph = ExpressionGraph()
+    outputs = [graph.add(e.complete())[0] for _, e in items]
+    results = graph.eval(environment, outputs)
+    return {key: result for (key, _), result in zip(items, results)}
+
+
+def evaluate_bytes(
+    data: bytes, environment: Optional[Mapping[str, FloatOrArray]] = None
+) -> FloatOrArray:
+    """Evaluate an expression directly from its bytecode.
+
+    This avoids creating a :class:`CompleteExpression`, see
+    :func:`CompleteExpression.to_bytes` for the bytecode.
+
+    .. code-block:: python
+
+        result = evaluate_bytes(expression.to_bytes(), environment)
+
+    :param data:
+        Bytecode of a complete expression.
+    :param environment:
+        A mapping to lookup variables in when evaluating the expression.
+
+    :return:
+        The numeric or logical result of the expression.
+
+    :raises ValueError:
+        If `data` is not valid bytecode of a complete expression.
+
+    See :func:`CompleteExpression.eval` for other exceptions.
+    """
+    if environment is None:
+        environment = {}
+    stack: List[FloatOrArray] = []
+    for token_ in _decode(bytes(data)):
+        token_(stack, environment)
+    return stack[0]
+
+
 # NOTE: The operators in this file are in the same order as they are in the
 # RADS user manual.
 
@@ -1495,29 +3112,25 @@ class _YMDHMSType(Operator):
     ) -> None:
         x = _get_x(stack)
         if isinstance(x, np.ndarray):
-            time = np.datetime64(EPOCH) + (x * 1e6).astype("timedelta64[us]")
-            year, month, day, hour, minute, second, microsecond = ymdhmsus(time)
-            a = (
-                (year % 100) * 1e10
-                + month * 1e8
-                + day * 1e6
-                + hour * 1e4
-                + minute * 1e2
-                + second
-                + microsecond * 1e-6
+            # NaN and infinity are not valid times, they give NaN
+            finite = np.isfinite(x)
+            microseconds = (np.where(finite, x, 0) * 1e6).astype(np.int64)
+            year, month, day, hour, minute, second, microsecond = (
+                ymdhmsus_from_microseconds(microseconds + _EPOCH_MICROSECONDS)
             )
         else:
             time = EPOCH + timedelta(seconds=x)
-            a = (
-                (time.year % 100) * 1e10
-                + time.month * 1e8
-                + time.day * 1e6
-                + time.hour * 1e4
-                + time.minute * 1e2
-                + time.second
-                + time.microsecond * 1e-6
-            )
-        stack.append(a)
+            year, month, day = time.year, time.month, time.day
+            hour, minute, second = time.hour, time.minute, time.second
+            microsecond = time.microsecond
+        # integer until the microseconds, so this is exact
+        a = (
+            ((((year % 100) * 100 + month) * 100 + day) * 100 + hour) * 100 + minute
+        ) * 100 + second
+        if isinstance(x, np.ndarray):
+            stack.append(np.where(finite, a + microsecond * 1e-6, np.nan))
+        else:
+            stack.append(a + microsecond * 1e-6)
 
 
 class _SUMType(Operator):
@@ -2063,54 +3676,13 @@ class _INRANGEType(Operator):
         x, y, z = _get_xyz(stack)
         if any(isinstance(v, np.ndarray) for v in [x, y, z]):
             x, y, z = np.broadcast_arrays(x, y, z)
-            a = np.logical_and(y <= x, x <= z)
-        else:
-            a = y <= x <= z
-        stack.append(a)
-
-
-class _BOXCARType(Operator):
-    @property
-    def pops(self) -> int:
-        return 3
-
-    @property
-    def puts(self) -> int:
-        return 1
-
-    def __call__(
-        self,
-        stack: MutableSequence[FloatOrArray],
-        environment: Mapping[str, FloatOrArray],
-    ) -> None:
-        x, y, z = _get_xyz(stack)
-        if np.size(x) == 1:
-            a = x
+            a = np.logical_and(y <= x, x <= z)
         else:
-            if np.size(y) != 1:
-                raise ValueError("'y' of 'x y z BOXCAR a' must be a scalar")
-            if np.size(z) != 1:
-                raise ValueError("'z' of 'x y z BOXCAR a' must be a scalar")
-            if len(np.shape(x)) <= y:
-                raise IndexError(
-                    f"requested filter along dimension {y} but "
-                    f"'x' has only {len(np.shape(x))} dimensions"
-                )
-            kernel = Box1DKernel(z)
-            # split into slices along dimension y
-            tmp = np.moveaxis(x, y, -1)
-            slices = []
-            for slice_ in tmp.reshape(-1, np.shape(x)[y]):
-                # filter each slice
-                slices.append(
-                    convolve(slice_, kernel, boundary="extend", preserve_nan=True)
-                )
-            # recombine slices
-            a = np.moveaxis(np.array(slices).reshape(tmp.shape), -1, y)
+            a = y <= x <= z
         stack.append(a)
 
 
-class _GAUSSType(Operator):
+class _FilterType(Operator, ABC):
     @property
     def pops(self) -> int:
         return 3
@@ -2129,27 +3701,48 @@ class _GAUSSType(Operator):
             a = x
         else:
             if np.size(y) != 1:
-                raise ValueError("'y' of 'x y z GAUSS a' must be a scalar")
+                raise ValueError(f"'y' of 'x y z {self}' must be a scalar")
             if np.size(z) != 1:
-                raise ValueError("'z' of 'x y z GAUSS a' must be a scalar")
+                raise ValueError(f"'z' of 'x y z {self}' must be a scalar")
             if len(np.shape(x)) <= y:
                 raise IndexError(
                     f"requested filter along dimension {y} but "
                     f"'x' has only {len(np.shape(x))} dimensions"
                 )
-            kernel = Gaussian1DKernel(z)
-            # split into slices along dimension y
-            tmp = np.moveaxis(x, y, -1)
-            slices = []
-            for slice_ in tmp.reshape(-1, np.shape(x)[y]):
-                # filter each slice
-                slices.append(
-                    convolve(slice_, kernel, boundary="extend", preserve_nan=True)
-                )
-            # recombine slices
-            a = np.moveaxis(np.array(slices).reshape(tmp.shape), -1, y)
+            a = _filter(x, self._kernel(z), y)
         stack.append(a)
 
+    def halo(self, *args: Optional[FloatOrArray]) -> Optional[Tuple[int, int]]:
+        _, axis, size = args
+        if axis is None or size is None or np.size(axis) != 1 or np.size(size) != 1:
+            return None
+        if axis == 0:
+            radius = len(self._kernel(size)) // 2
+            return radius, radius
+        # filtering along another dimension is element wise along the first
+        return (0, 0) if axis > 0 else None
+
+    @abstractmethod
+    def _kernel(self, size: FloatOrArray) -> np.ndarray:
+        """Get the filter kernel.
+
+        :param size:
+            Size parameter of the filter.
+
+        :return:
+            1D kernel array of odd length.
+        """
+
+
+class _BOXCARType(_FilterType):
+    def _kernel(self, size: FloatOrArray) -> np.ndarray:
+        return Box1DKernel(size).array
+
+
+class _GAUSSType(_FilterType):
+    def _kernel(self, size: FloatOrArray) -> np.ndarray:
+        return Gaussian1DKernel(size).array
+
 
 # constants
 
@@ -2788,6 +4381,1673 @@ _KEYWORDS = {
 }
 
 
+# opcodes of the operators, new operators must only be added at the end to
+# keep existing bytecode valid
+_OPCODES = tuple(t for t in _KEYWORDS.values() if isinstance(t, Operator))
+_OPCODE_OF = {o: i for i, o in reversed(list(enumerate(_OPCODES)))}
+
+# opcodes of literals and variables start at these values
+_LITERAL_CODE = 0x4000
+_VARIABLE_CODE = 0x8000
+
+_BYTECODE_MAGIC = b"RPN\x01"
+
+# header giving the number of opcodes, literals, and bytes of variable names
+_BYTECODE_HEADER = struct.Struct("<4sIII")
+
+
+_STACK = OperatorKind.STACK
+_ELEMENTWISE = OperatorKind.ELEMENTWISE
+_STENCIL = OperatorKind.STENCIL
+_REDUCTION = OperatorKind.REDUCTION
+
+
+def _sum(values: List[Any]) -> FloatOrArray:
+    """Return the sum of the partial results of SUM, see OperatorInfo.combine."""
+    return cast(FloatOrArray, sum(values))
+
+
+# result types that are floating point when any argument is, see DTypeRule
+_FLOATING_RULES = (DTypeRule.FLOAT, DTypeRule.PROMOTE, DTypeRule.FIRST)
+
+_UNKNOWN_OPERATOR_INFO = OperatorInfo(
+    OperatorKind.OTHER, DTypeRule.OTHER, NaNRule.OTHER, halo=None
+)
+
+# properties of each operator, see OperatorInfo
+_OPERATOR_INFO: Dict[Operator, OperatorInfo] = {
+    SUB: OperatorInfo(_ELEMENTWISE, DTypeRule.PROMOTE, NaNRule.PROPAGATE),
+    ADD: OperatorInfo(
+        _ELEMENTWISE, DTypeRule.PROMOTE, NaNRule.PROPAGATE, commutative=True
+    ),
+    MUL: OperatorInfo(
+        _ELEMENTWISE, DTypeRule.PROMOTE, NaNRule.PROPAGATE, commutative=True
+    ),
+    POP: OperatorInfo(_STACK, DTypeRule.PRESERVE, NaNRule.PROPAGATE),
+    NEG: OperatorInfo(_ELEMENTWISE, DTypeRule.PROMOTE, NaNRule.PROPAGATE),
+    ABS: OperatorInfo(_ELEMENTWISE, DTypeRule.PROMOTE, NaNRule.PROPAGATE),
+    INV: OperatorInfo(_ELEMENTWISE, DTypeRule.FLOAT, NaNRule.PROPAGATE),
+    SQRT: OperatorInfo(_ELEMENTWISE, DTypeRule.FLOAT, NaNRule.PROPAGATE),
+    SQR: OperatorInfo(_ELEMENTWISE, DTypeRule.PROMOTE, NaNRule.PROPAGATE),
+    **{
+        operator: OperatorInfo(_ELEMENTWISE, DTypeRule.FLOAT, NaNRule.PROPAGATE)
+        for operator in (
+            EXP,
+            LOG,
+            LOG10,
+            SIN,
+            COS,
+            TAN,
+            SIND,
+            COSD,
+            TAND,
+            SINH,
+            COSH,
+            TANH,
+            ASIN,
+            ACOS,
+            ATAN,
+            ASIND,
+            ACOSD,
+            ATAND,
+            ASINH,
+            ACOSH,
+            ATANH,
+        )
+    },
+    ISNAN: OperatorInfo(_ELEMENTWISE, DTypeRule.BOOL, NaNRule.DETECT),
+    ISAN: OperatorInfo(_ELEMENTWISE, DTypeRule.BOOL, NaNRule.DETECT),
+    RINT: OperatorInfo(_ELEMENTWISE, DTypeRule.PROMOTE, NaNRule.PROPAGATE),
+    NINT: OperatorInfo(_ELEMENTWISE, DTypeRule.PROMOTE, NaNRule.PROPAGATE),
+    CEIL: OperatorInfo(_ELEMENTWISE, DTypeRule.PROMOTE, NaNRule.PROPAGATE),
+    CEILING: OperatorInfo(_ELEMENTWISE, DTypeRule.PROMOTE, NaNRule.PROPAGATE),
+    FLOOR: OperatorInfo(_ELEMENTWISE, DTypeRule.PROMOTE, NaNRule.PROPAGATE),
+    D2R: OperatorInfo(_ELEMENTWISE, DTypeRule.FLOAT, NaNRule.PROPAGATE),
+    R2D: OperatorInfo(_ELEMENTWISE, DTypeRule.FLOAT, NaNRule.PROPAGATE),
+    YMDHMS: OperatorInfo(_ELEMENTWISE, DTypeRule.DOUBLE, NaNRule.INVALID),
+    SUM: OperatorInfo(
+        _REDUCTION, DTypeRule.PROMOTE, NaNRule.SKIP, halo=None, combine=_sum
+    ),
+    DIF: OperatorInfo(
+        _STENCIL, DTypeRule.FLOAT, NaNRule.PROPAGATE, halo=(1, 0), flat=True
+    ),
+    DUP: OperatorInfo(_STACK, DTypeRule.PRESERVE, NaNRule.PROPAGATE),
+    DIV: OperatorInfo(_ELEMENTWISE, DTypeRule.FLOAT, NaNRule.PROPAGATE),
+    POW: OperatorInfo(_ELEMENTWISE, DTypeRule.PROMOTE, NaNRule.PROPAGATE),
+    FMOD: OperatorInfo(_ELEMENTWISE, DTypeRule.PROMOTE, NaNRule.PROPAGATE),
+    MIN: OperatorInfo(
+        _ELEMENTWISE, DTypeRule.PROMOTE, NaNRule.PROPAGATE, commutative=True
+    ),
+    MAX: OperatorInfo(
+        _ELEMENTWISE, DTypeRule.PROMOTE, NaNRule.PROPAGATE, commutative=True
+    ),
+    ATAN2: OperatorInfo(_ELEMENTWISE, DTypeRule.FLOAT, NaNRule.PROPAGATE),
+    HYPOT: OperatorInfo(
+        _ELEMENTWISE, DTypeRule.FLOAT, NaNRule.PROPAGATE, commutative=True
+    ),
+    R2: OperatorInfo(
+        _ELEMENTWISE, DTypeRule.PROMOTE, NaNRule.PROPAGATE, commutative=True
+    ),
+    EQ: OperatorInfo(_ELEMENTWISE, DTypeRule.BOOL, NaNRule.COMPARE, commutative=True),
+    NE: OperatorInfo(_ELEMENTWISE, DTypeRule.BOOL, NaNRule.COMPARE, commutative=True),
+    LT: OperatorInfo(_ELEMENTWISE, DTypeRule.BOOL, NaNRule.COMPARE),
+    LE: OperatorInfo(_ELEMENTWISE, DTypeRule.BOOL, NaNRule.COMPARE),
+    GT: OperatorInfo(_ELEMENTWISE, DTypeRule.BOOL, NaNRule.COMPARE),
+    GE: OperatorInfo(_ELEMENTWISE, DTypeRule.BOOL, NaNRule.COMPARE),
+    NAN: OperatorInfo(_ELEMENTWISE, DTypeRule.FLOAT, NaNRule.PROPAGATE),
+    AND: OperatorInfo(_ELEMENTWISE, DTypeRule.FIRST, NaNRule.SKIP),
+    OR: OperatorInfo(_ELEMENTWISE, DTypeRule.FLOAT, NaNRule.OTHER),
+    IAND: OperatorInfo(
+        _ELEMENTWISE, DTypeRule.INTEGER, NaNRule.INVALID, commutative=True
+    ),
+    IOR: OperatorInfo(
+        _ELEMENTWISE, DTypeRule.INTEGER, NaNRule.INVALID, commutative=True
+    ),
+    BTEST: OperatorInfo(_ELEMENTWISE, DTypeRule.BOOL, NaNRule.INVALID),
+    AVG: OperatorInfo(_ELEMENTWISE, DTypeRule.FLOAT, NaNRule.SKIP, commutative=True),
+    DXDY: OperatorInfo(
+        _STENCIL, DTypeRule.FLOAT, NaNRule.PROPAGATE, halo=(1, 1), flat=True
+    ),
+    EXCH: OperatorInfo(_STACK, DTypeRule.PRESERVE, NaNRule.PROPAGATE),
+    INRANGE: OperatorInfo(_ELEMENTWISE, DTypeRule.BOOL, NaNRule.COMPARE),
+    BOXCAR: OperatorInfo(_STENCIL, DTypeRule.FLOAT, NaNRule.SKIP, halo=None),
+    GAUSS: OperatorInfo(_STENCIL, DTypeRule.FLOAT, NaNRule.SKIP, halo=None),
+}
+
+
+# Python code used by the expression compiler for each operator.  The first
+# string must give the same result as calling the operator and the second
+# (optional) string writes the result into the floating point array `out`.
+_CODE: Dict[Operator, Tuple[str, Optional[str]]] = {
+    SUB: ("{0} - {1}", "np.subtract({0}, {1}, out={out})"),
+    ADD: ("{0} + {1}", "np.add({0}, {1}, out={out})"),
+    MUL: ("{0} * {1}", "np.multiply({0}, {1}, out={out})"),
+    NEG: ("-{0}", "np.negative({0}, out={out})"),
+    ABS: ("np.absolute({0})", "np.absolute({0}, out={out})"),
+    INV: ("1 / {0}", "np.divide(1, {0}, out={out})"),
+    SQRT: ("np.sqrt({0})", "np.sqrt({0}, out={out})"),
+    SQR: ("np.square({0})", "np.square({0}, out={out})"),
+    EXP: ("np.exp({0})", "np.exp({0}, out={out})"),
+    LOG: ("np.log({0})", "np.log({0}, out={out})"),
+    LOG10: ("np.log10({0})", "np.log10({0}, out={out})"),
+    SIN: ("np.sin({0})", "np.sin({0}, out={out})"),
+    COS: ("np.cos({0})", "np.cos({0}, out={out})"),
+    TAN: ("np.tan({0})", "np.tan({0}, out={out})"),
+    SIND: (
+        "np.sin(np.deg2rad({0}))",
+        "np.sin(np.deg2rad({0}, out={out}), out={out})",
+    ),
+    COSD: (
+        "np.cos(np.deg2rad({0}))",
+        "np.cos(np.deg2rad({0}, out={out}), out={out})",
+    ),
+    TAND: (
+        "np.tan(np.deg2rad({0}))",
+        "np.tan(np.deg2rad({0}, out={out}), out={out})",
+    ),
+    SINH: ("np.sinh({0})", "np.sinh({0}, out={out})"),
+    COSH: ("np.cosh({0})", "np.cosh({0}, out={out})"),
+    TANH: ("np.tanh({0})", "np.tanh({0}, out={out})"),
+    ASIN: ("np.arcsin({0})", "np.arcsin({0}, out={out})"),
+    ACOS: ("np.arccos({0})", "np.arccos({0}, out={out})"),
+    ATAN: ("np.arctan({0})", "np.arctan({0}, out={out})"),
+    ASIND: (
+        "np.rad2deg(np.arcsin({0}))",
+        "np.rad2deg(np.arcsin({0}, out={out}), out={out})",
+    ),
+    ACOSD: (
+        "np.rad2deg(np.arccos({0}))",
+        "np.rad2deg(np.arccos({0}, out={out}), out={out})",
+    ),
+    ATAND: (
+        "np.rad2deg(np.arctan({0}))",
+        "np.rad2deg(np.arctan({0}, out={out}), out={out})",
+    ),
+    ASINH: ("np.arcsinh({0})", "np.arcsinh({0}, out={out})"),
+    ACOSH: ("np.arccosh({0})", "np.arccosh({0}, out={out})"),
+    ATANH: ("np.arctanh({0})", "np.arctanh({0}, out={out})"),
+    ISNAN: ("np.isnan({0})", None),
+    ISAN: ("np.logical_not(np.isnan({0}))", None),
+    RINT: ("np.round({0})", "np.round({0}, out={out})"),
+    NINT: ("np.round({0})", "np.round({0}, out={out})"),
+    CEIL: ("np.ceil({0})", "np.ceil({0}, out={out})"),
+    CEILING: ("np.ceil({0})", "np.ceil({0}, out={out})"),
+    FLOOR: ("np.floor({0})", "np.floor({0}, out={out})"),
+    D2R: ("np.deg2rad({0})", "np.deg2rad({0}, out={out})"),
+    R2D: ("np.rad2deg({0})", "np.rad2deg({0}, out={out})"),
+    SUM: ("np.nansum({0})", None),
+    DIV: ("{0} / {1}", "np.divide({0}, {1}, out={out})"),
+    POW: ("np.power({0}, {1})", "np.power({0}, {1}, out={out})"),
+    FMOD: ("np.fmod({0}, {1})", "np.fmod({0}, {1}, out={out})"),
+    MIN: ("np.minimum({0}, {1})", "np.minimum({0}, {1}, out={out})"),
+    MAX: ("np.maximum({0}, {1})", "np.maximum({0}, {1}, out={out})"),
+    ATAN2: ("np.arctan2({0}, {1})", "np.arctan2({0}, {1}, out={out})"),
+    HYPOT: ("np.hypot({0}, {1})", "np.hypot({0}, {1}, out={out})"),
+    R2: ("{0} ** 2 + {1} ** 2", None),
+    EQ: ("{0} == {1}", None),
+    NE: ("{0} != {1}", None),
+    LT: ("{0} < {1}", None),
+    LE: ("{0} <= {1}", None),
+    GT: ("{0} > {1}", None),
+    GE: ("{0} >= {1}", None),
+    IAND: ("np.bitwise_and({0}, {1})", None),
+    IOR: ("np.bitwise_or({0}, {1})", None),
+}
+
+
+def _inplace_function(operator: Operator, code: str) -> Callable[..., FloatOrArray]:
+    """Create a function from the in-place code of an operator, see _CODE.
+
+    :param operator:
+        Operator to create the function for.
+    :param code:
+        Python code writing the result of the `operator` into `out`.
+
+    :return:
+        Function taking the arguments of the `operator` and the keyword
+        argument `out`, returning the result.
+    """
+    args = [f"a{i}" for i in range(operator.pops)]
+    namespace: Dict[str, Any] = {"np": np}
+    code = code.format(*args, out="out")
+    exec(
+        f"def inplace({''.join(a + ', ' for a in args)}*, out):\n    return {code}",
+        namespace,
+    )
+    return cast(Callable[..., FloatOrArray], namespace["inplace"])
+
+
+# functions writing the result of an operator into an existing array
+_INPLACE: Dict[Operator, Callable[..., FloatOrArray]] = {
+    operator: _inplace_function(operator, inplace_code)
+    for operator, (_, inplace_code) in _CODE.items()
+    if inplace_code
+}
+
+
+@lru_cache(maxsize=_PARSE_CACHE_SIZE)
+def _parse(string: str) -> Tuple[Token, ...]:
+    """Parse a string of tokens, caching the most recently parsed strings.
+
+    :param string:
+        String of tokens separated by whitespace.
+
+    :return:
+        Parsed tokens.
+
+    :raises ValueError:
+        If any of the tokens are invalid.
+    """
+    return tuple(token(t) for t in string.split())
+
+
+def _flatten(tokens: Iterable[Token]) -> Iterator[Token]:
+    """Iterate over tokens, expanding any nested expressions."""
+    for token_ in tokens:
+        if isinstance(token_, Expression):
+            yield from _flatten(token_)
+        else:
+            yield token_
+
+
+def _call(
+    operator: Token,
+    args: Sequence[FloatOrArray],
+    environment: Optional[Mapping[str, FloatOrArray]] = None,
+) -> List[FloatOrArray]:
+    """Call a token on the given arguments, returning the resulting stack.
+
+    :param operator:
+        Token to call.
+    :param args:
+        Values on the stack before calling the token.
+    :param environment:
+        A mapping to lookup variables in, only needed for tokens other than
+        the built in operators.
+
+    :return:
+        The stack after calling the token.
+    """
+    stack = list(args)
+    operator(stack, {} if environment is None else environment)
+    return stack
+
+
+def _reusable(out: FloatOrArray, *args: FloatOrArray) -> bool:
+    r"""Determine if an array can hold the result of an element wise operation.
+
+    :param out:
+        The array to store the result in.
+    :param \*args:
+        Arguments of the operation, `out` may be one of these.
+
+    :return:
+        True if `out` is a floating point array with the shape and type that
+        NumPy would give the result of an element wise operation on `args`.
+    """
+    if type(out) is not np.ndarray or out.dtype.kind != "f":
+        return False
+    for arg in args:
+        if arg is out:
+            continue
+        if np.ndim(arg) > out.ndim or np.broadcast(out, arg).shape != out.shape:
+            return False
+        if np.result_type(out, arg) != out.dtype:
+            return False
+    return True
+
+
+class _Estimated(NamedTuple):
+    shape: Tuple[int, ...]
+    dtype: Any  # NumPy type, or the value of a literal
+    temporary: bool  # True for intermediate results
+
+
+def _estimate(
+    tokens: Iterable[Token],
+    shapes: Mapping[str, Union[int, Sequence[int]]],
+    dtypes: Mapping[str, Any],
+) -> CostEstimate:
+    """Estimate the cost of evaluating tokens.
+
+    See :func:`Expression.estimate`.
+    """
+    estimate = CostEstimate()
+    stack: List[_Estimated] = []
+    for token_ in _flatten(tokens):
+        if isinstance(token_, Literal):
+            stack.append(_Estimated((), token_.value, False))
+        elif isinstance(token_, Variable):
+            shape = shapes[token_.name]
+            shape = (shape,) if isinstance(shape, int) else tuple(shape)
+            dtype = np.dtype(dtypes.get(token_.name, np.float64))
+            stack.append(_Estimated(shape, dtype, False))
+        else:
+            operator = cast(Operator, token_)
+            start = len(stack) - operator.pops
+            args = stack[start:]
+            results = _estimate_results(operator, args)
+            # the arguments are alive until the results have been computed
+            peak_bytes = _temporary_bytes(stack + results)
+            estimate.peak_bytes = max(estimate.peak_bytes, peak_bytes)
+            stack[start:] = results
+            if operator.info.kind is not OperatorKind.STACK:
+                size = max((_size(v.shape) for v in args + results), default=1)
+                name = str(operator)
+                estimate.operations[name] = estimate.operations.get(name, 0) + size
+        estimate.stack_depth = max(estimate.stack_depth, len(stack))
+    return estimate
+
+
+def _estimate_results(
+    operator: Operator, args: List[_Estimated]
+) -> List[_Estimated]:
+    """Estimate the shapes and types of the results of an operator."""
+    info = operator.info
+    if info.kind is OperatorKind.STACK:
+        stack: List[Any] = list(args)
+        operator(stack, {})
+        return stack
+    shape: Tuple[int, ...] = np.broadcast(
+        *(np.broadcast_to(False, a.shape) for a in args)
+    ).shape
+    if info.kind is OperatorKind.REDUCTION:
+        shape = ()
+    elif info.flat:
+        shape = (_size(shape),)
+    types = [a.dtype for a in args]
+    if not any(isinstance(t, np.dtype) for t in types):
+        # operators on Python scalars use double precision
+        types = [np.asarray(t).dtype for t in types]
+    dtype: np.dtype
+    if info.dtype is DTypeRule.BOOL:
+        dtype = np.dtype(bool)
+    elif info.dtype in (DTypeRule.PROMOTE, DTypeRule.INTEGER, DTypeRule.PRESERVE):
+        dtype = np.result_type(*types)
+    elif info.dtype is DTypeRule.FIRST:
+        dtype = np.result_type(types[0])
+    elif info.dtype is DTypeRule.FLOAT:
+        # integers are converted to double precision, an overestimate for
+        # some NumPy functions of small integers
+        types = [
+            np.dtype(np.float64) if isinstance(t, np.dtype) and t.kind in "biu" else t
+            for t in types
+        ]
+        dtype = np.result_type(*types, np.float16)
+    elif info.dtype is DTypeRule.DOUBLE:
+        dtype = np.dtype(np.float64)
+    else:
+        dtype = np.dtype(np.float64)  # unknown
+    return [_Estimated(shape, dtype, True) for _ in range(operator.puts)]
+
+
+def _temporary_bytes(values: Iterable[_Estimated]) -> int:
+    """Return the number of bytes of the distinct intermediate arrays in values."""
+    unique = {id(v): v for v in values if v.temporary}
+    return sum(_size(v.shape) * v.dtype.itemsize for v in unique.values())
+
+
+def _size(shape: Tuple[int, ...]) -> int:
+    """Return the number of elements of an array with the given shape."""
+    size = 1
+    for n in shape:
+        size *= n
+    return size
+
+
+def _eval_inplace(
+    tokens: Iterable[Token],
+    environment: Mapping[str, FloatOrArray],
+    dtype: Optional[Union[str, np.dtype]] = None,
+) -> FloatOrArray:
+    """Evaluate tokens, writing results into intermediate arrays.
+
+    See the `inplace` argument of :func:`CompleteExpression.eval`.
+
+    :param tokens:
+        Tokens of a complete expression.
+    :param environment:
+        Mapping to lookup variables in.
+    :param dtype:
+        Validated dtype policy, see :func:`_dtype_policy`.
+
+    :return:
+        The result of the expression.
+    """
+    stack: List[FloatOrArray] = []
+    # for each value on the stack, True if it is an intermediate result that
+    # is not referenced anywhere else and may therefore be overwritten
+    owned: List[bool] = []
+    for token_ in _flatten(tokens):
+        if not isinstance(token_, Operator):
+            token_(stack, environment)
+            owned.append(False)
+            continue
+        start = len(stack) - token_.pops
+        args, temporaries = stack[start:], owned[start:]
+        float_type = None if dtype is None else _float_type(token_, args, dtype)
+        if float_type is not None:
+            converted = [_astype(a, float_type, "iuf") for a in args]
+            # converted arguments are new arrays
+            temporaries = [
+                t or c is not a for t, c, a in zip(temporaries, converted, args)
+            ]
+            args = converted
+        del stack[start:], owned[start:]
+        out = _output(token_, args, temporaries)
+        if out is not None:
+            stack.append(_INPLACE[token_](*args, out=out))
+            owned.append(True)
+            continue
+        stack.extend(args)
+        token_(stack, environment)
+        if float_type is not None:
+            stack[start:] = [_astype(r, float_type, "f") for r in stack[start:]]
+        owned.extend(_owned(token_, args, temporaries, stack[start:]))
+    # NOTE: The stack will always have exactly one element at this point
+    #       due to the static checker of CompleteExpression.
+    return stack[0]
+
+
+def _output(
+    operator: Operator, args: Sequence[FloatOrArray], owned: Sequence[bool]
+) -> Optional[np.ndarray]:
+    """Find an argument to write the result of an operator into.
+
+    :param operator:
+        Operator to call.
+    :param args:
+        Arguments of the `operator`.
+    :param owned:
+        For each argument, True if it may be overwritten.
+
+    :return:
+        The first argument that may be overwritten and can hold the result,
+        None if there is no such argument or the `operator` can not write
+        into an existing array.
+    """
+    if operator not in _INPLACE:
+        return None
+    for arg, owned_ in zip(args, owned):
+        if owned_ and _reusable(arg, *args):
+            return cast(np.ndarray, arg)
+    return None
+
+
+def _owned(
+    operator: Operator,
+    args: Sequence[FloatOrArray],
+    owned: Sequence[bool],
+    results: Sequence[FloatOrArray],
+) -> List[bool]:
+    """Determine which results of an operator may be overwritten.
+
+    :param operator:
+        Operator that was called.
+    :param args:
+        Arguments of the `operator`.
+    :param owned:
+        For each argument, True if it may be overwritten.
+    :param results:
+        Results of the `operator`.
+
+    :return:
+        For each result, True if it is an intermediate result that is not
+        referenced anywhere else.
+    """
+    if operator in _INPLACE:
+        # element wise operators always give new values
+        return [not any(r is a for a in args) for r in results]
+    if operator.info.kind is OperatorKind.STACK:
+        # rearranged arguments can be overwritten unless they were duplicated
+        return [
+            any(r is a and o for a, o in zip(args, owned))
+            and sum(r is r_ for r_ in results) == 1
+            for r in results
+        ]
+    return [False] * len(results)
+
+
+def _compile(tokens: Iterable[Token]) -> Callable[..., FloatOrArray]:
+    """Compile a sequence of tokens into a function.
+
+    See :func:`CompleteExpression.compile`.
+
+    :param tokens:
+        Tokens of a complete expression.
+
+    :return:
+        Function evaluating the tokens with the given environment.
+    """
+    graph = ExpressionGraph()
+    outputs = graph.add(tokens)
+    uses = graph.uses(outputs)
+    namespace: Dict[str, Any] = {"np": np, "_call": _call, "_reusable": _reusable}
+    lines = ["def compiled(environment=None):", "    if environment is None:"]
+    lines.append("        environment = {}")
+    names: Dict[GraphNode, str] = {}
+    # intermediate floating point values that are only used once may be
+    # overwritten
+    owned = {
+        n
+        for n, u in uses.items()
+        if u == 1
+        and isinstance(n.token, Operator)
+        and n.token in _CODE
+        and n.token.info.dtype in _FLOATING_RULES
+    }
+    # results of operators with multiple outputs, keyed by token and arguments
+    calls: Dict[Tuple[int, ...], List[str]] = {}
+    for i, node in enumerate(graph.order(outputs)):
+        token_ = cast(Token, node.token)
+        args = [names[a] for a in node.args]
+        if isinstance(token_, Literal):
+            namespace[f"c{i}"] = token_.value
+            names[node] = f"c{i}"
+        elif isinstance(token_, Variable):
+            lines.append(f"    v{i} = environment[{repr(token_.name)}]")
+            names[node] = f"v{i}"
+        elif isinstance(token_, Operator) and token_ in _CODE:
+            code, inplace_code = _CODE[token_]
+            code = code.format(*args)
+            outs = [names[a] for a in node.args if a in owned]
+            if inplace_code and outs:
+                inplace_code = inplace_code.format(*args, out=outs[0])
+                test = f"_reusable({outs[0]}, {', '.join(args)})"
+                code = f"{inplace_code} if {test} else {code}"
+            lines.append(f"    v{i} = {code}")
+            names[node] = f"v{i}"
+        else:
+            key = (id(token_),) + tuple(id(a) for a in node.args)
+            if key not in calls:
+                namespace[f"t{i}"] = token_
+                calls[key] = [f"v{i}_{j}" for j in range(token_.puts)]
+                results = "".join(r + ", " for r in calls[key])
+                call = f"_call(t{i}, ({''.join(a + ', ' for a in args)}), environment)"
+                lines.append(f"    {results}= {call}")
+            names[node] = calls[key][node.index]
+    # NOTE: There will always be exactly one output at this point due to the
+    #       static checker of CompleteExpression.
+    lines.append(f"    return {names[outputs[0]]}")
+    exec("\n".join(lines), namespace)
+    return cast(Callable[..., FloatOrArray], namespace["compiled"])
+
+
+# operators giving the same result with the arguments exchanged
+_FLIPPED = {LT: GT, GT: LT, LE: GE, GE: LE}
+
+# operators rounding to integers, including the aliases
+_ROUNDING: Set[Operator] = {RINT, NINT, CEIL, CEILING, FLOOR}
+
+# operators that can be applied more than once without changing the result
+_IDEMPOTENT: Dict[Operator, Set[Operator]] = {
+    ABS: {ABS},
+    **{r: _ROUNDING for r in _ROUNDING},
+}
+
+# pairs of tokens that cancel out, the second set with a loss of precision
+_CANCEL = {(EXCH, EXCH), (DUP, POP), (NEG, NEG)}
+_CANCEL_FAST_MATH = {(D2R, R2D), (R2D, D2R), (INV, INV)}
+
+
+def _fold(tokens: Iterable[Token]) -> List[Token]:
+    """Replace operators that only take literal arguments with the result.
+
+    :param tokens:
+        Tokens to fold.
+
+    :return:
+        New sequence of tokens.  Operators that raise an error or give a
+        warning for their literal arguments are not replaced.
+    """
+    result: List[Token] = []
+    literals = 0  # number of literals on top of the stack
+    for token_ in tokens:
+        if isinstance(token_, Operator) and 0 < token_.pops <= literals:
+            args = [cast(Literal, t).value for t in result[-token_.pops :]]
+            try:
+                with warnings.catch_warnings():
+                    warnings.simplefilter("error")
+                    values = _call(token_, args)
+            except Exception:
+                values = None
+            # NumPy integers and booleans do not act the same as Python's in
+            # mixed type operations and are therefore not converted
+            if values is not None and all(
+                isinstance(v, (int, float, bool)) for v in values
+            ):
+                del result[-token_.pops :]
+                result.extend(Literal(cast(Union[int, float, bool], v)) for v in values)
+                literals += len(values) - token_.pops
+                continue
+        result.append(token_)
+        literals = literals + 1 if isinstance(token_, Literal) else 0
+    return result
+
+
+def _simplify(tokens: Iterable[Token], fast_math: bool = False) -> List[Token]:
+    """Remove redundant stack operations and operators.
+
+    See :func:`Expression.optimize`.
+
+    :param tokens:
+        Tokens to simplify.
+    :param fast_math:
+        Set to True to allow simplifications that change the result due to
+        rounding or overflow.
+
+    :return:
+        New sequence of tokens.
+    """
+    cancel = _CANCEL | _CANCEL_FAST_MATH if fast_math else _CANCEL
+    result: List[Token] = []
+    for token_ in tokens:
+        last = result[-1] if result else None
+        if not isinstance(last, Operator) or not isinstance(token_, Operator):
+            result.append(token_)
+        elif (last, token_) in cancel:
+            result.pop()
+        elif last is DUP and token_ is EXCH:
+            continue
+        elif token_ in _IDEMPOTENT.get(last, ()):
+            continue
+        elif last is EXCH and token_.info.commutative:
+            result[-1] = token_
+        elif last is EXCH and token_ in _FLIPPED:
+            result[-1] = _FLIPPED[token_]
+        elif fast_math and last is SQR and token_ is SQRT:
+            result[-1] = ABS
+        else:
+            result.append(token_)
+    return result
+
+
+def _cost(tokens: Sequence[Token]) -> Tuple[int, int]:
+    """Estimate the cost of evaluating a sequence of tokens.
+
+    :return:
+        The number of tokens creating new values (operators and variables)
+        followed by the total number of tokens.
+    """
+    stack_tokens = (DUP, EXCH, POP)
+    values = sum(
+        1 for t in tokens if not isinstance(t, Literal) and t not in stack_tokens
+    )
+    return values, len(tokens)
+
+
+class _ChunkError(Exception):
+    """Raised when an expression can not be evaluated in chunks."""
+
+
+def _halo(node: GraphNode) -> Tuple[int, int]:
+    """Get the number of neighbors needed by a node to compute an element.
+
+    :param node:
+        Node of an expression graph.
+
+    :return:
+        The number of elements along the first dimension needed before and
+        after an element of the arguments to compute that element of `node`.
+
+    :raises _ChunkError:
+        If the node can not be computed in chunks.
+    """
+    token_ = node.token
+    if isinstance(token_, (Literal, Variable)):
+        return 0, 0
+    if _is_reduction(node):
+        # computed before the rest of the expression
+        return 0, 0
+    if isinstance(token_, Operator):
+        constants = [
+            a.token.value if isinstance(a.token, Literal) else None for a in node.args
+        ]
+        halo = token_.halo(*constants)
+        if halo is not None:
+            return halo
+    raise _ChunkError(f"{token_} can not be evaluated in chunks")
+
+
+def _is_reduction(node: GraphNode) -> bool:
+    """Determine if a node is a reduction that can be computed in chunks."""
+    token_ = node.token
+    return (
+        isinstance(token_, Operator)
+        and token_.info.kind is OperatorKind.REDUCTION
+        and token_.info.combine is not None
+    )
+
+
+def _eval_chunked(
+    expression: CompleteExpression,
+    environment: Mapping[str, FloatOrArray],
+    chunksize: int,
+    out: Optional[np.ndarray],
+) -> FloatOrArray:
+    """Evaluate an expression in chunks along the first dimension.
+
+    See :func:`CompleteExpression.eval_chunked`.
+    """
+    graph = ExpressionGraph(expression)
+    nodes = graph.order()
+    try:
+        halos = _halos(nodes)
+    except _ChunkError:
+        return _store(expression.eval(environment), out)
+    variables = {
+        n.token.name: environment[n.token.name]
+        for n in nodes
+        if isinstance(n.token, Variable)
+    }
+    shapes = {np.shape(v) for v in variables.values() if np.ndim(v)}
+    flattens = any(isinstance(n.token, Operator) and n.token.info.flat for n in nodes)
+    if len(shapes) == 1:
+        shape = shapes.pop()
+        if shape[0] > chunksize and not (flattens and len(shape) > 1):
+            try:
+                return _eval_chunks(graph, variables, shape[0], chunksize, halos, out)
+            except _ChunkError:
+                pass
+    return _store(graph.eval(variables)[0], out)
+
+
+def _halos(nodes: Sequence[GraphNode]) -> Dict[GraphNode, Tuple[int, int]]:
+    """Get the total number of neighbors needed to compute each node.
+
+    :param nodes:
+        Nodes of an expression graph in evaluation order.
+
+    :return:
+        Mapping from each node to the number of elements along the first
+        dimension needed before and after the elements of a chunk to compute
+        the node for the chunk.
+
+    :raises _ChunkError:
+        If one of the nodes can not be computed in chunks.
+    """
+    halos: Dict[GraphNode, Tuple[int, int]] = {}
+    for node in nodes:
+        before, after = _halo(node)
+        if _is_reduction(node):
+            halos[node] = (0, 0)
+        else:
+            halos[node] = (
+                before + max((halos[a][0] for a in node.args), default=0),
+                after + max((halos[a][1] for a in node.args), default=0),
+            )
+    return halos
+
+
+def _eval_chunks(
+    graph: ExpressionGraph,
+    variables: Mapping[str, FloatOrArray],
+    size: int,
+    chunksize: int,
+    halos: Mapping[GraphNode, Tuple[int, int]],
+    out: Optional[np.ndarray],
+) -> FloatOrArray:
+    """Evaluate the output of a graph in chunks.
+
+    :param graph:
+        Graph with a single output.
+    :param variables:
+        Values of the variables used by the graph, all arrays must have the
+        same shape.
+    :param size:
+        Length of the first dimension of the arrays in `variables`.
+    :param chunksize:
+        Number of elements along the first dimension in each chunk.
+    :param halos:
+        Number of neighbors needed to compute each node, see :func:`_halos`.
+    :param out:
+        Array to store the result in.
+
+    :return:
+        The result of the graph.
+
+    :raises _ChunkError:
+        If a chunk does not give the expected shape.
+    """
+    known: Dict[GraphNode, FloatOrArray] = {}
+    for node in graph.order():
+        if _is_reduction(node):
+            operator = cast(Operator, node.token)
+            chunks = _chunks(
+                graph, node.args[0], variables, size, chunksize, halos, known
+            )
+            parts = [_call(operator, [v])[0] for _, _, v in chunks]
+            known[node] = cast(Callable[..., Any], operator.info.combine)(parts)
+    output = graph.outputs[0]
+    for start, stop, value in _chunks(
+        graph, output, variables, size, chunksize, halos, known
+    ):
+        if not np.ndim(value):
+            return _store(value, out)
+        shape = (size,) + np.shape(value)[1:]
+        if out is None:
+            out = np.empty(shape, np.result_type(value))
+        elif np.shape(out) != shape:
+            raise ValueError(
+                f"'out' has shape {np.shape(out)} but the result has shape {shape}"
+            )
+        out[start:stop] = value
+    return cast(np.ndarray, out)
+
+
+def _chunks(
+    graph: ExpressionGraph,
+    node: GraphNode,
+    variables: Mapping[str, FloatOrArray],
+    size: int,
+    chunksize: int,
+    halos: Mapping[GraphNode, Tuple[int, int]],
+    known: Mapping[GraphNode, FloatOrArray],
+) -> Iterator[Tuple[int, int, FloatOrArray]]:
+    """Evaluate a node of a graph in chunks.
+
+    See :func:`_eval_chunks` for the parameters.
+
+    :return:
+        Iterator over the start and stop index of each chunk and the value of
+        the node for the chunk.  A single value is given for the entire array
+        if the node does not depend on the arrays.
+
+    :raises _ChunkError:
+        If a chunk does not give the expected shape.
+    """
+    before, after = halos[node]
+    for start in range(0, size, chunksize):
+        stop = min(start + chunksize, size)
+        first = max(start - before, 0)
+        last = min(stop + after, size)
+        environment = {
+            k: v[first:last] if np.ndim(v) else v for k, v in variables.items()
+        }
+        value = graph._eval(environment, [node], known)[0]
+        if not np.ndim(value):
+            yield 0, size, value
+            return
+        if np.shape(value)[0] != last - first:
+            raise _ChunkError("result does not have the length of the chunk")
+        yield start, stop, cast(np.ndarray, value)[start - first : stop - first]
+
+
+def _store(value: FloatOrArray, out: Optional[np.ndarray]) -> FloatOrArray:
+    """Store a value in the given output array, if any."""
+    if out is None:
+        return value
+    if np.ndim(value) and np.shape(out) != np.shape(value):
+        raise ValueError(
+            f"'out' has shape {np.shape(out)} but the result has shape "
+            f"{np.shape(value)}"
+        )
+    out[...] = value
+    return out
+
+
+# expressions of each ParallelEvaluator, in the worker processes
+_WORKER_EXPRESSIONS: Dict[str, Mapping[Any, CompleteExpression]] = {}
+
+
+class _SharedArray(NamedTuple):
+    """Array in shared memory, returned from a worker process."""
+
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+
+def _init_worker(id_: str, expressions: Mapping[Any, CompleteExpression]) -> None:
+    """Store and compile the expressions of a :class:`ParallelEvaluator`."""
+    for expression in expressions.values():
+        expression.compile()
+    _WORKER_EXPRESSIONS[id_] = expressions
+
+
+def _eval_worker(
+    id_: str,
+    expressions: Optional[Mapping[Any, CompleteExpression]],
+    environment: Mapping[str, FloatOrArray],
+) -> Dict[Any, Union[FloatOrArray, _SharedArray]]:
+    """Evaluate the expressions of a :class:`ParallelEvaluator`.
+
+    :param id_:
+        Identifier of the evaluator.
+    :param expressions:
+        Expressions of the evaluator, if not given on initialization.
+    :param environment:
+        A mapping to lookup variables in when evaluating the expressions.
+
+    :return:
+        Mapping from each key to the result of the expression.  Arrays are
+        placed in shared memory if possible.
+    """
+    if id_ not in _WORKER_EXPRESSIONS:
+        _init_worker(id_, cast(Mapping[Any, CompleteExpression], expressions))
+    results: Dict[Any, Union[FloatOrArray, _SharedArray]] = {}
+    try:
+        for key, expression in _WORKER_EXPRESSIONS[id_].items():
+            results[key] = _share(expression.compile()(environment))
+    except BaseException:
+        for value in results.values():
+            _unshare(value, keep=False)
+        raise
+    return results
+
+
+def _share(value: FloatOrArray) -> Union[FloatOrArray, _SharedArray]:
+    """Place an array in shared memory, owned by the receiving process.
+
+    :param value:
+        Number or array to share.
+
+    :return:
+        The shared array, or the given `value` if it can not be shared.
+    """
+    if (
+        shared_memory is None
+        or type(value) is not np.ndarray
+        or value.dtype.hasobject
+        or not value.nbytes
+    ):
+        return value
+    if sys.version_info >= (3, 13):
+        memory = shared_memory.SharedMemory(create=True, size=value.nbytes, track=False)
+    else:
+        memory = shared_memory.SharedMemory(create=True, size=value.nbytes)
+        # the receiving process is responsible for unlinking the memory
+        resource_tracker.unregister(memory._name, "shared_memory")  # type: ignore
+    try:
+        np.ndarray(value.shape, value.dtype, buffer=memory.buf)[...] = value
+    finally:
+        memory.close()
+    return _SharedArray(memory.name, value.shape, value.dtype.str)
+
+
+def _unshare(
+    value: Union[FloatOrArray, _SharedArray], keep: bool = True
+) -> Optional[FloatOrArray]:
+    """Retrieve an array from shared memory, without copying it.
+
+    The shared memory is released once the array (and every view of it) is
+    garbage collected.
+
+    :param value:
+        Value returned by :func:`_share`.
+    :param keep:
+        Set to False to release the memory at once, without using the array.
+
+    :return:
+        The array or other value given to :func:`_share`, None if `keep` is
+        False.
+    """
+    if not isinstance(value, _SharedArray):
+        return value if keep else None
+    memory = shared_memory.SharedMemory(name=value.name)
+    if not keep:
+        _release_shared_memory(memory)
+        return None
+    array = np.ndarray(value.shape, np.dtype(value.dtype), buffer=memory.buf)
+    # views of the array refer to it as their base, keeping it alive
+    finalize(array, _release_shared_memory, memory)
+    return array
+
+
+def _release_shared_memory(memory: Any) -> None:
+    """Close and unlink shared memory."""
+    memory.close()
+    memory.unlink()
+
+
+def _release_futures(futures: Deque["Future[Any]"]) -> None:
+    """Cancel evaluations and release the shared memory of their results.
+
+    :param futures:
+        Futures of :func:`_eval_worker` whose results will not be used, these
+        are removed.
+    """
+    while futures:
+        future = futures.popleft()
+        if not future.cancel():
+            try:
+                results = future.result()
+            except Exception:
+                continue
+            for value in results.values():
+                _unshare(value, keep=False)
+
+
+_D2R = repr(math.pi / 180)
+_R2D = repr(180 / math.pi)
+
+# numexpr templates of the operators that numexpr evaluates with the same
+# result as NumPy when given double precision arguments
+_NUMEXPR: Dict[Operator, str] = {
+    SUB: "{0} - {1}",
+    ADD: "{0} + {1}",
+    MUL: "{0} * {1}",
+    NEG: "-{0}",
+    ABS: "abs({0})",
+    INV: "1 / {0}",
+    SQRT: "sqrt({0})",
+    SQR: "{0} ** 2",
+    EXP: "exp({0})",
+    LOG: "log({0})",
+    LOG10: "log10({0})",
+    SIN: "sin({0})",
+    COS: "cos({0})",
+    TAN: "tan({0})",
+    SIND: f"sin({{0}} * {_D2R})",
+    COSD: f"cos({{0}} * {_D2R})",
+    TAND: f"tan({{0}} * {_D2R})",
+    SINH: "sinh({0})",
+    COSH: "cosh({0})",
+    TANH: "tanh({0})",
+    ASIN: "arcsin({0})",
+    ACOS: "arccos({0})",
+    ATAN: "arctan({0})",
+    ASIND: f"arcsin({{0}}) * {_R2D}",
+    ACOSD: f"arccos({{0}}) * {_R2D}",
+    ATAND: f"arctan({{0}}) * {_R2D}",
+    ASINH: "arcsinh({0})",
+    ACOSH: "arccosh({0})",
+    ATANH: "arctanh({0})",
+    ISNAN: "{0} != {0}",
+    ISAN: "{0} == {0}",
+    D2R: f"{{0}} * {_D2R}",
+    R2D: f"{{0}} * {_R2D}",
+    DIV: "{0} / {1}",
+    POW: "{0} ** {1}",
+    ATAN2: "arctan2({0}, {1})",
+    R2: "{0} ** 2 + {1} ** 2",
+    EQ: "{0} == {1}",
+    NE: "{0} != {1}",
+    LT: "{0} < {1}",
+    LE: "{0} <= {1}",
+    GT: "{0} > {1}",
+    GE: "{0} >= {1}",
+    NAN: "where({0} == {1}, nan, {0})",
+    AND: "where({0} != {0}, {1}, {0})",
+    OR: "where(({0} != {0}) | ({1} != {1}), {1}, {0})",
+    AVG: "where({0} != {0}, {1}, where({1} != {1}, {0}, ({0} + {1}) / 2))",
+    INRANGE: "({1} <= {0}) & ({0} <= {2})",
+}
+
+# maximum number of distinct variables in a numexpr expression
+_NUMEXPR_MAX_NAMES = 32
+
+
+class _NumExpr(NamedTuple):
+    code: str
+    kind: Optional[str]  # "f" (double), "i" (integer scalar), "b" or None
+    array: bool
+    names: FrozenSet[str]
+
+
+def _eval_numexpr(
+    expression: CompleteExpression, environment: Mapping[str, FloatOrArray]
+) -> FloatOrArray:
+    """Evaluate an expression with numexpr where possible.
+
+    See :func:`CompleteExpression.eval_numexpr`.
+    """
+    graph = expression._graph
+    leaves = {
+        n: graph._eval_node(n, {}, environment)
+        for n in graph.order()
+        if isinstance(n.token, (Literal, Variable))
+    }
+    arrays = [v for v in leaves.values() if np.ndim(v)]
+    if numexpr is None or not any(_numexpr_kind(v) == "f" for v in arrays):
+        return graph._eval(environment, graph.outputs, leaves)[0]
+    return _NumExprEvaluator(graph, leaves, environment).eval()
+
+
+class _NumExprEvaluator:
+    """Evaluate a graph, combining element wise operators into numexpr calls.
+
+    Nodes that are used more than once are evaluated and stored, the others
+    are only evaluated as part of the expression of the node using them.
+    """
+
+    def __init__(
+        self,
+        graph: ExpressionGraph,
+        leaves: Mapping[GraphNode, FloatOrArray],
+        environment: Mapping[str, FloatOrArray],
+    ):
+        self._graph = graph
+        self._leaves = leaves
+        self._environment = environment
+        self._locals: Dict[str, FloatOrArray] = {"nan": np.nan}
+        self._terms: Dict[GraphNode, _NumExpr] = {}
+        self._calls: Dict[Any, List[FloatOrArray]] = {}
+
+    def eval(self) -> FloatOrArray:
+        uses = self._graph.uses()
+        for node in self._graph.order():
+            if node in self._leaves:
+                self._terms[node] = self._name(self._leaves[node])
+            else:
+                self._terms[node] = self._combine(node) or self._call(node)
+            # discarded nodes are evaluated for their errors
+            if uses[node] != 1:
+                self._materialize(node)
+        return self._value(self._graph.outputs[0])
+
+    def _combine(self, node: GraphNode) -> Optional[_NumExpr]:
+        """Build the numexpr expression of a node, None if not possible."""
+        operator = cast(Operator, node.token)
+        template = _NUMEXPR.get(operator)
+        info = operator.info
+        terms = [self._terms[a] for a in node.args]
+        kinds = [t.kind for t in terms]
+        if (
+            template is None
+            or not set(kinds) <= {"f", "i"}
+            or "f" not in kinds
+            or not any(t.array for t in terms)
+            or (info.dtype is DTypeRule.FIRST and kinds[0] != "f")
+        ):
+            return None
+        names = frozenset().union(*(t.names for t in terms))
+        for i, arg in enumerate(node.args):
+            # store arguments instead of evaluating them multiple times
+            if template.count(f"{{{i}}}") > 1 or len(names) > _NUMEXPR_MAX_NAMES:
+                self._materialize(arg)
+        terms = [self._terms[a] for a in node.args]
+        return _NumExpr(
+            f"({template.format(*(t.code for t in terms))})",
+            "b" if info.dtype is DTypeRule.BOOL else "f",
+            True,
+            frozenset().union(*(t.names for t in terms)),
+        )
+
+    def _call(self, node: GraphNode) -> _NumExpr:
+        """Evaluate a node with the operator itself."""
+        key = (id(node.token), node.args)
+        if key not in self._calls:
+            args = [self._value(a) for a in node.args]
+            token_ = cast(Token, node.token)
+            self._calls[key] = _call(token_, args, self._environment)
+        return self._name(self._calls[key][node.index])
+
+    def _name(self, value: FloatOrArray) -> _NumExpr:
+        """Store a value, giving it a name in numexpr expressions."""
+        name = f"v{len(self._locals)}"
+        self._locals[name] = value
+        kind = _numexpr_kind(value)
+        return _NumExpr(name, kind, np.ndim(value) > 0, frozenset([name]))
+
+    def _materialize(self, node: GraphNode) -> None:
+        """Evaluate and store the value of a node."""
+        code = self._terms[node].code
+        if code not in self._locals:
+            value = numexpr.evaluate(code, local_dict=self._locals)
+            self._terms[node] = self._name(value)
+
+    def _value(self, node: GraphNode) -> FloatOrArray:
+        self._materialize(node)
+        return self._locals[self._terms[node].code]
+
+
+def _numexpr_kind(value: FloatOrArray) -> Optional[str]:
+    """Classify a value by how it can be used in a numexpr expression.
+
+    :return:
+        "f" for double precision values, "i" for integer scalars, "b" for
+        logical values, and None for values numexpr can not be used with.
+    """
+    if isinstance(value, np.ndarray):
+        if type(value) is not np.ndarray:  # masked arrays and other subclasses
+            return None
+        dtype = value.dtype
+    elif isinstance(value, (bool, np.bool_)):
+        return "b"
+    elif isinstance(value, (int, np.integer)):
+        return "i" if -(2 ** 63) <= value < 2 ** 63 else None
+    elif isinstance(value, float):
+        return "f"
+    else:
+        return None
+    if dtype == np.float64:
+        return "f"
+    if dtype == np.bool_:
+        return "b"
+    return None
+
+
+def _dask_array() -> Any:
+    """Get the dask.array module if it has been imported, otherwise None.
+
+    There can not be any dask arrays before it is imported, this avoids the
+    cost of importing dask when it is not used.
+    """
+    return sys.modules.get("dask.array")
+
+
+def _uses_dask(
+    expression: CompleteExpression, environment: Mapping[str, FloatOrArray]
+) -> bool:
+    """Determine if any variable of an expression is a dask array.
+
+    Missing variables are not dask arrays, the error of looking them up is
+    left to the evaluation.
+    """
+    da = _dask_array()
+    return da is not None and any(
+        isinstance(environment.get(v), da.Array) for v in expression.variables
+    )
+
+
+def _eval_dask(
+    tokens: Iterable[Token],
+    environment: Mapping[str, FloatOrArray],
+    dtype: Optional[Union[str, np.dtype]] = None,
+) -> FloatOrArray:
+    """Evaluate tokens lazily on dask arrays.
+
+    See :func:`CompleteExpression.eval`.
+    """
+    da = _dask_array()
+    stack: List[FloatOrArray] = []
+    for token_ in _flatten(tokens):
+        start = len(stack) - token_.pops
+        if isinstance(token_, Operator) and any(
+            isinstance(a, da.Array) for a in stack[start:]
+        ):
+            args = stack[start:]
+            float_type = None if dtype is None else _float_type(token_, args, dtype)
+            if float_type is not None:
+                args = [_astype(a, float_type, "iuf") for a in args]
+            del stack[start:]
+            stack.extend(_call_dask(token_, args))
+            if float_type is not None:
+                stack[start:] = [_astype(r, float_type, "f") for r in stack[start:]]
+        else:
+            _call_with_dtype(token_, stack, environment, dtype)
+    # NOTE: The stack will always have exactly one element at this point
+    #       due to the static checker of CompleteExpression.
+    return stack[0]
+
+
+def _call_dask(operator: Operator, args: Sequence[FloatOrArray]) -> List[Any]:
+    """Call an operator lazily on arguments including dask arrays.
+
+    :param operator:
+        Operator to call.
+    :param args:
+        Arguments of the `operator`.
+
+    :return:
+        Results of the `operator`, dask arrays unless the `operator` is not
+        known to be element wise, a stencil or a reduction (or has more than
+        one result), in which case it is called on the dask arrays directly.
+    """
+    da = _dask_array()
+    info = operator.info
+    if operator.puts != 1:
+        return _call(operator, args)
+    if info.kind is OperatorKind.ELEMENTWISE:
+        function, arrays = _block_function(operator, args)
+        dtype = _dask_dtype(operator, args)
+        return [da.map_blocks(function, *arrays, dtype=dtype)]
+    if info.kind is OperatorKind.REDUCTION and info.combine and len(args) == 1:
+        return [_reduce_dask(operator, args[0])]
+    if info.kind is OperatorKind.STENCIL:
+        halo = operator.halo(*(None if isinstance(a, da.Array) else a for a in args))
+        if halo is not None:
+            return [_map_overlap(operator, args, halo)]
+    return _call(operator, args)
+
+
+def _map_overlap(
+    operator: Operator, args: Sequence[FloatOrArray], halo: Tuple[int, int]
+) -> Any:
+    """Apply a stencil operator to overlapping blocks of dask arrays.
+
+    :param operator:
+        Stencil operator to call.
+    :param args:
+        Arguments of the `operator`.
+    :param halo:
+        Number of neighboring elements needed before and after each element
+        along the first dimension.
+
+    :return:
+        The lazy result.
+    """
+    da = _dask_array()
+    if operator.info.flat:
+        arrays = da.broadcast_arrays(*(a for a in args if np.ndim(a)))
+        flat = iter(a.ravel() for a in arrays)
+        args = [next(flat) if np.ndim(a) else a for a in args]
+    # neighbors are only known along the first dimension
+    args = [
+        a.rechunk({i: -1 for i in range(1, a.ndim)})
+        if isinstance(a, da.Array)
+        else a
+        for a in args
+    ]
+    function, arrays = _block_function(operator, args)
+    return da.map_overlap(
+        function,
+        *arrays,
+        depth={0: halo},
+        boundary="none",
+        dtype=_dask_dtype(operator, args),
+        align_arrays=True,
+    )
+
+
+def _reduce_dask(operator: Operator, x: Any) -> Any:
+    """Apply a reduction operator to a dask array as a tree reduction.
+
+    The operator is applied to each block and the results combined with
+    :attr:`OperatorInfo.combine`.
+    """
+    da = _dask_array()
+    return da.reduction(
+        x,
+        partial(_reduce_block, operator),
+        partial(_combine_blocks, operator),
+        combine=partial(_combine_blocks, operator),
+        dtype=_dask_dtype(operator, [x]),
+        concatenate=False,
+    )
+
+
+def _block_function(
+    operator: Operator, args: Sequence[FloatOrArray]
+) -> Tuple[Callable[..., FloatOrArray], List[FloatOrArray]]:
+    """Create a function applying an operator to blocks of its array arguments.
+
+    :return:
+        The function, taking the blocks of the array arguments (in order),
+        and the array arguments as dask arrays broadcast against each other.
+        Scalar arguments, other than dask arrays (such as the result of a
+        reduction), are part of the function.
+    """
+    da = _dask_array()
+    constants = [
+        None if isinstance(a, da.Array) or np.ndim(a) else a for a in args
+    ]
+    arrays = da.broadcast_arrays(
+        *(da.asarray(a) for a, c in zip(args, constants) if c is None)
+    )
+    return partial(_apply_to_blocks, operator, constants), arrays
+
+
+def _apply_to_blocks(
+    operator: Operator, constants: Sequence[Any], *blocks: FloatOrArray
+) -> FloatOrArray:
+    """Call an operator on blocks, with constants in place of None."""
+    blocks_ = iter(blocks)
+    args = [next(blocks_) if c is None else c for c in constants]
+    return _call(operator, args)[0]
+
+
+def _reduce_block(
+    operator: Operator, x: np.ndarray, axis: Any, keepdims: bool
+) -> np.ndarray:
+    """Apply a reduction operator to a block, see :func:`dask.array.reduction`."""
+    return np.reshape(_call(operator, [x])[0], (1,) * x.ndim)
+
+
+def _combine_blocks(
+    operator: Operator, x: Any, axis: Any, keepdims: bool
+) -> FloatOrArray:
+    """Combine the results of a reduction operator on blocks."""
+    # nested lists of the results of each block (or of previous combines)
+    parts = list(_flatten_lists(x))
+    value = cast(Callable[..., Any], operator.info.combine)(parts)
+    return np.reshape(value, (1,) * len(axis)) if keepdims else value
+
+
+def _flatten_lists(x: Any) -> Iterator[Any]:
+    """Iterate over the elements of nested lists of arrays."""
+    if isinstance(x, list):
+        for item in x:
+            yield from _flatten_lists(item)
+    else:
+        yield from np.ravel(x)
+
+
+def _dask_dtype(operator: Operator, args: Sequence[FloatOrArray]) -> np.dtype:
+    """Determine the type of the result of an operator on dask arrays.
+
+    The operator is called on single element arrays of ones, with the types
+    of the arguments.
+    """
+    samples = [
+        np.ones((1,) * a.ndim, a.dtype) if isinstance(a, _dask_array().Array) else a
+        for a in args
+    ]
+    with warnings.catch_warnings(), np.errstate(all="ignore"):
+        warnings.simplefilter("ignore")
+        dtype: np.dtype = np.result_type(_call(operator, samples)[0])
+    return dtype
+
+
+def _encode(tokens: Iterable[Token]) -> bytes:
+    """Encode tokens as bytecode, see :func:`CompleteExpression.to_bytes`."""
+    codes: List[int] = []
+    literals: Dict[Any, int] = {}
+    tags = bytearray()
+    values = bytearray()
+    names: Dict[str, int] = {}
+    for token_ in _flatten(tokens):
+        if isinstance(token_, Literal):
+            value = token_.value
+            key = (type(value), repr(value))
+            if key not in literals:
+                literals[key] = len(literals)
+                if isinstance(value, float):
+                    tags += b"f"
+                    values += struct.pack("<d", value)
+                elif -(2 ** 63) <= value < 2 ** 63:
+                    tags += b"b" if isinstance(value, bool) else b"i"
+                    values += struct.pack("<q", value)
+                else:
+                    raise ValueError(f"literal '{value}' does not fit in 64 bits")
+            codes.append(_LITERAL_CODE + literals[key])
+        elif isinstance(token_, Variable):
+            codes.append(_VARIABLE_CODE + names.setdefault(token_.name, len(names)))
+        elif isinstance(token_, Operator) and token_ in _OPCODE_OF:
+            codes.append(_OPCODE_OF[token_])
+        else:
+            raise ValueError(f"'{token_}' can not be encoded in bytecode")
+    if len(literals) > _VARIABLE_CODE - _LITERAL_CODE:
+        raise ValueError("too many literals to encode in bytecode")
+    if len(names) > 0x10000 - _VARIABLE_CODE:
+        raise ValueError("too many variables to encode in bytecode")
+    names_bytes = " ".join(names).encode("utf-8")
+    header = _BYTECODE_HEADER.pack(
+        _BYTECODE_MAGIC, len(codes), len(literals), len(names_bytes)
+    )
+    codes_bytes = struct.pack(f"<{len(codes)}H", *codes)
+    return b"".join([header, codes_bytes, tags, values, names_bytes])
+
+
+@lru_cache(maxsize=_PARSE_CACHE_SIZE)
+def _decode(data: bytes) -> Tuple[Token, ...]:
+    """Decode bytecode, caching the most recently decoded bytecode.
+
+    :param data:
+        Bytecode given by :func:`CompleteExpression.to_bytes`.
+
+    :return:
+        The tokens of the expression.
+
+    :raises ValueError:
+        If `data` is not valid bytecode of a complete expression.
+    """
+    try:
+        magic, num_codes, num_literals, num_bytes = _BYTECODE_HEADER.unpack_from(
+            data
+        )
+        offset = _BYTECODE_HEADER.size
+        codes = struct.unpack_from(f"<{num_codes}H", data, offset)
+        offset += 2 * num_codes
+        tags = data[offset : offset + num_literals].decode("ascii")
+        offset += num_literals
+        literals = [
+            Literal(_unpack_literal(t, data, offset + 8 * i))
+            for i, t in enumerate(tags)
+        ]
+        offset += 8 * num_literals
+        names = data[offset : offset + num_bytes].decode("utf-8").split()
+        variables = [Variable(n) for n in names]
+        offset += num_bytes
+    except (struct.error, UnicodeDecodeError) as err:
+        raise ValueError("invalid RPN bytecode") from err
+    if magic != _BYTECODE_MAGIC or offset != len(data) or len(tags) != num_literals:
+        raise ValueError("invalid RPN bytecode")
+    return _bytecode_tokens(codes, literals, variables)
+
+
+def _bytecode_tokens(
+    codes: Iterable[int], literals: Sequence[Literal], variables: Sequence[Variable]
+) -> Tuple[Token, ...]:
+    """Get the tokens of opcodes, checking that they form a complete expression.
+
+    :raises ValueError:
+        If an opcode is invalid or the tokens do not form a complete
+        expression.
+    """
+    tokens: List[Token] = []
+    stack_size = 0
+    for code in codes:
+        try:
+            if code >= _VARIABLE_CODE:
+                token_: Token = variables[code - _VARIABLE_CODE]
+            elif code >= _LITERAL_CODE:
+                token_ = literals[code - _LITERAL_CODE]
+            else:
+                token_ = _OPCODES[code]
+        except IndexError:
+            raise ValueError(f"invalid opcode {code} in RPN bytecode") from None
+        stack_size -= token_.pops
+        if stack_size < 0:
+            raise ValueError("RPN bytecode underflows the stack")
+        stack_size += token_.puts
+        tokens.append(token_)
+    if stack_size != 1:
+        raise ValueError("RPN bytecode is not a complete expression")
+    return tuple(tokens)
+
+
+def _unpack_literal(tag: str, data: bytes, offset: int) -> Union[int, float, bool]:
+    if tag == "f":
+        return cast(float, struct.unpack_from("<d", data, offset)[0])
+    if tag == "i":
+        return cast(int, struct.unpack_from("<q", data, offset)[0])
+    if tag == "b":
+        return bool(struct.unpack_from("<q", data, offset)[0])
+    raise ValueError("invalid RPN bytecode")
+
+
+# the RADS epoch in microseconds since 1970-01-01, see YMDHMS
+_EPOCH_MICROSECONDS = (EPOCH - datetime(1970, 1, 1)) // timedelta(microseconds=1)
+
+
+# profiler recording evaluations (the last of the enabled profilers), see Profiler
+_PROFILER: Optional[Profiler] = None
+_PROFILERS: List[Profiler] = []
+_PROFILERS_LOCK = threading.Lock()
+
+
+def _dtype_name(value: FloatOrArray) -> str:
+    """Name of the NumPy type of an array or of the Python type of a scalar."""
+    dtype = getattr(value, "dtype", None)
+    return dtype.name if dtype is not None else type(value).__name__
+
+
+def _dtype_policy(dtype: Any) -> Optional[Union[str, np.dtype]]:
+    """Validate a dtype policy, see :func:`CompleteExpression.eval`.
+
+    :raises ValueError:
+        If `dtype` is not None, "preserve" or a single or double precision
+        type.
+    """
+    if dtype is None or isinstance(dtype, str) and dtype == "preserve":
+        return dtype
+    try:
+        policy: np.dtype = np.dtype(dtype)
+    except TypeError:
+        raise ValueError(f"invalid dtype policy '{dtype}'") from None
+    if policy not in (np.float32, np.float64):
+        raise ValueError(f"invalid dtype policy '{dtype}'")
+    return policy
+
+
+def _call_with_dtype(
+    token_: Token,
+    stack: MutableSequence[FloatOrArray],
+    environment: Mapping[str, FloatOrArray],
+    dtype: Optional[Union[str, np.dtype]],
+) -> None:
+    """Call a token, converting floating point values to the `dtype` policy."""
+    if dtype is None or not isinstance(token_, Operator):
+        token_(stack, environment)
+        return
+    start = len(stack) - token_.pops
+    float_type = _float_type(token_, stack[start:], dtype)
+    if float_type is None:
+        token_(stack, environment)
+        return
+    stack[start:] = [_astype(a, float_type, "iuf") for a in stack[start:]]
+    token_(stack, environment)
+    start = len(stack) - token_.puts
+    stack[start:] = [_astype(r, float_type, "f") for r in stack[start:]]
+
+
+def _float_type(
+    operator: Operator,
+    args: Sequence[FloatOrArray],
+    dtype: Union[str, np.dtype],
+) -> Optional[np.dtype]:
+    """Determine the floating point type to compute an operator in.
+
+    :return:
+        The type to convert the arguments and results of the `operator` to,
+        None if they must not be converted.
+    """
+    rule = operator.info.dtype
+    if rule not in _FLOATING_RULES:
+        return None
+    types: List[np.dtype] = []
+    for arg in args:
+        type_ = getattr(arg, "dtype", None)
+        if type_ is not None and type_.kind in "iuf":
+            types.append(type_)
+    if not types:
+        return None
+    floating = any(isinstance(a, float) for a in args)
+    floating = floating or any(t.kind == "f" for t in types)
+    if rule is not DTypeRule.FLOAT and not floating:
+        return None  # integer arithmetic
+    if isinstance(dtype, str):  # "preserve"
+        float_type: np.dtype = np.result_type(*(_exact_float(t) for t in types))
+        return float_type
+    return dtype
+
+
+def _exact_float(dtype: np.dtype) -> np.dtype:
+    """Get the smallest floating point type that represents a type exactly."""
+    float_type: np.dtype = np.promote_types(dtype, np.float32)
+    return float_type
+
+
+def _astype(value: FloatOrArray, dtype: np.dtype, kinds: str) -> FloatOrArray:
+    """Convert NumPy arrays and scalars of the given kinds to a type."""
+    value_dtype = getattr(value, "dtype", None)
+    if value_dtype is None or value_dtype == dtype or value_dtype.kind not in kinds:
+        return value
+    return cast(np.ndarray, value).astype(dtype)
+
+
 def _is_integer(x: FloatOrArray) -> bool:
     """Determine if number is an integer or array of integers.
 
@@ -2802,6 +6062,41 @@ def _is_integer(x: FloatOrArray) -> bool:
     return isinstance(x, Integral)
 
 
+def _filter(x: np.ndarray, kernel: np.ndarray, axis: int) -> np.ndarray:
+    """Filter an array along the given axis, skipping NaN values.
+
+    This is a normalized convolution that gives the same results as
+    :func:`astropy.convolution.convolve` with :code:`boundary="extend"` and
+    :code:`preserve_nan=True` on each 1D slice along the `axis`, but filters
+    all slices at once.
+
+    :param x:
+        Array to filter.
+    :param kernel:
+        1D kernel array of odd length.
+    :param axis:
+        Axis to filter along.
+
+    :return:
+        The filtered array.  This will have the same dtype as `x` if it is
+        floating point or :code:`float64` otherwise.  NaN values of `x` are
+        kept as NaN.
+    """
+    x = np.asarray(x)
+    dtype = x.dtype if x.dtype.kind == "f" else np.float64
+    data = x.astype(np.float64)
+    isnan = np.isnan(data)
+    if not isnan.any():
+        a = convolve1d(data, kernel, axis, mode="nearest") / np.sum(kernel)
+        return a.astype(dtype, copy=False)
+    data[isnan] = 0
+    weights = convolve1d((~isnan).astype(np.float64), kernel, axis, mode="nearest")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        a = convolve1d(data, kernel, axis, mode="nearest") / weights
+    a[isnan] = np.nan
+    return a.astype(dtype, copy=False)
+
+
 def _get_x(stack: MutableSequence[FloatOrArray]) -> FloatOrArray:
     if not stack:
         raise StackUnderflowError(
@@ -31,7 +31,7 @@ checks_require = [
     "pydocstyle",
     "typing-extensions",
 ]
-tests_require = ["pytest", "pytest-cov", "pytest-mock"]
+tests_require = ["dask[array]", "numexpr", "pytest", "pytest-cov", "pytest-mock"]
 dev_requires = ["black", "isort", "twine"]
 
 if os.environ.get("READTHEDOCS") == "True":
@@ -63,7 +63,7 @@ setup(
     long_description_content_type="text/x-rst",
     license="MIT",
     url="https://github.com/ccarocean/pyrads",
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks"]),
     package_data={
         "rads": ["py.typed"],
         "rads.config": ["py.typed"],
@@ -74,6 +74,8 @@ setup(
     install_requires=install_requires,
     extras_require={
         "lxml": ["lxml"],  # use libxml2 to read configuration files
+        "numexpr": ["numexpr"],  # evaluate RPN expressions with numexpr
+        "dask": ["dask[array]"],  # evaluate RPN expressions on dask arrays
         "checks": checks_require,
         "tests": tests_require,
         "docs": docs_require,
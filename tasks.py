@@ -16,7 +16,7 @@ def check_typing(c):
 @task
 def check_style(c):
     """check code style"""
-    c.run("flake8 setup.py tasks.py rads tests")
+    c.run("flake8 setup.py tasks.py rads tests benchmarks")
 
 
 @task
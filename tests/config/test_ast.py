@@ -0,0 +1,97 @@
+from rads.config.ast import (
+    Alias,
+    Assignment,
+    CompoundStatement,
+    FalseCondition,
+    If,
+    NullStatement,
+    Phase,
+    SatelliteCondition,
+    SatelliteID,
+    Satellites,
+    TrueCondition,
+    append,
+    partition_satellites,
+)
+
+SATELLITES = ["e1", "e2", "j1", "j2"]
+
+
+def test_condition_match_satellites():
+    assert TrueCondition().match_satellites(SATELLITES) is None
+    assert FalseCondition().match_satellites(SATELLITES) == set()
+    condition = SatelliteCondition({"j1", "j2", "n1"})
+    assert condition.match_satellites(SATELLITES) == {"j1", "j2"}
+    condition = SatelliteCondition({"j1", "j2"}, invert=True)
+    assert condition.match_satellites(SATELLITES) == {"e1", "e2"}
+
+
+def test_statement_match_satellites():
+    j1 = SatelliteCondition({"j1"})
+    assert NullStatement().match_satellites(SATELLITES) == set()
+    assert Assignment("a", 1).match_satellites(SATELLITES) is None
+    assert Assignment("a", 1, j1).match_satellites(SATELLITES) == {"j1"}
+    assert Alias("a", ["b"], j1).match_satellites(SATELLITES) == {"j1"}
+    assert Phase(NullStatement(), j1).match_satellites(SATELLITES) == {"j1"}
+    assert SatelliteID("j1", "JA1").match_satellites(SATELLITES) == {"j1"}
+    assert SatelliteID("n1", "NN1").match_satellites(SATELLITES) == set()
+    satellites = Satellites(SatelliteID("j1", "JA1"), SatelliteID("n1", "NN1"))
+    assert satellites.match_satellites(SATELLITES) == {"j1"}
+    compound = CompoundStatement(
+        Assignment("a", 1, j1), Assignment("a", 1, SatelliteCondition({"j2"}))
+    )
+    assert compound.match_satellites(SATELLITES) == {"j1", "j2"}
+    compound = CompoundStatement(Assignment("a", 1, j1), Assignment("a", 1))
+    assert compound.match_satellites(SATELLITES) is None
+
+
+def test_if_match_satellites():
+    j = SatelliteCondition({"j1", "j2"})
+    j1 = SatelliteCondition({"j1"})
+    e1 = SatelliteCondition({"e1"})
+    assert If(j, Assignment("a", 1)).match_satellites(SATELLITES) == {"j1", "j2"}
+    statement = If(j, Assignment("a", 1, j1))
+    assert statement.match_satellites(SATELLITES) == {"j1"}
+    statement = If(j, Assignment("a", 1, j1), Assignment("a", 1, e1))
+    assert statement.match_satellites(SATELLITES) == {"e1", "j1"}
+    statement = If(j, NullStatement(), Assignment("a", 1))
+    assert statement.match_satellites(SATELLITES) == {"e1", "e2"}
+    statement = If(TrueCondition(), NullStatement(), Assignment("a", 1))
+    assert statement.match_satellites(SATELLITES) == set()
+
+
+def test_partition_satellites():
+    unconditional = Assignment("a", 1)
+    j1 = Assignment("b", 2, SatelliteCondition({"j1"}))
+    not_j1 = Assignment("b", 3, SatelliteCondition({"j1"}, invert=True))
+    e = If(SatelliteCondition({"e1", "e2"}), Assignment("c", 4))
+    statement = CompoundStatement(
+        unconditional, CompoundStatement(j1, NullStatement()), not_j1, e
+    )
+    partitions = partition_satellites(statement, SATELLITES)
+    assert list(partitions) == SATELLITES
+    assert list(partitions["e1"]) == [unconditional, not_j1, e]
+    assert list(partitions["e2"]) == [unconditional, not_j1, e]
+    assert list(partitions["j1"]) == [unconditional, j1]
+    assert list(partitions["j2"]) == [unconditional, not_j1]
+
+
+def test_partition_satellites_evaluates_identically():
+    statement = CompoundStatement(
+        Assignment("a", [1]),
+        Assignment("a", [2], SatelliteCondition({"j1", "e2"}), action=append),
+        If(
+            SatelliteCondition({"j1"}, invert=True),
+            CompoundStatement(Assignment("b", 1), Assignment("a", [3], action=append)),
+            Assignment("b", 2),
+        ),
+        Alias("x", ["a", "b"], SatelliteCondition({"j2"})),
+        Assignment("a", [4], SatelliteCondition({"e1"}), action=append),
+    )
+    partitions = partition_satellites(statement, SATELLITES)
+    for sat in SATELLITES:
+        expected = {}
+        statement.eval(expected, {"id": sat})
+        environment = {}
+        partitions[sat].eval(environment, {"id": sat})
+        assert environment == expected
@@ -0,0 +1,211 @@
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest  # type: ignore
+
+import rads.config.loader
+from rads.config.builders import SatelliteBuilder
+from rads.config.loader import load_config
+from rads.exceptions import ConfigError
+
+_RADS_XML = """\
+<?xml version="1.0"?>
+<satellites>
+j2 JA2 JASON-2
+e1 E1 ERS-1
+</satellites>
+<satellite sat="j2">JASON-2</satellite>
+<satellite sat="e1">ERS-1</satellite>
+<dt1hz>1.0</dt1hz>
+<inclination>{inclination}</inclination>
+<frequency>13.575 5.3</frequency>
+<phase name="a" sat="j2">
+  <mission>first</mission>
+  <cycles>1 500</cycles>
+  <repeat>9.9156 254</repeat>
+  <ref_pass>2008-07-04T00:00:00 0.0 1 1</ref_pass>
+  <start_time>2008-07-04T00:00:00</start_time>
+</phase>
+<phase name="a" sat="e1">
+  <mission>first</mission>
+  <cycles>1 100</cycles>
+  <repeat>3 43</repeat>
+  <ref_pass>1991-07-25T00:00:00 0.0 1 1</ref_pass>
+  <start_time>1991-07-25T00:00:00</start_time>
+</phase>
+"""
+
+
+@pytest.fixture
+def dataroot(tmp_path, monkeypatch):
+    dataroot = tmp_path / "rads"
+    (dataroot / "conf").mkdir(parents=True)
+    (dataroot / "conf" / "rads.xml").write_text(_RADS_XML.format(inclination=66.04))
+    monkeypatch.setattr(rads.config.loader, "user_cache", lambda: tmp_path / "cache")
+    return dataroot
+
+
+@pytest.fixture
+def spy(mocker):
+    return mocker.spy(rads.config.loader, "_load_config")
+
+
+def _load(dataroot, **kwargs):
+    xml_files = [dataroot / "conf" / "rads.xml"]
+    return load_config(dataroot=dataroot, xml_files=xml_files, **kwargs)
+
+
+def test_load_config_cache(dataroot, spy):
+    config = _load(dataroot)
+    assert spy.call_count == 1
+    assert len(list((dataroot.parent / "cache").glob("config-*.pickle"))) == 1
+    cached = _load(dataroot)
+    assert spy.call_count == 1
+    assert cached.satellites["j2"] == config.satellites["j2"]
+    assert cached.dataroot == config.dataroot
+    assert cached.config_files == config.config_files
+
+
+def test_load_config_cache_invalidated_by_change(dataroot, spy):
+    _load(dataroot)
+    xml = dataroot / "conf" / "rads.xml"
+    stat = xml.stat()
+    xml.write_text(_RADS_XML.format(inclination=66.05))
+    os.utime(xml, ns=(stat.st_atime_ns, stat.st_mtime_ns))  # same size and time
+    assert _load(dataroot).satellites["j2"].inclination == 66.05
+    assert spy.call_count == 2
+
+
+def test_load_config_cache_invalidated_by_version(dataroot, spy, monkeypatch):
+    _load(dataroot)
+    monkeypatch.setattr(rads.config.loader, "__version__", "0.0.0")
+    _load(dataroot)
+    assert spy.call_count == 2
+
+
+def test_load_config_cache_per_satellites(dataroot, spy):
+    _load(dataroot)
+    _load(dataroot, satellites=["j2"])
+    assert spy.call_count == 2
+
+
+def test_load_config_without_cache(dataroot, spy):
+    _load(dataroot, cache=False)
+    _load(dataroot, cache=False)
+    assert spy.call_count == 2
+    assert not (dataroot.parent / "cache").exists()
+
+
+def test_load_config_file_objects_not_cached(dataroot, mocker):
+    m = mocker.patch("rads.config.loader._load_config")
+    for _ in range(2):
+        with (dataroot / "conf" / "rads.xml").open() as file:
+            assert load_config(dataroot=dataroot, xml_files=[file]) is m.return_value
+    assert m.call_count == 2
+    assert not (dataroot.parent / "cache").exists()
+
+
+def test_load_config_corrupt_cache(dataroot, spy):
+    config = _load(dataroot)
+    (cache,) = (dataroot.parent / "cache").glob("config-*.pickle")
+    cache.write_bytes(b"not a pickle")
+    assert _load(dataroot).satellites["j2"] == config.satellites["j2"]
+    assert spy.call_count == 2
+    _load(dataroot)  # rewritten
+    assert spy.call_count == 2
+
+
+def test_load_config_unwritable_cache(dataroot, spy):
+    (dataroot.parent / "cache").write_text("not a directory")
+    _load(dataroot)
+    _load(dataroot)
+    assert spy.call_count == 2
+
+
+def test_load_config_is_lazy(dataroot, mocker):
+    builder = mocker.patch(
+        "rads.config.loader.SatelliteBuilder", wraps=SatelliteBuilder
+    )
+    config = _load(dataroot, cache=False)
+    assert list(config.satellites) == ["j2", "e1"]
+    assert "e1" in config.satellites
+    assert "n1" not in config.satellites
+    assert builder.call_count == 0
+    assert config.satellites["e1"].name == "ERS-1"
+    assert config.satellites["e1"] is config.satellites["e1"]
+    assert builder.call_count == 1
+    with pytest.raises(KeyError):
+        config.satellites["n1"]
+    assert [s.name for s in config.satellites.values()] == ["JASON-2", "ERS-1"]
+    assert builder.call_count == 2
+
+
+@pytest.mark.parametrize("cache", [False, True])
+def test_load_config_lazy_error(dataroot, cache):
+    xml = dataroot / "conf" / "rads.xml"
+    text = _RADS_XML.format(inclination=66.04)
+    xml.write_text(text.replace("<cycles>1 100</cycles>", ""))
+    _load(dataroot, cache=cache)
+    config = _load(dataroot, cache=cache)  # from the cache, if enabled
+    assert config.satellites["j2"].name == "JASON-2"
+    with pytest.raises(ConfigError) as exc_info:
+        config.satellites["e1"]
+    assert exc_info.value.file == str(xml)
+    assert exc_info.value.line == 19
+    assert "cycles" in str(exc_info.value)
+
+
+@pytest.mark.parametrize("cache", [False, True])
+def test_load_config_workers(dataroot, mocker, cache):
+    expected = dict(_load(dataroot, cache=False).satellites)
+    _load(dataroot, cache=cache)
+    pool = mocker.patch(
+        "rads.config.loader.ProcessPoolExecutor", wraps=ProcessPoolExecutor
+    )
+    config = _load(dataroot, cache=cache, workers=2)
+    pool.assert_called_once_with(2)
+    mocker.patch("rads.config.loader._build_satellite", side_effect=AssertionError)
+    assert list(config.satellites) == ["j2", "e1"]
+    assert dict(config.satellites) == expected
+
+
+def test_load_config_workers_error(dataroot):
+    xml = dataroot / "conf" / "rads.xml"
+    text = _RADS_XML.format(inclination=66.04)
+    xml.write_text(text.replace("<cycles>1 100</cycles>", ""))
+    with pytest.raises(ConfigError) as exc_info:
+        _load(dataroot, cache=False, workers=2)
+    assert exc_info.value.file == str(xml)
+    assert exc_info.value.line == 19
+    assert "cycles" in str(exc_info.value)
+
+
+def test_load_config_invalid_workers(dataroot):
+    with pytest.raises(ValueError, match="'workers' must be at least 1"):
+        _load(dataroot, workers=0)
+
+
+def test_load_config_concurrent_access(dataroot, mocker):
+    build_satellite = rads.config.loader._build_satellite
+
+    def slow_build_satellite(*args):
+        time.sleep(0.05)  # so the threads access the satellite at the same time
+        return build_satellite(*args)
+
+    builder = mocker.patch(
+        "rads.config.loader._build_satellite", side_effect=slow_build_satellite
+    )
+    config = _load(dataroot, cache=False)
+    barrier = threading.Barrier(8)
+
+    def access(sat):
+        barrier.wait()
+        return config.satellites[sat]
+
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(access, ["j2", "e1"] * 4))
+    assert builder.call_count == 2
+    assert all(s is config.satellites["j2"] for s in results[::2])
+    assert all(s is config.satellites["e1"] for s in results[1::2])
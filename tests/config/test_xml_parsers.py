@@ -0,0 +1,63 @@
+import pytest  # type: ignore
+
+from rads.config.xml_parsers import (
+    TerminalXMLParseError,
+    XMLParseError,
+    any,
+    at,
+    lazy,
+    must,
+    seq,
+    tag,
+)
+from rads.xml import fromstring
+
+
+def _elements(*tags):
+    xml = "<root>" + "".join(f"<{t}/>" for t in tags) + "</root>"
+    return fromstring(xml).down()
+
+
+def _tag(parser):
+    return parser ^ (lambda e: e.tag)
+
+
+def test_alternate_first_match():
+    parser = _tag(tag("a")) | (_tag(any()) ^ str.upper) | _tag(tag("b"))
+    assert parser(_elements("a"))[0] == "a"
+    assert parser(_elements("b"))[0] == "B"
+    assert parser(_elements("c"))[0] == "C"
+
+
+def test_alternate_first_match_of_tagged_parsers():
+    parser = (
+        (seq(tag("a"), tag("b")) ^ (lambda x: "ab"))
+        | (at(tag("a")) ^ (lambda x: "at"))
+        | (lazy(lambda: tag("b") | tag("c")) ^ (lambda x: "bc"))
+    )
+    assert parser(_elements("a", "b"))[0] == "ab"
+    assert parser(_elements("a", "c"))[0] == "at"
+    assert parser(_elements("c"))[0] == "bc"
+    with pytest.raises(XMLParseError):
+        parser(_elements("d"))
+
+
+def test_alternate_must_is_always_tried():
+    parser = tag("a") | must(tag("b")) | tag("c")
+    with pytest.raises(TerminalXMLParseError):
+        parser(_elements("c"))
+
+
+def test_alternate_in_place_extension():
+    parser = tag("a") | tag("b")
+    with pytest.raises(XMLParseError):
+        parser(_elements("c"))
+    parser |= _tag(tag("c"))
+    assert parser(_elements("c"))[0] == "c"
+
+
+def test_alternate_at_end():
+    parser = tag("a") | tag("b")
+    _, position = parser(_elements("a"))
+    with pytest.raises(XMLParseError):
+        parser(position)
@@ -9,6 +9,7 @@ from rads.datetime64util import (
     second,
     year,
     ymdhmsus,
+    ymdhmsus_from_microseconds,
 )
 
 DATE = np.datetime64("2002-02-03T13:56:03.172")
@@ -80,3 +81,31 @@ def test_ymdhmsus():
     assert ymdhmsus(NEAR_EPOCH) == (1970, 1, 1, 0, 0, 0, 80988)
     assert ymdhmsus(LOW) == (0, 1, 1, 0, 0, 0, 0)
     assert ymdhmsus(HIGH) == (9999, 12, 31, 23, 59, 59, 999999)
+    nat = np.iinfo(np.int64).min
+    assert ymdhmsus(np.datetime64("NaT")) == (nat,) * 7
+    year, *_, microsecond = ymdhmsus(np.array([DATE, np.datetime64("NaT")]))
+    assert year.tolist() == [2002, nat]
+    assert microsecond.tolist() == [172000, nat]
+
+
+def test_ymdhmsus_from_microseconds():
+    assert ymdhmsus_from_microseconds(0) == (1970, 1, 1, 0, 0, 0, 0)
+    assert ymdhmsus_from_microseconds(-1) == (1969, 12, 31, 23, 59, 59, 999999)
+    for datetime64 in (DATE, LEAP_YEAR, NEAR_EPOCH, LOW, HIGH):
+        microseconds = datetime64.astype("datetime64[us]").astype(np.int64)
+        assert ymdhmsus_from_microseconds(int(microseconds)) == ymdhmsus(datetime64)
+    # compare with NumPy's calendar
+    rng = np.random.default_rng(0)
+    microseconds = rng.integers(-(2 ** 60), 2 ** 60, 100000)
+    datetime64 = microseconds.astype("datetime64[us]")
+    components = ymdhmsus_from_microseconds(microseconds)
+    years = datetime64.astype("datetime64[Y]").astype(int) + 1970
+    months = datetime64.astype("datetime64[M]")
+    days = (datetime64.astype("datetime64[D]") - months).astype(int) + 1
+    np.testing.assert_equal(components[0], years)
+    np.testing.assert_equal(components[1], months.astype(int) % 12 + 1)
+    np.testing.assert_equal(components[2], days)
+    np.testing.assert_equal(components[3], microseconds // 3600000000 % 24)
+    np.testing.assert_equal(components[4], microseconds // 60000000 % 60)
+    np.testing.assert_equal(components[5], microseconds // 1000000 % 60)
+    np.testing.assert_equal(components[6], microseconds % 1000000)
@@ -1,11 +1,25 @@
+import gc
 import math
+import os
+import pickle
+import random
+import tracemalloc
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from copy import copy, deepcopy
-from datetime import datetime
-from typing import Mapping, MutableMapping, MutableSequence, Optional
+from datetime import datetime, timedelta
+from typing import (
+    Iterator,
+    Mapping,
+    MutableMapping,
+    MutableSequence,
+    Optional,
+    Tuple,
+)
 
 import numpy as np  # type: ignore
 import pytest  # type: ignore
+from astropy.convolution import Box1DKernel, Gaussian1DKernel, convolve  # type: ignore
 
 from rads.rpn import (
     ABS,
@@ -79,18 +93,64 @@ from rads.rpn import (
     TANH,
     YMDHMS,
     CompleteExpression,
+    CostEstimate,
+    DTypeRule,
     E,
     Expression,
+    ExpressionGraph,
+    LazyEnvironment,
     Literal,
+    NaNRule,
+    Operator,
+    OperatorInfo,
+    OperatorKind,
+    ParallelEvaluator,
+    Profiler,
     StackUnderflowError,
     Token,
     Variable,
+    _CODE,
+    _KEYWORDS,
+    _SharedArray,
+    _SINType,
+    _decode,
+    _flatten,
+    _parse,
+    _share,
+    _unshare,
+    shared_memory,
+    evaluate_bytes,
+    evaluate_many,
     token,
 )
 from rads.typing import FloatOrArray
 
 GOLDEN_RATIO = math.log((1 + math.sqrt(5)) / 2)
 
+# arguments of each kind of input, x, y and z in order
+INPUTS = {
+    "integer": (
+        np.array([-2, 0, 1, 3, 5]),
+        np.array([1, 2, 0, 3, -1]),
+        np.array([2, 3, 4, 0, 1]),
+    ),
+    "float": (
+        np.array([-0.5, 0.0, 0.25, 1.5, 2.0]),
+        np.array([1.5, -2.0, 0.0, 0.5, 3.0]),
+        np.array([2.0, 0.5, -1.0, 0.0, 1.0]),
+    ),
+    "nan": (
+        np.array([np.nan, 0.5, np.nan, 1.0, -1.0]),
+        np.array([1.0, np.nan, np.nan, 0.0, 2.0]),
+        np.full(5, np.nan),
+    ),
+    "mixed": (np.array([-2, 0, 1, 3, 5]), math.nan, 0.5),
+    "integer scalar": (3, -2, 0),
+    "zero scalar": (0, 0, 0),
+    "float scalar": (0.5, -1.5, 0.0),
+    "nan scalar": (math.nan, 1.0, math.nan),
+}
+
 
 class TestLiteral:
     def test_init(self):
@@ -99,6 +159,14 @@ class TestLiteral:
         with pytest.raises(TypeError):
             Literal("not a number")  # type: ignore
 
+    def test_interned(self):
+        assert Literal(3) is Literal(3)
+        assert Literal(3.0) is not Literal(3)
+        assert Literal(0.0) is not Literal(-0.0)
+        assert Literal(True) is not Literal(1)
+        assert pickle.loads(pickle.dumps(Literal(3.14))) is Literal(3.14)
+        assert deepcopy(Literal(3.14)) is Literal(3.14)
+
     def test_pops(self):
         assert Literal(3).pops == 0
 
@@ -188,6 +256,12 @@ class TestVariable:
         with pytest.raises(TypeError):
             Variable(3.14)  # type: ignore
 
+    def test_interned(self):
+        assert Variable("alt") is Variable("alt")
+        assert Variable("alt") is not Variable("lat")
+        assert pickle.loads(pickle.dumps(Variable("alt"))) is Variable("alt")
+        assert deepcopy(Variable("alt")) is Variable("alt")
+
     def test_pops(self):
         assert Variable("alt").pops == 0
 
@@ -1571,12 +1645,31 @@ class TestYMDHMSOperator:
             [np.array([80704121919.570865, 190626123106.930575])],
             approx=True,
         )
+        # before the epoch
+        assert_token(YMDHMS, [-1.5], [841231235958.5], approx=True)
+        assert_token(YMDHMS, [np.array([-1.5])], [np.array([841231235958.5])])
         # extra stack elements
         assert_token(YMDHMS, [0, seconds1], [0, 80704121919.570865], approx=True)
         # not enough stack elements
         with pytest.raises(StackUnderflowError):
             YMDHMS([], {})
 
+    def test_call_array_matches_datetime(self):
+        rng = np.random.default_rng(0)
+        seconds = np.round(rng.uniform(-5e8, 3e9, 1000), 3)
+        stack: MutableSequence[FloatOrArray] = [seconds]
+        YMDHMS(stack, {})
+        for x, result in zip(seconds, stack[0]):
+            time = datetime(1985, 1, 1) + timedelta(seconds=float(x))
+            assert result == float(time.strftime("%y%m%d%H%M%S.%f"))
+
+    def test_call_array_not_finite(self):
+        stack: MutableSequence[FloatOrArray] = [np.array([np.nan, 0.0, np.inf])]
+        YMDHMS(stack, {})
+        assert np.isnan(stack[0][0])
+        assert stack[0][1] == 850101000000.0
+        assert np.isnan(stack[0][2])
+
 
 class TestSUMOperator:
     def test_repr(self):
@@ -2555,6 +2648,42 @@ class TestINRANGEOperator:
             INRANGE([1, 2], {})
 
 
+def assert_filter_matches_astropy(operator: Token, kernel_class: type) -> None:
+    rng = np.random.RandomState(0)
+    for shape, axis, size in [
+        ((50,), 0, 3),
+        ((50,), 0, 8),
+        ((7,), 0, 21),
+        ((30, 4), 0, 5),
+        ((4, 30), 1, 5),
+        ((3, 10, 6), 1, 3),
+    ]:
+        x = rng.normal(size=shape)
+        # isolated NaN values and NaN runs longer than the kernel
+        x[rng.uniform(size=shape) < 0.2] = np.nan
+        x[..., :3] = np.nan
+        x_moved = np.moveaxis(x, axis, -1)
+        kernel = kernel_class(size)
+        expected = np.moveaxis(
+            np.array(
+                [
+                    convolve(s, kernel, boundary="extend", preserve_nan=True)
+                    for s in x_moved.reshape(-1, shape[axis])
+                ]
+            ).reshape(x_moved.shape),
+            -1,
+            axis,
+        )
+        for x_, expected_ in ((x, expected), (np.nan_to_num(x), None)):
+            if expected_ is None:
+                expected_ = np.apply_along_axis(
+                    convolve, axis, x_, kernel, boundary="extend"
+                )
+            stack = [x_, axis, size]
+            operator(stack, {})
+            np.testing.assert_allclose(stack[0], expected_, rtol=1e-12, atol=1e-12)
+
+
 class TestBOXCAROperator:
     def test_repr(self):
         assert repr(BOXCAR) == "BOXCAR"
@@ -2635,6 +2764,18 @@ class TestBOXCAROperator:
         with pytest.raises(StackUnderflowError):
             BOXCAR([1, 2], {})
 
+    def test_call_matches_astropy(self):
+        assert_filter_matches_astropy(BOXCAR, Box1DKernel)
+
+    def test_call_dtype(self):
+        stack = [np.array([1, 2, 3, 4]), 0, 3]
+        BOXCAR(stack, {})
+        assert stack[0].dtype == np.float64
+        stack = [np.array([1, 2, np.nan, 4], dtype=np.float32), 0, 3]
+        BOXCAR(stack, {})
+        assert stack[0].dtype == np.float32
+        assert np.isnan(stack[0][2])
+
 
 class TestGAUSSOperator:
     def test_repr(self):
@@ -2728,6 +2869,98 @@ class TestGAUSSOperator:
         with pytest.raises(StackUnderflowError):
             GAUSS([1, 2], {})
 
+    def test_call_matches_astropy(self):
+        assert_filter_matches_astropy(GAUSS, Gaussian1DKernel)
+
+    def test_call_dtype(self):
+        stack = [np.array([1, 2, 3, 4]), 0, 3]
+        GAUSS(stack, {})
+        assert stack[0].dtype == np.float64
+        stack = [np.array([1, 2, np.nan, 4], dtype=np.float32), 0, 3]
+        GAUSS(stack, {})
+        assert stack[0].dtype == np.float32
+        assert np.isnan(stack[0][2])
+
+
+class _MathVariable:
+    def __init__(self, data):
+        self.data = data
+
+
+class TestLazyEnvironment:
+    def test_getitem(self, mocker):
+        loader = mocker.Mock(side_effect=lambda name: {"x": 1, "y": 2}[name])
+        environment = LazyEnvironment(loader)
+        assert environment["x"] == 1
+        assert environment["x"] == 1
+        loader.assert_called_once_with("x")
+        with pytest.raises(KeyError):
+            environment["z"]
+
+    def test_getitem_math_variable(self, mocker):
+        loader = mocker.Mock(side_effect=lambda name: {"x": 1, "y": 2}[name])
+        variables = {
+            "a": _MathVariable(CompleteExpression("x 10 MUL")),
+            "b": _MathVariable(CompleteExpression("a y ADD")),
+            "x": _MathVariable(None),
+        }
+        environment = LazyEnvironment(loader, variables)
+        assert environment["b"] == 12
+        assert environment["a"] == 10
+        assert loader.call_args_list == [mocker.call("x"), mocker.call("y")]
+
+    def test_getitem_cycle(self):
+        variables = {
+            "a": _MathVariable(CompleteExpression("b 1 ADD")),
+            "b": _MathVariable(CompleteExpression("c")),
+            "c": _MathVariable(CompleteExpression("a")),
+        }
+        environment = LazyEnvironment(lambda name: 0, variables)
+        with pytest.raises(ValueError, match="a -> b -> c -> a"):
+            environment["a"]
+
+    def test_eval_loads_only_needed_variables(self, mocker):
+        loader = mocker.Mock(side_effect=lambda name: {"x": 1, "y": 2}[name])
+        environment = LazyEnvironment(loader)
+        assert CompleteExpression("x 2 MUL").eval(environment) == 2
+        loader.assert_called_once_with("x")
+
+    def test_maxsize(self, mocker):
+        loader = mocker.Mock(side_effect=lambda name: name.upper())
+        environment = LazyEnvironment(loader, maxsize=2)
+        assert environment["a"] == "A"
+        assert environment["b"] == "B"
+        assert environment["a"] == "A"
+        assert environment["c"] == "C"  # evicts b
+        assert list(environment) == ["a", "c"]
+        assert environment["b"] == "B"
+        assert loader.call_count == 4
+        environment = LazyEnvironment(loader, maxsize=None)
+        for name in "abcdefghijklmnopqrstuvwxyz":
+            environment[name]
+        assert len(environment) == 26
+
+    def test_clear(self, mocker):
+        loader = mocker.Mock(return_value=1)
+        environment = LazyEnvironment(loader)
+        environment["x"]
+        environment.clear()
+        environment["x"]
+        assert loader.call_count == 2
+
+    def test_contains_iter_len(self, mocker):
+        loader = mocker.Mock(return_value=1)
+        environment = LazyEnvironment(loader, {"a": _MathVariable(None)})
+        assert "a" in environment
+        assert "x" not in environment
+        assert list(environment) == ["a"]
+        assert len(environment) == 1
+        environment["x"]
+        environment["a"]
+        assert "x" in environment
+        assert list(environment) == ["a", "x"]
+        assert len(environment) == 2
+
 
 def test_token_keywords():
     assert token("SUB") == SUB
@@ -2755,6 +2988,23 @@ def test_token_literals():
     assert token("3.14-100") == Literal(3.14e-100)
 
 
+def test_token_interned():
+    assert token("3.14d10") is token("3.14D10")
+    assert token("alt") is token("alt")
+
+
+def test_parse_cache(mocker):
+    _parse.cache_clear()
+    spy = mocker.patch("rads.rpn.token", wraps=token)
+    assert Expression("alt 3.14d10 MUL") == Expression("alt 3.14d10 MUL")
+    assert spy.call_count == 3
+    first, second = Expression("alt 1 ADD"), Expression("alt 1 ADD")
+    assert first._tokens is not second._tokens
+    assert all(a is b for a, b in zip(first, second))
+    with pytest.raises(ValueError):
+        Expression("alt 3, ADD")
+
+
 def test_token_variables():
     assert token("alt") == Variable("alt")
     assert token("ref_frame_offset") == Variable("ref_frame_offset")
@@ -2771,6 +3021,121 @@ def test_token_wrong_type():
         token(5)  # type: ignore
 
 
+def test_operator_pickle():
+    for operator in _KEYWORDS.values():
+        if isinstance(operator, Operator):
+            assert pickle.loads(pickle.dumps(operator)) is operator
+    # operators defined elsewhere are pickled normally
+    assert isinstance(pickle.loads(pickle.dumps(SPLIT)), _SPLITType)
+
+
+def test_evaluate_many():
+    environment = {"x": np.array([1.0, 2.0]), "y": np.array([3.0, 4.0])}
+    expressions = {
+        "a": CompleteExpression("x y ADD"),
+        "b": CompleteExpression("x y ADD 2 MUL"),
+        "c": CompleteExpression("y"),
+    }
+    results = evaluate_many(expressions, environment)
+    assert list(results) == ["a", "b", "c"]
+    np.testing.assert_equal(results["a"], [4.0, 6.0])
+    np.testing.assert_equal(results["b"], [8.0, 12.0])
+    assert results["c"] is environment["y"]
+
+
+def test_evaluate_many_with_sequence():
+    environment = {"x": np.array([1.0, 2.0])}
+    results = evaluate_many(
+        [CompleteExpression("x 1 ADD"), Expression("x NEG")], environment
+    )
+    assert list(results) == ["x 1 ADD", "x NEG"]
+    np.testing.assert_equal(results["x 1 ADD"], [2.0, 3.0])
+    np.testing.assert_equal(results["x NEG"], [-1.0, -2.0])
+    assert evaluate_many([]) == {}
+
+
+def test_evaluate_many_computes_once(mocker):
+    spy = mocker.spy(_SINType, "__call__")
+    environment = mocker.MagicMock(spec=dict)
+    environment.__len__.return_value = 1
+    environment.__getitem__.return_value = 0.5
+    results = evaluate_many(
+        [CompleteExpression("x SIN"), CompleteExpression("x SIN 2 MUL")], environment
+    )
+    assert results == {"x SIN": math.sin(0.5), "x SIN 2 MUL": 2 * math.sin(0.5)}
+    assert spy.call_count == 1
+    environment.__getitem__.assert_called_once_with("x")
+
+
+def test_evaluate_many_with_incomplete_expression():
+    with pytest.raises(ValueError):
+        evaluate_many([Expression("x ADD")], {"x": 1})
+    with pytest.raises(ValueError):
+        evaluate_many([Expression("1 2")])
+
+
+def test_bytecode():
+    for name, operator in _KEYWORDS.items():
+        args = ["x", "y", "z"][: operator.pops]
+        string = " ".join(args + [name] + ["POP"] * (operator.puts - 1))
+        if operator.puts == 0:
+            string = "x " + string
+        expression = CompleteExpression(string)
+        data = expression.to_bytes()
+        assert CompleteExpression.from_bytes(data) == expression
+    expression = CompleteExpression(
+        [Literal(1), Literal(1.0), Literal(True), Literal(-0.0), Literal(-(2 ** 63))]
+        + [Expression("ADD ADD ADD"), Variable("α"), ADD, ADD, Literal(1), ADD]
+    )
+    data = expression.to_bytes()
+    # the literal pool and variable table only hold distinct values
+    assert len(data) == 16 + 2 * 13 + 5 * 9 + len("α".encode())
+    result = CompleteExpression.from_bytes(bytearray(data))
+    # nested expressions are flattened
+    assert result == CompleteExpression(list(_flatten(expression)))
+    assert [repr(t) for t in result] == [repr(t) for t in _flatten(expression)]
+    assert CompleteExpression.from_bytes(data)._tokens is not result._tokens
+
+
+def test_bytecode_invalid():
+    with pytest.raises(ValueError):
+        CompleteExpression([Variable("x"), SPLIT, POP]).to_bytes()
+    with pytest.raises(ValueError):
+        CompleteExpression([Literal(2 ** 63)]).to_bytes()
+    data = CompleteExpression("x 2 MUL").to_bytes()
+    for invalid in (
+        b"",
+        b"XYZ" + data[3:],
+        data[:-1],
+        data + b" ",
+        data.replace(b"i", b"j"),
+        data[:16] + b"\xff\x3f" + data[18:],
+        data[:16] + b"\x00\x00" + data[18:],
+        data[:18] + b"\x00\x00" + data[20:],
+    ):
+        with pytest.raises(ValueError):
+            CompleteExpression.from_bytes(invalid)
+        with pytest.raises(ValueError):
+            evaluate_bytes(invalid)
+
+
+def test_evaluate_bytes(mocker):
+    environment = {"x": np.array([1.0, 2.0]), "y": np.array([3.0, 4.0])}
+    expression = CompleteExpression("x y ADD 2 MUL SQRT 1.5d0 DIV")
+    data = expression.to_bytes()
+    np.testing.assert_equal(
+        evaluate_bytes(data, environment), expression.eval(environment)
+    )
+    assert evaluate_bytes(CompleteExpression("1 2 ADD").to_bytes()) == 3
+    with pytest.raises(KeyError):
+        evaluate_bytes(data, {"x": 1})
+    # decoded bytecode is cached
+    _decode.cache_clear()
+    evaluate_bytes(data, environment)
+    evaluate_bytes(data, environment)
+    assert _decode.cache_info().hits == 1
+
+
 class TestExpression:
     def test_init_with_token_sequence(self):
         # complete expressions
@@ -3162,6 +3527,125 @@ class TestExpression:
         assert str(Expression("1 2.5 DUP")) == "1 2.5 DUP"
         assert str(Expression("ADD 2 MUL a_var DUP")) == "ADD 2 MUL a_var DUP"
 
+    def test_optimize_folds_literals(self):
+        assert Expression("PI 180 DIV").optimize() == CompleteExpression(
+            [math.pi / 180]
+        )
+        assert Expression("x 1 2 ADD MUL").optimize() == CompleteExpression("x 3 MUL")
+        assert Expression("1 2 EXCH SUB").optimize() == CompleteExpression("1")
+        assert Expression("1 2 DUP ADD POP").optimize() == CompleteExpression("1")
+        assert Expression("1 2 ADD ADD").optimize() == Expression("3 ADD")
+        # errors and warnings are left for evaluation
+        assert Expression("1 0 DIV").optimize() == CompleteExpression("1 0 DIV")
+        assert Expression("-1 SQRT").optimize() == CompleteExpression("-1 SQRT")
+
+    def test_optimize_removes_stack_operations(self):
+        assert Expression("x EXCH EXCH").optimize() == Expression("x")
+        assert Expression("x DUP POP").optimize() == CompleteExpression("x")
+        assert Expression("x y EXCH ADD").optimize() == CompleteExpression("x y ADD")
+        assert Expression("x y EXCH LT").optimize() == CompleteExpression("x y GT")
+        assert Expression("x y EXCH GE").optimize() == CompleteExpression("x y LE")
+        assert Expression("x DUP EXCH DIV").optimize() == CompleteExpression(
+            "x DUP DIV"
+        )
+        assert Expression("x y EXCH EXCH SUB EXCH").optimize() == Expression(
+            "x y SUB EXCH"
+        )
+
+    def test_optimize_removes_operators(self):
+        assert Expression("x NEG NEG").optimize() == CompleteExpression("x")
+        assert Expression("x ABS ABS").optimize() == CompleteExpression("x ABS")
+        assert Expression("x FLOOR CEIL RINT").optimize() == CompleteExpression(
+            "x FLOOR"
+        )
+        # aliases
+        assert Expression("x NINT NINT").optimize() == CompleteExpression("x NINT")
+        assert Expression("x CEILING CEILING").optimize() == CompleteExpression(
+            "x CEILING"
+        )
+        assert Expression("x RINT CEILING NINT").optimize() == CompleteExpression(
+            "x RINT"
+        )
+        assert Expression("x y NEG EXCH EXCH NEG SUB").optimize() == (
+            CompleteExpression("x y SUB")
+        )
+
+    def test_optimize_fast_math(self):
+        for string in ("x D2R R2D", "x R2D D2R", "x INV INV", "x SQR SQRT"):
+            assert Expression(string).optimize() == CompleteExpression(string)
+        assert Expression("x D2R R2D").optimize(True) == CompleteExpression("x")
+        assert Expression("x R2D D2R").optimize(True) == CompleteExpression("x")
+        assert Expression("x INV INV").optimize(True) == CompleteExpression("x")
+        assert Expression("x SQR SQRT").optimize(True) == CompleteExpression("x ABS")
+
+    def test_optimize_shares_subexpressions(self):
+        assert Expression("lat SIND SQR lat SIND ADD").optimize() == (
+            CompleteExpression("lat SIND DUP SQR EXCH ADD")
+        )
+        # not made more expensive
+        assert Expression("x SIN DUP 2 EXCH POW ADD").optimize() == (
+            CompleteExpression("x SIN DUP 2 EXCH POW ADD")
+        )
+
+    def test_optimize_keeps_errors(self):
+        for string, error in (
+            ("y POP 1", KeyError),
+            ("0 0 DIV POP 1", ZeroDivisionError),
+        ):
+            optimized = Expression(string).optimize()
+            assert optimized == CompleteExpression(string)
+            with pytest.raises(error):
+                CompleteExpression(string).eval({})
+            with pytest.raises(error):
+                optimized.eval({})
+
+    def test_optimize_random_expressions(self):
+        rng = random.Random(1)
+        environment = {
+            "x": np.array([0.1, -0.2, np.nan, 0.5, 3.0]),
+            "y": np.array([1.5, 0.3, 0.4, -0.5, 0.6]),
+        }
+        for _ in range(200):
+            expression = random_expression(rng, rng.randint(1, 30))
+            optimized = expression.optimize()
+            assert isinstance(optimized, CompleteExpression)
+            assert len(optimized) <= len(expression)
+            np.testing.assert_equal(
+                optimized.eval(environment), expression.eval(environment)
+            )
+            np.testing.assert_allclose(
+                expression.optimize(True).eval(environment),
+                expression.eval(environment),
+            )
+
+    def test_estimate(self):
+        estimate = Expression("x 2 MUL 3 ADD").estimate({"x": 1000})
+        assert estimate == CostEstimate(2, 16000, {"MUL": 1000, "ADD": 1000})
+        estimate = Expression("x DUP MUL y SUM ADD").estimate({"x": 1000, "y": 10})
+        assert estimate == CostEstimate(2, 16008, {"MUL": 1000, "SUM": 10, "ADD": 1000})
+        estimate = Expression("x y z ADD MUL").estimate(
+            {"x": (10, 100), "y": (1, 100), "z": ()}, {"x": np.float32}
+        )
+        assert estimate == CostEstimate(3, 8800, {"ADD": 100, "MUL": 1000})
+        estimate = Expression("x y ADD z ADD").estimate(
+            {"x": 100, "y": 100, "z": 100}, {"x": np.float32, "y": np.float32}
+        )
+        assert estimate == CostEstimate(2, 1200, {"ADD": 200})
+        estimate = Expression("x DIF i j IAND EXCH POP").estimate(
+            {"x": (10, 20), "i": 5, "j": 5}, {"i": np.int16, "j": np.int16}
+        )
+        assert estimate == CostEstimate(3, 1610, {"DIF": 200, "IAND": 5})
+        estimate = Expression("1 2 ADD").estimate({})
+        assert estimate == CostEstimate(2, 8, {"ADD": 1})
+
+    def test_estimate_errors(self):
+        with pytest.raises(KeyError):
+            Expression("x y ADD").estimate({"x": 10})
+        with pytest.raises(ValueError):
+            Expression("x y ADD").estimate({"x": 10, "y": 20})
+        with pytest.raises(ValueError):
+            Expression("2 ADD").estimate({})
+
 
 class TestCompleteExpression:
     def test_init_with_token_sequence(self):
@@ -3339,3 +3823,1103 @@ class TestCompleteExpression:
         assert not CompleteExpression("1") != Expression("1")
         assert not CompleteExpression("1 2.5 ADD") != Expression("1 2.5 ADD")
         assert not (CompleteExpression("1 a_var ADD") != Expression("1 a_var ADD"))
+
+    def test_eval_chunked(self, mocker):
+        rng = np.random.RandomState(0)
+        x = rng.normal(size=100)
+        x[rng.uniform(size=100) < 0.1] = np.nan
+        environment = {
+            "x": x,
+            "y": np.cumsum(rng.uniform(size=100)),
+            "m": rng.normal(size=(100, 3)),
+            "s": 3.0,
+        }
+        for string in [
+            "1",
+            "s 2 MUL",
+            "x y ADD s MUL",
+            "x DIF",
+            "x y DXDY DIF",
+            "x 0 5 BOXCAR DIF",
+            "x 0 3 GAUSS 0 3 BOXCAR y DXDY",
+            "m 0 3 BOXCAR",
+            "m 1 3 GAUSS",
+            "x SUM",
+            "x DUP SUM DIV",
+            "x SUM x DIF SUM ADD x MUL",
+        ]:
+            expression = CompleteExpression(string)
+            spy = mocker.spy(ExpressionGraph, "_eval")
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                expected = expression.eval(environment)
+                result = expression.eval_chunked(environment, 7)
+            np.testing.assert_allclose(result, expected, rtol=1e-12)
+            if string not in ("1", "s 2 MUL"):
+                # evaluated in 15 chunks
+                assert spy.call_count >= 15
+            mocker.stopall()
+
+    def test_eval_chunked_out(self):
+        environment = {"x": np.arange(10.0)}
+        out = np.empty(10)
+        result = CompleteExpression("x 2 MUL").eval_chunked(environment, 3, out=out)
+        assert result is out
+        np.testing.assert_equal(out, np.arange(10.0) * 2)
+        out = np.empty(10)
+        result = CompleteExpression("x SUM").eval_chunked(environment, 3, out=out)
+        assert result is out
+        np.testing.assert_equal(out, 45.0)
+        with pytest.raises(ValueError):
+            CompleteExpression("x 2 MUL").eval_chunked(environment, 3, out=np.empty(9))
+        with pytest.raises(ValueError):
+            CompleteExpression("x 2 MUL").eval_chunked(environment, 20, out=np.empty(9))
+
+    def test_eval_chunked_fallback(self, mocker):
+        spy = mocker.spy(ExpressionGraph, "_eval")
+        # arrays with different shapes
+        environment = {"x": np.arange(10.0), "y": np.arange(10.0)[:, np.newaxis]}
+        result = CompleteExpression("x y ADD").eval_chunked(environment, 3)
+        np.testing.assert_equal(result, np.arange(10.0) + np.arange(10.0)[:, None])
+        assert spy.call_count == 1
+        # filter with arguments that are not literals
+        environment = {"x": np.arange(10.0), "n": 3}
+        result = CompleteExpression("x 0 n BOXCAR").eval_chunked(environment, 3)
+        np.testing.assert_allclose(
+            result, CompleteExpression("x 0 n BOXCAR").eval(environment)
+        )
+        # flattening operators on multi-dimensional arrays
+        environment = {"x": np.arange(20.0).reshape(10, 2)}
+        result = CompleteExpression("x DIF").eval_chunked(environment, 3)
+        np.testing.assert_equal(result, np.diff(np.arange(20.0), prepend=np.nan))
+        # operators that are not known to be element wise
+        x = Variable("x")
+        environment = {"x": np.arange(10)}
+        expression = CompleteExpression([x, SPLIT, POP])
+        result = expression.eval_chunked(environment, 3)
+        np.testing.assert_equal(result, np.arange(-1, 9))
+
+    def test_eval_chunked_invalid_chunksize(self):
+        with pytest.raises(ValueError):
+            CompleteExpression("1").eval_chunked(chunksize=0)
+
+    def test_compile(self):
+        assert CompleteExpression("1").compile()() == 1
+        assert CompleteExpression("1 2.5 ADD").compile()() == 3.5
+        assert CompleteExpression("1 a_var ADD").compile()({"a_var": 10}) == 11
+        assert CompleteExpression("1 2 EXCH SUB").compile()() == 1
+        assert CompleteExpression("1 2 DUP POP SUB").compile()() == -1
+        with pytest.raises(KeyError):
+            CompleteExpression("1 a_var ADD").compile()()
+        # compiled only once
+        expression = CompleteExpression("1 a_var ADD")
+        assert expression.compile() is expression.compile()
+
+    def test_compile_matches_eval(self):
+        environment = {
+            "x": np.array([0.1, np.nan, 0.5, 0.7, 0.9]),
+            "y": np.array([0.2, 0.3, 0.4, 0.5, 0.6]),
+            "z": np.array([1.5, 1.6, 1.7, 1.8, 1.9]),
+            "i": np.array([1, 2, 3, 4, 5]),
+            "j": np.array([0, 1, 2, 0, 1]),
+        }
+        original = deepcopy(environment)
+        for name, operator in _KEYWORDS.items():
+            if not isinstance(operator, Operator):
+                continue
+            if name in ("IAND", "IOR", "BTEST"):
+                args = "i j"
+            elif name in ("BOXCAR", "GAUSS"):
+                args = "x 0 3"
+            else:
+                args = " ".join(["x", "y", "z"][: operator.pops])
+            # intermediate arguments may be reused by the compiled function
+            temporaries = " ".join(a + " 1 MUL" for a in args.split())
+            for string in (f"{args} {name}", f"{temporaries} {name}"):
+                string += " POP" * (operator.puts - 1)
+                if operator.puts == 0:
+                    string = "x " + string
+                expression = CompleteExpression(string)
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore")
+                    expected = expression.eval(environment)
+                    result = expression.compile()(environment)
+                np.testing.assert_equal(result, expected)
+        # the environment is not modified
+        np.testing.assert_equal(environment, original)
+
+    @pytest.mark.parametrize("kind", INPUTS)
+    @pytest.mark.parametrize(
+        "name",
+        [k for k, v in _KEYWORDS.items() if isinstance(v, Operator) and v in _CODE],
+    )
+    def test_compile_code_matches_call(self, name, kind):
+        # the compiled code of each operator duplicates its __call__
+        operator = _KEYWORDS[name]
+        environment = dict(zip(["x", "y", "z"], INPUTS[kind]))
+        args = ["x", "y", "z"][: operator.pops]
+        # intermediate arguments may be reused by the compiled function
+        temporaries = [a + " 1 MUL" for a in args]
+        for string in (" ".join(args + [name]), " ".join(temporaries + [name])):
+            expression = CompleteExpression(string)
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                try:
+                    expected = expression.eval(environment)
+                except Exception as err:
+                    with pytest.raises(type(err)):
+                        expression.compile()(environment)
+                    continue
+                result = expression.compile()(environment)
+            assert type(result) is type(expected), string
+            assert np.result_type(result) == np.result_type(expected), string
+            np.testing.assert_equal(result, expected, err_msg=string)
+
+    def test_compile_reuses_intermediates(self):
+        x = np.array([1.0, 2.0, 3.0])
+        result = CompleteExpression("x 2 MUL 1 ADD SQRT").compile()({"x": x})
+        np.testing.assert_equal(result, np.sqrt(x * 2 + 1))
+        np.testing.assert_equal(x, [1.0, 2.0, 3.0])
+        # duplicated intermediates are not reused
+        result = CompleteExpression("x 2 MUL DUP 1 ADD MUL").compile()({"x": x})
+        np.testing.assert_equal(result, (x * 2) * (x * 2 + 1))
+        # integer intermediates can not hold floating point results
+        i = np.array([1, 2, 3])
+        result = CompleteExpression("i 2 MUL 2 DIV").compile()({"i": i})
+        np.testing.assert_equal(result, [1.0, 2.0, 3.0])
+
+    def test_compile_pickle(self):
+        expression = CompleteExpression("1 a_var ADD")
+        expression.compile()
+        assert pickle.loads(pickle.dumps(expression)) == expression
+
+    def test_eval_executor(self, mocker):
+        x = np.linspace(0, 1, 200000)
+        y = np.linspace(1, 2, 200000)
+        expression = CompleteExpression("x SIN y COS MUL x EXP y LOG ADD SUB")
+        with ThreadPoolExecutor(2) as executor:
+            spy = mocker.spy(executor, "submit")
+            result = expression.eval({"x": x, "y": y}, executor=executor)
+        np.testing.assert_equal(result, expression.eval({"x": x, "y": y}))
+        assert spy.call_count == 7
+
+    def test_eval_executor_small(self, mocker):
+        expression = CompleteExpression("x SIN y COS MUL")
+        executor = mocker.Mock()
+        result = expression.eval({"x": np.zeros(10), "y": 1}, executor=executor)
+        np.testing.assert_equal(result, np.zeros(10))
+        executor.submit.assert_not_called()
+
+    def test_eval_executor_error(self, mocker):
+        mocker.patch("rads.rpn._CONCURRENT_MIN_SIZE", 1)
+        expression = CompleteExpression("x 1 0 DIV ADD")
+        with ThreadPoolExecutor(2) as executor:
+            with pytest.raises(ZeroDivisionError):
+                expression.eval({"x": 1}, executor=executor)
+            with pytest.raises(KeyError):
+                expression.eval({}, executor=executor)
+
+    def test_eval_numexpr_matches_eval(self):
+        pytest.importorskip("numexpr")
+        environment = {
+            "x": np.array([-2.5, -0.5, 0.0, 0.25, 0.5, 1.0, 3.0, np.nan]),
+            "y": np.array([1.5, -0.5, 0.0, 0.25, np.nan, 2.0, -3.0, 1.0]),
+            "z": np.array([2.0, 0.5, 0.0, 0.5, 1.0, np.nan, 4.0, 1.0]),
+            "i": np.array([1, 2, 3, 4, 5, 6, 7, 8]),
+            "j": np.array([0, 1, 2, 0, 1, 2, 0, 1]),
+        }
+        original = deepcopy(environment)
+        for name, operator in _KEYWORDS.items():
+            if not isinstance(operator, Operator):
+                continue
+            if name in ("IAND", "IOR", "BTEST"):
+                variants = ["i j", "x j"]
+            elif name in ("BOXCAR", "GAUSS"):
+                variants = ["x 0 3"]
+            else:
+                args = ["x", "y", "z"][: operator.pops]
+                variants = [" ".join(args)]
+                # integer literals mixed with arrays
+                for k in range(operator.pops if operator.pops > 1 else 0):
+                    variants.append(" ".join(args[:k] + ["2"] + args[k + 1 :]))
+            for args in variants:
+                string = f"{args} {name}" + " POP" * (operator.puts - 1)
+                if operator.puts == 0:
+                    string = "x " + string
+                expression = CompleteExpression(string)
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore")
+                    try:
+                        expected = expression.eval(environment)
+                    except (TypeError, ValueError) as err:
+                        with pytest.raises(type(err)):
+                            expression.eval_numexpr(environment)
+                        continue
+                    result = expression.eval_numexpr(environment)
+                assert np.result_type(result) == np.result_type(expected), string
+                np.testing.assert_allclose(result, expected, rtol=1e-15)
+        # the environment is not modified
+        np.testing.assert_equal(environment, original)
+
+    def test_eval_numexpr_combines_operators(self, mocker):
+        numexpr = pytest.importorskip("numexpr")
+        spy = mocker.spy(numexpr, "evaluate")
+        environment = {
+            "x": np.array([0.1, np.nan, 0.5]),
+            "y": np.array([0.2, 0.3, 0.4]),
+        }
+        expression = CompleteExpression("x y ADD SIND 2 MUL x SQRT y DIV SUB")
+        result = expression.eval_numexpr(environment)
+        np.testing.assert_allclose(result, expression.eval(environment), rtol=1e-15)
+        assert spy.call_count == 1
+        # the shared sub-expression is only evaluated once
+        expression = CompleteExpression("x y ADD SIN DUP MUL x 0 3 BOXCAR ADD")
+        result = expression.eval_numexpr(environment)
+        np.testing.assert_allclose(result, expression.eval(environment), rtol=1e-15)
+        assert spy.call_count == 3
+
+    def test_eval_numexpr_fallback(self, mocker):
+        mocker.patch("rads.rpn.numexpr", None)
+        environment = {"x": np.array([0.1, 0.2, 0.5]), "y": 2}
+        expression = CompleteExpression("x y MUL SIN")
+        np.testing.assert_equal(
+            expression.eval_numexpr(environment), expression.eval(environment)
+        )
+        assert CompleteExpression("1 y ADD").eval_numexpr(environment) == 3
+
+    def test_eval_dtype(self):
+        environment = {
+            "i": np.array([1, 2, 4], dtype=np.int16),
+            "j": np.array([1, 2, 4], dtype=np.int32),
+            "x": np.array([0.1, 0.2, 0.3], dtype=np.float32),
+            "y": np.array([0.1, 0.2, 0.3]),
+        }
+        cases = {
+            # expression: types with None, float64, float32 and preserve
+            "i 0.01 MUL": ("float64", "float64", "float32", "float32"),
+            "j 0.01 MUL": ("float64", "float64", "float32", "float64"),
+            "i SIN": ("float32", "float64", "float32", "float32"),
+            "x SIN": ("float32", "float64", "float32", "float32"),
+            "y SIN": ("float64", "float64", "float32", "float64"),
+            "x y ADD": ("float64", "float64", "float32", "float64"),
+            "i x ADD": ("float32", "float64", "float32", "float32"),
+            "x 0 3 BOXCAR": ("float32", "float64", "float32", "float32"),
+            "i 1 ADD": ("int16", "int16", "int16", "int16"),
+            "i j MAX": ("int32", "int32", "int32", "int32"),
+            "i 2 IAND": ("int16", "int16", "int16", "int16"),
+            "i 1 BTEST": ("bool", "bool", "bool", "bool"),
+            "x 0.2 GT": ("bool", "bool", "bool", "bool"),
+            "i YMDHMS": ("float64", "float64", "float64", "float64"),
+        }
+        for string, types in cases.items():
+            expression = CompleteExpression(string)
+            for dtype, type_ in zip([None, "float64", np.float32, "preserve"], types):
+                result = expression.eval(environment, dtype=dtype)
+                assert result.dtype == type_, (string, dtype)
+        # comparisons are made on the original values
+        expression = CompleteExpression("k 16777216 GT")
+        k = np.array([16777217], dtype=np.int32)
+        assert expression.eval({"k": k}, dtype="float32")[0]
+        # scalars
+        assert CompleteExpression("2 3 DIV").eval(dtype="float32") == 2 / 3
+        result = CompleteExpression("y SUM SIN").eval(environment, dtype="float32")
+        assert result.dtype == np.float32
+
+    def test_eval_dtype_invalid(self):
+        expression = CompleteExpression("1 2 ADD")
+        for dtype in ("float16", np.int32, "single_precision", object()):
+            with pytest.raises(ValueError):
+                expression.eval(dtype=dtype)
+        with ThreadPoolExecutor(1) as executor:
+            with pytest.raises(ValueError):
+                expression.eval(executor=executor, dtype="float32")
+
+    def test_eval_dtype_accuracy(self):
+        # The result of each operator in single precision must be within a few
+        # units in the last place (a relative error of 1e-6) of the result in
+        # double precision, for the same single precision arguments.
+        rng = np.random.default_rng(0)
+        environment = {
+            "x": rng.uniform(0.1, 0.9, 1000).astype(np.float32),
+            "y": rng.uniform(0.2, 0.6, 1000).astype(np.float32),
+            "z": rng.uniform(1.5, 1.9, 1000).astype(np.float32),
+            "i": rng.integers(0, 100, 1000).astype(np.int16),
+            "j": rng.integers(0, 8, 1000).astype(np.int16),
+        }
+        for name, operator in _KEYWORDS.items():
+            if not isinstance(operator, Operator):
+                continue
+            if name in ("IAND", "IOR", "BTEST"):
+                args = "i j"
+            elif name in ("BOXCAR", "GAUSS"):
+                args = "x 0 3"
+            elif name == "ACOSH":
+                args = "z"
+            else:
+                args = " ".join(["x", "y", "z"][: operator.pops])
+            string = f"{args} {name}" + " POP" * (operator.puts - 1)
+            if operator.puts == 0:
+                string = "x " + string
+            expression = CompleteExpression(string)
+            expected = expression.eval(environment, dtype="float64")
+            result = expression.eval(environment, dtype="float32")
+            if operator.info.dtype in (
+                DTypeRule.FLOAT,
+                DTypeRule.PROMOTE,
+                DTypeRule.FIRST,
+            ):
+                assert np.result_type(result) == np.float32, name
+            else:
+                assert np.result_type(result) == np.result_type(expected), name
+            np.testing.assert_allclose(result, expected, rtol=1e-6, err_msg=name)
+
+    def test_eval_inplace(self):
+        rng = np.random.default_rng(0)
+        environment = {
+            "x": rng.uniform(0.1, 0.9, 100),
+            "y": rng.uniform(0.2, 0.6, 100),
+            "z": rng.uniform(1.5, 1.9, 100),
+            "i": rng.integers(0, 100, 100),
+            "j": rng.integers(0, 8, 100),
+        }
+        copies = {k: v.copy() for k, v in environment.items()}
+        # intermediate results as arguments, so they can be overwritten
+        temporaries = ["x 0.5 MUL", "y 2 MUL", "z 1 ADD"]
+        for name, operator in _KEYWORDS.items():
+            if not isinstance(operator, Operator):
+                continue
+            if name in ("IAND", "IOR", "BTEST"):
+                args = "i 1 ADD j"
+            elif name in ("BOXCAR", "GAUSS"):
+                args = "x 1 ADD 0 3"
+            elif name == "ACOSH":
+                args = "z 1 ADD"
+            else:
+                args = " ".join(temporaries[: operator.pops])
+            string = f"{args} {name}" + " POP" * (operator.puts - 1)
+            if operator.puts == 0:
+                string = "x 1 ADD " + string
+            for string_ in (string, f"x {string} ADD", f"{string} DUP SQR EXCH SUB"):
+                expression = CompleteExpression(string_)
+                expected = expression.eval(environment)
+                result = expression.eval(environment, inplace=True)
+                assert np.result_type(result) == np.result_type(expected), string_
+                np.testing.assert_equal(result, expected, err_msg=string_)
+                for key, value in copies.items():
+                    np.testing.assert_equal(environment[key], value, err_msg=string_)
+
+    def test_eval_inplace_dtype(self):
+        environment = {"x": np.linspace(0, 1, 100), "i": np.arange(100)}
+        expression = CompleteExpression("x 2 MUL i ADD SQRT i 3 MUL 1 ADD DIV")
+        expected = expression.eval(environment, dtype="float32")
+        result = expression.eval(environment, dtype="float32", inplace=True)
+        assert result.dtype == np.float32
+        np.testing.assert_equal(result, expected)
+        with ThreadPoolExecutor(1) as executor:
+            with pytest.raises(ValueError):
+                expression.eval(environment, executor=executor, inplace=True)
+
+    def test_eval_inplace_memory(self):
+        environment = {"x": np.linspace(0, 1, 100000)}
+        expression = CompleteExpression("x 2 MUL 1 ADD SQRT 3 MUL x DUP MUL SUB NEG")
+        tracemalloc.start()
+        try:
+            expression.eval(environment)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.reset_peak()
+            expression.eval(environment, inplace=True)
+            inplace_peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        # at most two intermediate arrays at the same time
+        assert inplace_peak < 2.5 * environment["x"].nbytes < peak
+
+    def test_eval_dask(self):
+        da = pytest.importorskip("dask.array")
+        rng = np.random.default_rng(0)
+        environment = {
+            "x": rng.uniform(0.1, 0.9, 1000),
+            "y": rng.uniform(0.2, 0.6, 1000),
+            "z": rng.uniform(1.5, 1.9, 1000),
+            "i": rng.integers(0, 100, 1000),
+            "j": rng.integers(0, 8, 1000),
+        }
+        environment["x"][[0, 129, 130, 500]] = np.nan
+        lazy = {k: da.from_array(v, chunks=130) for k, v in environment.items()}
+        for name, operator in _KEYWORDS.items():
+            if not isinstance(operator, Operator):
+                continue
+            if name in ("IAND", "IOR", "BTEST"):
+                args = "i j"
+            elif name in ("BOXCAR", "GAUSS"):
+                args = "x 0 3"
+            elif name == "ACOSH":
+                args = "z"
+            else:
+                args = " ".join(["x", "y", "z"][: operator.pops])
+            string = f"{args} {name}" + " POP" * (operator.puts - 1)
+            if operator.puts == 0:
+                string = "x " + string
+            expression = CompleteExpression(string)
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                expected = expression.eval(environment)
+                result = expression.eval(lazy)
+                assert isinstance(result, da.Array), name
+                assert result.dtype == np.result_type(expected), name
+                np.testing.assert_allclose(result.compute(), expected, err_msg=name)
+
+    def test_eval_dask_is_lazy(self):
+        dask = pytest.importorskip("dask")
+        da = pytest.importorskip("dask.array")
+        rng = np.random.default_rng(0)
+        environment = {
+            "x": rng.uniform(size=(500, 40)),
+            "t": np.arange(20000.0).reshape(500, 40),
+            "w": rng.uniform(size=40),
+        }
+        lazy = {
+            "x": da.from_array(environment["x"], chunks=(64, 7)),
+            "t": da.from_array(environment["t"], chunks=(100, 40)),
+            "w": environment["w"],
+        }
+
+        def compute(*args, **kwargs):
+            raise AssertionError("dask array computed during evaluation")
+
+        for string in (
+            "x 0 3 BOXCAR",
+            "x 1 5 BOXCAR",
+            "x 0 2 GAUSS 1 2 GAUSS SUM",
+            "x DIF",
+            "x t DXDY SUM x DIF SUM ADD",
+            "x w MUL 2 ADD t SUM DIV",
+            "x w DXDY",
+        ):
+            expression = CompleteExpression(string)
+            with dask.config.set(scheduler=compute):
+                result = expression.eval(lazy)
+            np.testing.assert_allclose(
+                result.compute(), expression.eval(environment), err_msg=string
+            )
+        result = CompleteExpression("x 2 MUL SQRT").eval(lazy, dtype="float32")
+        assert result.dtype == np.float32
+
+    def test_eval_dask_missing_variable(self, mocker):
+        pytest.importorskip("dask.array")
+        mocker.patch("rads.rpn._CONCURRENT_MIN_SIZE", 1)
+        expression = CompleteExpression("y POP x")
+        with pytest.raises(KeyError):
+            expression.eval({"x": 1})
+        with ThreadPoolExecutor(2) as executor:
+            with pytest.raises(KeyError):
+                expression.eval({"x": 1}, executor=executor)
+
+    @pytest.mark.parametrize(
+        "string",
+        [
+            "x x SUM DIV",
+            "x SUM x AND",
+            "x x SUM AND",
+            "x SUM x OR",
+            "x SUM x ISNAN AND",
+            "x SUM x NAN",
+            "x SUM x SUM ADD",
+            "x 0 3 BOXCAR x SUM SUB",
+        ],
+    )
+    def test_eval_dask_reduction_argument(self, string):
+        da = pytest.importorskip("dask.array")
+        x = np.arange(20)
+        expression = CompleteExpression(string)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            expected = expression.eval({"x": x})
+            result = expression.eval({"x": da.from_array(x, chunks=5)})
+            assert isinstance(result, da.Array)
+            computed = result.compute()
+        assert isinstance(computed, (np.ndarray, np.generic))
+        assert computed.dtype == np.result_type(expected)
+        np.testing.assert_array_equal(computed, expected)
+
+
+class _SPLITType(Operator):
+    """Operator with multiple outputs, for testing only."""
+
+    @property
+    def pops(self) -> int:
+        return 1
+
+    @property
+    def puts(self) -> int:
+        return 2
+
+    def __call__(
+        self,
+        stack: MutableSequence[FloatOrArray],
+        environment: Mapping[str, FloatOrArray],
+    ) -> None:
+        x = stack.pop()
+        stack.extend([x - 1, x + 1])
+
+
+SPLIT = _SPLITType("SPLIT")
+
+
+class _SCALEType(Operator):
+    """Operator using the environment, for testing only."""
+
+    @property
+    def pops(self) -> int:
+        return 1
+
+    @property
+    def puts(self) -> int:
+        return 1
+
+    def __call__(
+        self,
+        stack: MutableSequence[FloatOrArray],
+        environment: Mapping[str, FloatOrArray],
+    ) -> None:
+        stack.append(stack.pop() * environment["scale"])
+
+
+SCALE = _SCALEType("SCALE")
+
+
+def random_expression(rng: random.Random, size: int) -> CompleteExpression:
+    unary = [NEG, ABS, SIN, COS, SQR, SIND, FLOOR, CEIL, D2R, R2D]
+    binary = [ADD, SUB, MUL, MIN, MAX, HYPOT]
+    tokens = []
+    depth = 0
+    for _ in range(size):
+        choice = rng.random()
+        if depth < 1 or choice < 0.3:
+            tokens.append(rng.choice([Variable("x"), Variable("y"), Literal(2)]))
+            depth += 1
+        elif choice < 0.5:
+            tokens.append(rng.choice(unary))
+        elif choice < 0.6:
+            tokens.append(DUP)
+            depth += 1
+        elif depth < 2:
+            continue
+        elif choice < 0.8:
+            tokens.append(rng.choice(binary))
+            depth -= 1
+        else:
+            tokens.append(rng.choice([EXCH, POP]))
+            depth -= tokens[-1] is POP
+    tokens.extend([ADD] * (depth - 1))
+    return CompleteExpression(tokens)
+
+
+class TestExpressionGraph:
+    def test_init(self):
+        graph = ExpressionGraph(Expression("x SIN y x SIN ADD"))
+        x, y = Variable("x"), Variable("y")
+        assert [n.token for n in graph.nodes] == [x, SIN, y, ADD]
+        assert graph.outputs == [graph.nodes[1], graph.nodes[3]]
+        assert graph.nodes[3].args == (graph.nodes[2], graph.nodes[1])
+        assert graph.inputs == 0
+
+    def test_init_with_expressions(self):
+        graph = ExpressionGraph([Expression("x SIN"), Expression("x SIN 2 MUL")])
+        assert len(graph.nodes) == 4
+        assert graph.outputs == [graph.nodes[1], graph.nodes[3]]
+
+    def test_graph(self):
+        graph = Expression("x SIN y x SIN ADD").graph()
+        assert isinstance(graph, ExpressionGraph)
+        assert len(graph.nodes) == 4
+
+    def test_stack_operators(self):
+        graph = Expression("x DUP y EXCH POP MUL 1 POP").graph()
+        x, y, mul, one = graph.nodes
+        assert mul.token is MUL
+        assert mul.args == (x, y)
+        assert one.token == Literal(1)
+        assert graph.outputs == [mul]
+
+    def test_literals(self):
+        graph = Expression("1 1 1.0 -0.0 0.0").graph()
+        assert [n.token.value for n in graph.outputs] == [1, 1, 1.0, -0.0, 0.0]
+        assert len(graph.nodes) == 4
+
+    def test_inputs(self):
+        graph = Expression("ADD SIN").graph()
+        assert graph.inputs == 2
+        first, second, add, _ = graph.nodes
+        assert first.token is None
+        assert first.index == 1
+        assert second.token is None
+        assert second.index == 0
+        assert add.args == (first, second)
+        with pytest.raises(ValueError):
+            graph.eval()
+        with pytest.raises(ValueError):
+            graph.expression()
+
+    def test_uses(self):
+        graph = Expression("x SIN DUP DUP MUL ADD").graph()
+        x, sin, mul, add = graph.nodes
+        assert graph.uses() == {x: 1, sin: 3, mul: 1, add: 1}
+        assert graph.uses([mul]) == {x: 1, sin: 2, mul: 1}
+
+    def test_order(self):
+        graph = ExpressionGraph([Expression("x SIN"), Expression("y COS")])
+        x, sin, y, cos = graph.nodes
+        assert graph.order() == [x, sin, y, cos]
+        assert graph.order([cos]) == [y, cos]
+
+    def test_eval(self):
+        graph = ExpressionGraph([Expression("x SIN"), Expression("y 2 MUL")])
+        assert graph.eval({"x": 0, "y": 3}) == [0.0, 6]
+        assert graph.eval({"y": 3}, graph.outputs[1:]) == [6]
+        with pytest.raises(KeyError):
+            graph.eval({"y": 3})
+
+    def test_eval_computes_once(self, mocker):
+        graph = Expression("x SIN x SIN ADD").graph()
+        spy = mocker.spy(_SINType, "__call__")
+        assert graph.eval({"x": 0}) == [0.0]
+        assert spy.call_count == 1
+
+    def test_eval_multiple_outputs(self):
+        x = Variable("x")
+        graph = Expression([x, SPLIT, EXCH, POP, x, SPLIT, POP, MUL]).graph()
+        assert graph.eval({"x": 3}) == [8]
+
+    def test_expression(self):
+        graph = Expression("lat SIND SQR lat SIND ADD").graph()
+        assert graph.expression() == CompleteExpression("lat SIND DUP SQR EXCH ADD")
+        graph = Expression("x y SIN MUL x y SIN MUL SUB").graph()
+        assert graph.expression() == CompleteExpression("x y SIN MUL DUP SUB")
+        graph = Expression("x SIN DUP y ADD EXCH MUL").graph()
+        assert graph.expression() == CompleteExpression("x SIN DUP y ADD EXCH MUL")
+        x = Variable("x")
+        graph = Expression([x, SPLIT, EXCH, POP, x, SPLIT, POP, MUL]).graph()
+        assert graph.expression() == CompleteExpression(
+            [x, SPLIT, EXCH, POP, x, SPLIT, POP, MUL]
+        )
+        graph = ExpressionGraph([Expression("x SIN"), Expression("y")])
+        assert graph.expression() == Expression("x SIN y")
+        assert graph.expression(graph.outputs[:1]) == CompleteExpression("x SIN")
+
+    def test_expression_too_large(self):
+        graph = Expression("x" + " DUP ADD" * 100).graph()
+        assert len(graph.nodes) == 101
+        with pytest.raises(ValueError):
+            graph.expression()
+
+    def test_random_expressions(self):
+        rng = random.Random(0)
+        environment = {
+            "x": np.array([0.1, -0.2, np.nan, 0.5, 3.0]),
+            "y": np.array([1.5, 0.3, 0.4, -0.5, 0.6]),
+        }
+        original = deepcopy(environment)
+        for _ in range(200):
+            expression = random_expression(rng, rng.randint(1, 30))
+            expected = expression.eval(environment)
+            graph = expression.graph()
+            np.testing.assert_equal(graph.eval(environment), [expected])
+            optimized = graph.expression()
+            np.testing.assert_equal(optimized.eval(environment), expected)
+            np.testing.assert_equal(expression.compile()(environment), expected)
+        np.testing.assert_equal(environment, original)
+
+    def test_eval_executor(self, mocker):
+        mocker.patch("rads.rpn._CONCURRENT_MIN_SIZE", 1)
+        rng = random.Random(0)
+        environment = {
+            "x": np.array([0.1, -0.2, np.nan, 0.5, 3.0]),
+            "y": np.array([1.5, 0.3, 0.4, -0.5, 0.6]),
+        }
+        x = Variable("x")
+        graph = ExpressionGraph(
+            [Expression([x, SPLIT, EXCH, POP, x, SPLIT, POP, MUL])]
+            + [random_expression(rng, rng.randint(1, 30)) for _ in range(100)]
+        )
+        with ThreadPoolExecutor(4) as executor:
+            np.testing.assert_equal(
+                graph.eval(environment, executor=executor), graph.eval(environment)
+            )
+
+    def test_compile_computes_once(self, mocker):
+        x = Variable("x")
+        expression = CompleteExpression([x, SPLIT, EXCH, POP, x, SPLIT, POP, MUL])
+        spy = mocker.spy(_SPLITType, "__call__")
+        assert expression.compile()({"x": 3}) == 8
+        assert spy.call_count == 1
+
+    def test_environment_of_operators(self, mocker):
+        mocker.patch("rads.rpn._CONCURRENT_MIN_SIZE", 1)
+        environment = {"x": np.arange(5.0), "scale": 2}
+        expression = CompleteExpression([Variable("x"), SCALE, Literal(1), ADD])
+        expected = np.arange(5.0) * 2 + 1
+        np.testing.assert_equal(expression.eval(environment), expected)
+        np.testing.assert_equal(expression.compile()(environment), expected)
+        np.testing.assert_equal(expression.eval_numexpr(environment), expected)
+        np.testing.assert_equal(
+            evaluate_many([expression], environment)[str(expression)], expected
+        )
+        with ThreadPoolExecutor(2) as executor:
+            np.testing.assert_equal(
+                expression.eval(environment, executor=executor), expected
+            )
+
+    def test_discarded(self):
+        graph = ExpressionGraph(Expression("x SIN POP y x SIN 1 POP ADD y POP"))
+        x_sin, y = graph.nodes[1], graph.nodes[2]
+        assert graph.discarded == [x_sin, y]
+        assert graph.uses() == {graph.nodes[0]: 1, x_sin: 1, y: 1, graph.nodes[4]: 1}
+        graph = ExpressionGraph(Expression("y POP 1 x 0 DIV POP"))
+        assert graph.uses()[graph.nodes[0]] == 0
+        assert graph.expression() == CompleteExpression("y POP x 0 DIV POP 1")
+
+    def test_discarded_computes_once(self, mocker):
+        x = Variable("x")
+        expression = CompleteExpression([x, SPLIT, POP, x, SPLIT, EXCH, POP, MUL])
+        spy = mocker.spy(_SPLITType, "__call__")
+        assert expression.compile()({"x": 3}) == 8
+        assert spy.call_count == 1
+
+    @pytest.mark.parametrize(
+        "string,error",
+        [
+            ("0 0 DIV POP 1", ZeroDivisionError),
+            ("2 -1 POW POP 1", ValueError),
+            ("x -1 POW POP 1", ValueError),
+            ("y POP 1", KeyError),
+            ("x y POP 2 MUL", KeyError),
+            ("x SIN y ADD POP x", KeyError),
+        ],
+    )
+    def test_popped_values_are_computed(self, mocker, string, error):
+        mocker.patch("rads.rpn._CONCURRENT_MIN_SIZE", 1)
+        environment = {"x": np.arange(1, 4)}
+        expression = CompleteExpression(string)
+        with pytest.raises(error):
+            expression.eval(environment)
+        with pytest.raises(error):
+            expression.eval(environment, inplace=True)
+        with pytest.raises(error):
+            expression.graph().eval(environment)
+        with pytest.raises(error):
+            expression.compile()(environment)
+        with pytest.raises(error):
+            expression.optimize().eval(environment)
+        with pytest.raises(error):
+            expression.eval_numexpr(environment)
+        with pytest.raises(error):
+            evaluate_many([expression], environment)
+        with ThreadPoolExecutor(2) as executor:
+            with pytest.raises(error):
+                expression.eval(environment, executor=executor)
+
+
+class TestOperatorInfo:
+    def test_all_operators(self):
+        for operator in _KEYWORDS.values():
+            if isinstance(operator, Operator):
+                assert isinstance(operator.info, OperatorInfo)
+                assert operator.info.kind is not OperatorKind.OTHER
+
+    def test_unknown_operator(self):
+        assert SPLIT.info.kind is OperatorKind.OTHER
+        assert SPLIT.info.dtype is DTypeRule.OTHER
+        assert SPLIT.info.nan is NaNRule.OTHER
+        assert SPLIT.halo(None) is None
+
+    def test_kind(self):
+        assert ADD.info.kind is OperatorKind.ELEMENTWISE
+        assert DUP.info.kind is OperatorKind.STACK
+        assert DIF.info.kind is OperatorKind.STENCIL
+        assert BOXCAR.info.kind is OperatorKind.STENCIL
+        assert SUM.info.kind is OperatorKind.REDUCTION
+        assert SUM.info.combine([1, 2, 3]) == 6
+
+    def test_halo(self):
+        assert ADD.halo(None, None) == (0, 0)
+        assert DIF.halo(None) == (1, 0)
+        assert DXDY.halo(None, None) == (1, 1)
+        assert SUM.halo(None) is None
+        assert BOXCAR.halo(None, 0, 5) == (2, 2)
+        assert BOXCAR.halo(None, 1, 5) == (0, 0)
+        assert BOXCAR.halo(None, None, 5) is None
+        assert BOXCAR.halo(None, 0, None) is None
+        assert GAUSS.halo(None, 0, 1) == (4, 4)
+
+    def test_commutative(self):
+        x = np.array([1.0, np.nan, 3.0, 4.0])
+        y = np.array([2.0, 5.0, np.nan, 4.0])
+        for name, operator in _KEYWORDS.items():
+            if isinstance(operator, Operator) and operator.info.commutative:
+                if name in ("IAND", "IOR"):
+                    a, b = np.array([1, 2, 3]), np.array([3, 4, 5])
+                else:
+                    a, b = x, y
+                np.testing.assert_equal(
+                    _apply(operator, a, b), _apply(operator, b, a)
+                )
+
+    def test_dtype(self):
+        x = np.array([0.1, np.nan, 0.3])
+        i = np.array([1, 2, 3])
+        for name, operator in _elementwise_operators():
+            info = operator.info
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                int_result = _apply(operator, *([i] * operator.pops))
+                if info.nan is not NaNRule.INVALID and info.dtype in (
+                    DTypeRule.FLOAT,
+                    DTypeRule.BOOL,
+                ):
+                    result = _apply(operator, *([x] * operator.pops))
+                    assert result.dtype == int_result.dtype, name
+            if info.dtype is DTypeRule.FLOAT:
+                assert int_result.dtype.kind == "f", name
+            elif info.dtype is DTypeRule.DOUBLE:
+                assert int_result.dtype == np.float64, name
+            elif info.dtype is DTypeRule.BOOL:
+                assert int_result.dtype.kind == "b", name
+            elif info.dtype is DTypeRule.FIRST:
+                assert _apply(operator, i, x).dtype == i.dtype, name
+                assert _apply(operator, x, i).dtype == x.dtype, name
+            else:
+                assert int_result.dtype.kind == "i", name
+
+    def test_nan(self):
+        x = np.array([0.1, np.nan, 0.3])
+        y = np.array([0.2, 0.4, 0.5])
+        for name, operator in _elementwise_operators():
+            if operator.info.nan is NaNRule.INVALID:
+                continue
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                result = _apply(operator, x, *([y] * (operator.pops - 1)))
+            if operator.info.nan is NaNRule.PROPAGATE:
+                assert np.isnan(result[1]), name
+            elif operator.info.nan in (NaNRule.COMPARE, NaNRule.DETECT):
+                assert result.dtype.kind == "b", name
+            elif operator.info.nan is NaNRule.SKIP:
+                assert not np.isnan(result[1]), name
+
+
+def _elementwise_operators() -> Iterator[Tuple[str, Operator]]:
+    for name, operator in _KEYWORDS.items():
+        if (
+            isinstance(operator, Operator)
+            and operator.info.kind is OperatorKind.ELEMENTWISE
+        ):
+            yield name, operator
+
+
+def _apply(operator: Token, *args: FloatOrArray) -> FloatOrArray:
+    stack = list(args)
+    operator(stack, {})
+    assert len(stack) == 1
+    return stack[0]
+
+
+class TestParallelEvaluator:
+    def test_map(self):
+        expressions = {
+            "a": CompleteExpression("x y ADD"),
+            "b": CompleteExpression("x SUM"),
+            "c": CompleteExpression("x 0 3 BOXCAR"),
+        }
+        environments = [
+            {"x": np.arange(10.0) + i, "y": np.arange(10, dtype=np.int32)}
+            for i in range(5)
+        ]
+        with ParallelEvaluator(expressions, max_workers=2) as evaluator:
+            results = list(evaluator.map(environments))
+        assert len(results) == 5
+        for result, environment in zip(results, environments):
+            assert list(result) == ["a", "b", "c"]
+            for key, expression in expressions.items():
+                expected = expression.eval(environment)
+                np.testing.assert_equal(result[key], expected)
+                assert np.result_type(result[key]) == np.result_type(expected)
+
+    def test_evaluate(self):
+        expressions = [CompleteExpression("x 2 MUL"), CompleteExpression("1")]
+        with ParallelEvaluator(expressions, max_workers=1) as evaluator:
+            result = evaluator.evaluate({"x": np.array([[1, 2], [3, 4]])})
+            assert list(result) == ["x 2 MUL", "1"]
+            np.testing.assert_equal(result["x 2 MUL"], [[2, 4], [6, 8]])
+            assert result["1"] == 1
+            # empty arrays and scalars
+            result = evaluator.evaluate({"x": np.array([])})
+            np.testing.assert_equal(result["x 2 MUL"], [])
+            assert evaluator.evaluate({"x": 3})["x 2 MUL"] == 6
+
+    def test_errors(self):
+        expressions = [CompleteExpression("x"), CompleteExpression("y")]
+        with ParallelEvaluator(expressions, max_workers=1) as evaluator:
+            with pytest.raises(KeyError):
+                evaluator.evaluate({"x": np.arange(10.0)})
+        with pytest.raises(ValueError):
+            ParallelEvaluator([Expression("x ADD")])
+
+    def test_unused_results(self):
+        expressions = [CompleteExpression("x 1 ADD")]
+        environments = [{"x": np.arange(10.0)}] * 4
+        with ParallelEvaluator(expressions, max_workers=1) as evaluator:
+            results = evaluator.map(environments)
+            np.testing.assert_equal(next(results)["x 1 ADD"], np.arange(1.0, 11.0))
+            results.close()
+
+    @pytest.mark.skipif(
+        shared_memory is None or not os.path.isdir("/dev/shm"),
+        reason="requires shared memory in /dev/shm",
+    )
+    def test_results_never_used(self):
+        expressions = [CompleteExpression("x 1 ADD")]
+        environments = [{"x": np.arange(10.0)}] * 4
+        before = set(os.listdir("/dev/shm"))
+        with ParallelEvaluator(expressions, max_workers=1) as evaluator:
+            results = evaluator.map(environments)
+            del results
+            gc.collect()
+        assert set(os.listdir("/dev/shm")) <= before
+
+    @pytest.mark.skipif(shared_memory is None, reason="requires shared memory")
+    def test_share(self):
+        array = np.arange(6, dtype=np.float32).reshape(2, 3)
+        shared = _share(array)
+        assert isinstance(shared, _SharedArray)
+        result = _unshare(shared)
+        np.testing.assert_equal(result, array)
+        assert result.dtype == array.dtype
+        del result
+        gc.collect()
+        with pytest.raises(FileNotFoundError):
+            _unshare(shared)
+        assert _unshare(_share(array), keep=False) is None
+        assert _share(1.5) == 1.5
+        assert _unshare(1.5) == 1.5
+        objects = np.array([None, 1])
+        assert _share(objects) is objects
+
+    @pytest.mark.skipif(shared_memory is None, reason="requires shared memory")
+    def test_unshare_is_not_copied(self):
+        shared = _share(np.arange(6.0))
+        result = _unshare(shared)
+        view = result[2:].reshape(2, 2)
+        # backed by the shared memory
+        memory = shared_memory.SharedMemory(name=shared.name)
+        try:
+            np.ndarray((6,), np.float64, buffer=memory.buf)[3] = -1.0
+        finally:
+            memory.close()
+        assert result[3] == -1.0
+        # released once the array and its views are garbage collected
+        del result
+        gc.collect()
+        assert view[0, 1] == -1.0
+        del view
+        gc.collect()
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=shared.name)
+
+
+class TestProfiler:
+    def test_eval(self):
+        environment = {"x": np.arange(10.0), "y": np.arange(10)}
+        expression = CompleteExpression("x y ADD DUP MUL 2 MUL")
+        with Profiler() as profiler:
+            result = expression.eval(environment)
+            expression.eval(environment)
+            CompleteExpression("1 2 ADD").eval()
+        np.testing.assert_equal(result, (np.arange(10.0) * 2) ** 2 * 2)
+        assert set(profiler.operators) == {"ADD", "DUP", "MUL"}
+        add = profiler.operators["ADD"]
+        assert add.calls == 3
+        assert add.time > 0
+        assert add.input_size == 2 * 20 + 2
+        assert add.output_size == 2 * 10 + 1
+        assert add.allocated == 2 * 80
+        assert add.dtypes == {"float64,int64->float64", "int,int->int"}
+        dup = profiler.operators["DUP"]
+        assert dup.allocated == 0
+        assert dup.dtypes == {"float64->float64,float64"}
+        stats = profiler.expressions["x y ADD DUP MUL 2 MUL"]
+        assert stats.calls == 2
+        assert stats.input_size == 2 * 20
+        assert stats.output_size == 2 * 10
+        assert stats.allocated == 2 * 3 * 80
+        assert stats.dtypes == {"float64,int64->float64"}
+        assert stats.time >= dup.time
+        stats = profiler.expressions["1 2 ADD"]
+        assert stats.calls == 1
+        assert (stats.input_size, stats.output_size, stats.allocated) == (0, 1, 0)
+        assert stats.dtypes == {"->int"}
+
+    def test_disabled(self, mocker):
+        spy = mocker.spy(Profiler, "_eval")
+        expression = CompleteExpression("x 1 ADD")
+        with Profiler() as profiler:
+            pass
+        expression.eval({"x": 1})
+        assert spy.call_count == 0
+        assert profiler.expressions == {}
+        assert profiler.operators == {}
+
+    def test_nested(self):
+        with Profiler() as outer:
+            CompleteExpression("1 2 ADD").eval()
+            with Profiler() as inner:
+                CompleteExpression("1 2 SUB").eval()
+            CompleteExpression("1 2 MUL").eval()
+        assert set(outer.operators) == {"ADD", "MUL"}
+        assert set(inner.operators) == {"SUB"}
+
+    def test_exit_out_of_order(self):
+        first = Profiler().__enter__()
+        second = Profiler().__enter__()
+        first.__exit__(None, None, None)  # such as from another thread
+        CompleteExpression("1 2 ADD").eval()
+        second.__exit__(None, None, None)
+        CompleteExpression("1 2 SUB").eval()
+        assert first.operators == {}
+        assert set(second.operators) == {"ADD"}
+
+    def test_threads(self):
+        expression = CompleteExpression("x 1 ADD")
+
+        def evaluate(_):
+            for _ in range(200):
+                expression.eval({"x": np.arange(3)})
+
+        with Profiler() as profiler:
+            with ThreadPoolExecutor(8) as executor:
+                list(executor.map(evaluate, range(8)))
+        assert profiler.operators["ADD"].calls == 8 * 200
+        assert profiler.expressions["x 1 ADD"].calls == 8 * 200
+        assert profiler.expressions["x 1 ADD"].input_size == 8 * 200 * 3
+
+    def test_report(self):
+        with Profiler() as profiler:
+            CompleteExpression("x SIN x 0 3 BOXCAR ADD").eval({"x": np.arange(10.0)})
+        lines = profiler.report().splitlines()
+        assert lines[0].split() == [
+            "operator",
+            "calls",
+            "time",
+            "[ms]",
+            "input",
+            "output",
+            "allocated",
+            "dtypes",
+        ]
+        assert len(lines) == 1 + 3 + 1 + 1 + 1
+        assert lines[5].startswith("expression")
+        assert lines[6].startswith("x SIN x 0 3 BOXCAR ADD ")
+        assert len(profiler.report(limit=1).splitlines()) == 1 + 1 + 1 + 1 + 1
+        profiler.clear()
+        assert profiler.expressions == {}
+        assert profiler.operators == {}